@@ -7,7 +7,7 @@ from collections import namedtuple
 import gomill
 from gomill import boards, sgf, sgf_moves, ascii_boards
 
-import utils
+import analyze_board_np
 
 NBCOORD_DIAG = tuple(product((1, -1), (1, -1)))
 NBCOORD = ((-1,0), (1,0), (0,1), (0,-1))
@@ -89,42 +89,26 @@ def board2string_lib(board):
 
     return StringLib(visited, liberties, lib_nb_cnt)
 
+def state2string_lib(state):
+    """
+    Returns StringLib of the state's board, reuses the state.string_lib
+    if present.
+    """
+    if state.string_lib is not None:
+        return state.string_lib
+    return board2string_lib(state.board)
+
 def board2dist_from_stones(board, player, maxdepth=4):
     """
     For each point, compute distance to the closest B or W stone.
+    Points further than maxdepth get distance 2*board.side.
+
+    See analyze_board_np.dist_from_stones.
+
+    :returns: dist_friend, dist_enemy
     """
-    # max L1 distance on goban is between (0,0) and (18,18) which is 36
-    # so 2*19 is good inf
-    inf = board.side * 2
-
-    def bfs(a, fringe, depth=0):
-        if depth > maxdepth:
-            return a
-
-        f = set()
-        for pt in fringe:
-            a[pt] = depth
-            for nb in iter_nbhs(board, pt):
-                if a[nb] == inf and nb not in fringe:
-                    f.add(nb)
-        if f:
-            bfs(a, f, depth+1)
-        return a
-
-    # fringes
-    us, them = set(), set()
-
-    for color, pt in board.list_occupied_points():
-        if color == player:
-            us.add(pt)
-        else:
-            them.add(pt)
-
-    def gd(fringe):
-        d = np.full((board.side, board.side), inf, dtype='uint8')
-        return bfs(d, fringe)
-
-    return gd(us), gd(them)
+    return analyze_board_np.dist_from_stones(analyze_board_np.board2array(board),
+                                             player, maxdepth)
 
 def analyze_nbhood(board, player, string_lib):
     """
@@ -232,46 +216,6 @@ def board2correct_move_mask(board, player):
     nb_info = analyze_nbhood(board, player, string_lib)
     return correct_moves_mask(board, player, string_lib, nb_info)
 
-def construct_closeset(boardsize, depth):
-    """
-    Ugly & slow, only run once
-    """
-    ret = []
-    for row in xrange(boardsize):
-        ret.append([])
-        for col in xrange(boardsize):
-            # l1 distance
-            cand=[]
-            for x, y in product(xrange(row-depth, row+depth +1),
-                                xrange(col-depth, col+depth +1)):
-                if 0 <= x < boardsize and 0 <= y < boardsize:
-                    l1 = utils.l1_distance((row, col), (x,y))
-                    if 0 <= l1 <= depth:
-                        cand.append((l1,x,y))
-            # s.t. neigbors are ordered by the distance
-            cand.sort()
-            ret[-1].append((np.array([c[0] for c in cand]),
-                            np.array([c[1] for c in cand]),
-                            np.array([c[2] for c in cand])))
-
-    return ret
-
-def npclose(a, empty, closeset, verbose=False):
-    inf = a.shape[0] * 2
-    ret = np.full(a.shape, inf)
-    it = np.nditer(empty, flags=['multi_index'])
-    while not it.finished:
-        x,y = it.multi_index
-
-        dist,xs,ys = closeset[x][y]
-        arg = a[xs,ys].argmax()
-        if a[xs[arg],ys[arg]]:
-            ret[x][y] = dist[arg]
-
-        it.iternext()
-
-    return ret
-
 def lib_nbs_to_lib_count(board, liberties_nb_count):
     """
     returns array of number of empty intersection around empty intersection.
@@ -435,76 +379,6 @@ if __name__ == "__main__":
         print db < dw
         print dw < db
 
-    def time_bfs():
-        logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
-                            level=logging.DEBUG)
-        import time
-        with open("../test_sgf/test2.sgf", 'r') as fin:
-            game = gomill.sgf.Sgf_game.from_string(fin.read())
-
-        closeset = construct_closeset(19, 4)
-
-        for i in xrange(1):
-            board, movepairs = gomill.sgf_moves.get_setup_and_moves(game)
-
-            num = 0
-            for color, move in movepairs:
-                if move:
-                    num+=1
-                    row, col = move
-                    board.play(row, col, color)
-
-
-                    empty, friend, enemy = board2color_mask(board, 'w')
-                    cb = npclose(friend, empty, closeset)
-
-                    break
-                    cw = npclose(enemy, empty, closeset)
-
-                    continue
-                    db, dw = board2dist_from_stones(board, 'w', 4)
-
-                    r1 = (db < dw) != (cb < cw)
-                    r2 = (db > dw) != (cb > cw)
-
-                    if r1.any() or r2.any():
-                        print gomill.ascii_boards.render_board(board)
-                        print "dist us"
-                        print db
-                        print "dist them"
-                        print dw
-                        print "nclose us"
-                        print cb
-                        print "nclose them"
-                        print cw
-                        print num
-                        if r1.any():
-                            i = np.argmax(r1)
-                            i = np.unravel_index([i],db.shape)
-                            i = i[0][0],i[1][0]
-                            print "r1[%s] == True: %d < %d = %s, %d < %d = %s"%(i,
-                                                    db[i], dw[i], (db < dw)[i],
-                                                    cb[i], cw[i], (cb < cw)[i])
-                        if r2.any():
-                            i = np.argmax(r2)
-                            i = np.unravel_index([i],db.shape)
-                            i = i[0][0],i[1][0]
-                            print "r2[%s] == True: %d > %d = %s, %d > %d = %s"%(i,
-                                                    db[i], dw[i], (db > dw)[i],
-                                                    cb[i], cw[i], (cb > cw)[i])
-                        assert False
-
-    def run():
-        closeset = construct_closeset(19, 4)
-        empty, friend, enemy = board2color_mask(gomill.boards.Board(side=19), 'w')
-        for a in xrange(2000):
-            cb = npclose(friend, empty, closeset)
-
-    import cProfile
-    #cProfile.run("run()")
-#    cProfile.run("time_bfs()")
-
-    #time_bfs()
     #test_libdist()
     test_strings()
 
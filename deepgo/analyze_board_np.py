@@ -0,0 +1,187 @@
+import numpy as np
+
+from static_planes import cached
+
+"""
+Vectorized board analysis.
+
+Computes the same features as the analyze_board routines, but works on
+int8 board arrays of shape (side, side) (see board2array) using whole-array
+operations, instead of looping over the intersections in python.
+
+The neighbors of all the points are gathered at once using precomputed
+neighbor index table (see get_nbhs_index), the strings are found by iterative
+min-label propagation and the liberties are counted by bincount.
+"""
+
+EMPTY, BLACK, WHITE = 0, 1, -1
+# value of the off-board neighbors, neither empty point nor a stone
+OFFBOARD = 2
+
+COLOR2INT = {'b' : BLACK,
+             'w' : WHITE}
+
+def board2array(board):
+    """
+    :returns: int8 array of shape (side, side),
+              with BLACK, WHITE and EMPTY values
+
+    For array backed boards (see fast_board.Board), this is just a view of
+    the board's array, so it must not be modified.
+    """
+    if hasattr(board, 'array'):
+        return board.array.reshape((board.side, board.side))
+
+    a = np.zeros((board.side, board.side), dtype='int8')
+    for color, (row, col) in board.list_occupied_points():
+        a[row, col] = COLOR2INT[color]
+    return a
+
+@cached
+def get_nbhs_index(side):
+    """
+    :returns: array of shape (side*side, 4) of flat indices of the neighbors
+              of each point (ordered as analyze_board.NBCOORD), off-board
+              neighbors have index side*side (see nbhs)
+    """
+    size = side * side
+    index = np.full((side, side, 4), size, dtype='intp')
+    points = np.arange(size).reshape((side, side))
+    index[1:, :, 0] = points[:-1, :]    # (-1, 0)
+    index[:-1, :, 1] = points[1:, :]    # (1, 0)
+    index[:, :-1, 2] = points[:, 1:]    # (0, 1)
+    index[:, 1:, 3] = points[:, :-1]    # (0, -1)
+    return index.reshape((size, 4))
+
+def nbhs(a, fill):
+    """
+    :returns: array of shape (side*side, 4), the i-th row are values of
+              the neighbors of i-th point of the flattened `a`, `fill` is used
+              for off-board neighbors
+    """
+    return np.append(a.ravel(), fill)[get_nbhs_index(a.shape[0])]
+
+@cached
+def get_edges_count(side):
+    """
+    Number of edges the intersection lies on, see analyze_board.coord_count_edges
+    """
+    return (get_nbhs_index(side) == side * side).sum(axis=1).reshape((side, side))
+
+def color_mask(a, player):
+    """
+    :returns: empty, friend, enemy uint8 masks (same as analyze_board.board2color_mask)
+    """
+    p = COLOR2INT[player]
+    return ((a == EMPTY).astype('uint8'),
+            (a == p).astype('uint8'),
+            (a == -p).astype('uint8'))
+
+def string_labels(a):
+    """
+    Divides board into strings.
+
+    :returns: int32 array, where all the stones of a string share the same
+              label > 0, empty points have label 0
+    """
+    size = a.size
+    flat = a.ravel()
+    stones = np.nonzero(flat)[0]
+
+    # which neighbors of the stones belong to the same string
+    nbs_index = get_nbhs_index(a.shape[0])[stones]
+    same = np.append(flat, OFFBOARD)[nbs_index] == flat[stones, None]
+
+    # label = index of a stone of the string + 1
+    # labels[size] is for the off-board & the empty points
+    big = size + 1
+    labels = np.full(size + 1, big, dtype='int32')
+    current = labels[stones] = stones + 1
+
+    while True:
+        # take minimal label in the direct nbhood of the same string
+        nb_min = np.where(same, labels[nbs_index], big).min(axis=1)
+        labels[stones] = np.minimum(current, nb_min)
+        # pointer jumping, label points to a stone with (possibly) even smaller label
+        new = labels[labels[stones] - 1]
+
+        if np.array_equal(new, current):
+            break
+        current = labels[stones] = new
+
+    ret = np.zeros(size, dtype='int32')
+    ret[stones] = current
+    return ret.reshape(a.shape)
+
+def liberties_count(a, labels):
+    """
+    :returns: array with number of liberties of the string for each stone,
+              0 for empty points (same as analyze_board.liberties_count)
+    """
+    empty = a.ravel() == EMPTY
+
+    # labels of the strings neighboring the empty points
+    nb_labels = nbhs(labels, 0)[empty]
+    # one string counts once, even if it neighbors the liberty from more sides
+    nb_labels.sort(axis=1)
+    first = np.ones(nb_labels.shape, dtype='bool')
+    first[:, 1:] = nb_labels[:, 1:] != nb_labels[:, :-1]
+
+    counts = np.bincount(nb_labels[first & (nb_labels > 0)], minlength=a.size + 1)
+    counts[0] = 0
+    return np.array(counts[labels], dtype='float64')
+
+def lib_nbs_to_lib_count(a):
+    """
+    Counts liberties of liberties,
+    same as analyze_board.lib_nbs_to_lib_count.
+    """
+    nbs = nbhs(a, EMPTY)
+    stone_nbs = ((nbs == BLACK) | (nbs == WHITE)).sum(axis=1).reshape(a.shape)
+    empty = a == EMPTY
+    return np.array(5 - empty * stone_nbs - get_edges_count(a.shape[0]), dtype='uint8')
+
+def correct_moves_mask(a, player, lib_count):
+    """
+    Same as analyze_board.correct_moves_mask.
+
+    :param lib_count: liberties_count() of the board
+    """
+    p = COLOR2INT[player]
+    nbs = nbhs(a, OFFBOARD)
+    nb_libs = nbhs(lib_count, 0)
+
+    # has liberties in nbhood
+    valid = (nbs == EMPTY).any(axis=1)
+    # has friendly string in nbhood, who has different liberty than the move
+    valid |= ((nbs == p) & (nb_libs > 1)).any(axis=1)
+    # enemy string in the nbhood, which we capture
+    valid |= ((nbs == -p) & (nb_libs == 1)).any(axis=1)
+
+    return np.array(valid.reshape(a.shape) & (a == EMPTY), dtype='uint8')
+
+def dist_from_stones(a, player, maxdepth=4):
+    """
+    For each point, compute L1 distance to the closest friend and enemy stone,
+    by repeated dilation of the stone masks.
+    Points further than maxdepth get distance 2*side.
+
+    Same as analyze_board.board2dist_from_stones.
+
+    :returns: dist_friend, dist_enemy uint8 arrays
+    """
+    p = COLOR2INT[player]
+    # both colors at once
+    reached = np.array([a == p, a == -p])
+    dist = np.where(reached, 0, 2 * a.shape[0]).astype('uint8')
+
+    for depth in xrange(1, maxdepth + 1):
+        grown = reached.copy()
+        grown[:, 1:, :] |= reached[:, :-1, :]
+        grown[:, :-1, :] |= reached[:, 1:, :]
+        grown[:, :, 1:] |= reached[:, :, :-1]
+        grown[:, :, :-1] |= reached[:, :, 1:]
+        dist[grown & ~reached] = depth
+        reached = grown
+
+    return dist[0], dist[1]
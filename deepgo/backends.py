@@ -0,0 +1,102 @@
+import logging
+from collections import namedtuple
+
+import analyze_board
+import analyze_board_np
+
+"""
+Board analysis backends.
+
+The cubes (and players) do not call the board analysis routines directly, but
+through the currently selected backend, so that the pure python routines in
+analyze_board can be swapped for the vectorized ones in analyze_board_np.
+Both backends compute exactly the same features.
+
+All the backend functions take deepgo.state.State:
+    color_mask(state, player)           -> empty, friend, enemy uint8 masks
+    liberties_count(state)              -> liberties of the string for each stone
+    lib_nbs_to_lib_count(state)         -> liberties of liberties
+    correct_moves_mask(state, player)   -> uint8 mask of correct moves
+"""
+
+Backend = namedtuple('Backend', 'color_mask liberties_count lib_nbs_to_lib_count correct_moves_mask')
+
+# name -> Backend
+reg_backend = {}
+
+#
+# python
+#
+
+def _py_liberties_count(state):
+    return analyze_board.liberties_count(state.board, analyze_board.state2string_lib(state))
+
+def _py_lib_nbs_to_lib_count(state):
+    string_lib = analyze_board.state2string_lib(state)
+    return analyze_board.lib_nbs_to_lib_count(state.board, string_lib.liberties_nb_count)
+
+def _py_correct_moves_mask(state, player):
+    string_lib = analyze_board.state2string_lib(state)
+    nb_info = analyze_board.analyze_nbhood(state.board, player, string_lib)
+    return analyze_board.correct_moves_mask(state.board, player, string_lib, nb_info)
+
+reg_backend['python'] = Backend(
+    color_mask=lambda state, player: analyze_board.board2color_mask(state.board, player),
+    liberties_count=_py_liberties_count,
+    lib_nbs_to_lib_count=_py_lib_nbs_to_lib_count,
+    correct_moves_mask=_py_correct_moves_mask)
+
+#
+# numpy
+#
+
+def _np_liberties_count(state):
+    a = analyze_board_np.board2array(state.board)
+    return analyze_board_np.liberties_count(a, analyze_board_np.string_labels(a))
+
+def _np_correct_moves_mask(state, player):
+    a = analyze_board_np.board2array(state.board)
+    lib_count = analyze_board_np.liberties_count(a, analyze_board_np.string_labels(a))
+    return analyze_board_np.correct_moves_mask(a, player, lib_count)
+
+reg_backend['numpy'] = Backend(
+    color_mask=lambda state, player: analyze_board_np.color_mask(
+                                        analyze_board_np.board2array(state.board), player),
+    liberties_count=_np_liberties_count,
+    lib_nbs_to_lib_count=lambda state: analyze_board_np.lib_nbs_to_lib_count(
+                                        analyze_board_np.board2array(state.board)),
+    correct_moves_mask=_np_correct_moves_mask)
+
+def memoized(backend):
+    """
+    Backend which remembers the results for the last state, so that the
+    analysis of a position is done only once, when more cubes (or labels)
+    are computed for it. The results must not be modified by the callers.
+    """
+    last = [None]
+    memo = {}
+
+    def wrap(function):
+        def f(state, *args):
+            if state is not last[0]:
+                last[0] = state
+                memo.clear()
+            key = (function, args)
+            if key not in memo:
+                memo[key] = function(state, *args)
+            return memo[key]
+        return f
+
+    return Backend(*map(wrap, backend))
+
+BACKEND = reg_backend['python']
+
+def set_backend(name, memoize=False):
+    global BACKEND
+    logging.debug("Using '%s' board analysis backend."%name)
+    BACKEND = reg_backend[name]
+    if memoize:
+        BACKEND = memoized(BACKEND)
+
+def get_backend():
+    return BACKEND
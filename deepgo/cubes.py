@@ -1,8 +1,10 @@
 import logging
+from collections import namedtuple
 import numpy as np
 
 import gomill
 import analyze_board
+import backends
 import static_planes
 from utils import raw_history
 from rank import Rank, BrWr
@@ -52,7 +54,9 @@ def get_label_simple(s, player):
     assert s.future
     player_next, (row, col) = s.future[0]
     assert player == player_next
-    return np.array((s.board.side * row + col,), dtype='uint8')
+    # 19x19 has more points than uint8 holds
+    dtype = 'uint8' if s.board.side ** 2 <= 256 else 'uint16'
+    return np.array((s.board.side * row + col,), dtype=dtype)
 
 @register(reg_label, 'expanded_label')
 def get_label_exp(s, player):
@@ -68,7 +72,7 @@ def get_label_exp_packed(s, player):
     assert s.future
     player_next, (row, col) = s.future[0]
     assert player == player_next
-    label = get_label_exp((row, col), s.board.side)
+    label = get_label_exp(s, player)
     return np.packbits(label)
 
 @register(reg_label, '3_moves_lookahead_expanded_label')
@@ -95,7 +99,7 @@ def get_label_future3_exp(s, player):
 
 @register(reg_label, 'correct_moves')
 def get_label_correct(s, player):
-    return analyze_board.board2correct_move_mask(s.board, player)
+    return backends.get_backend().correct_moves_mask(s, player)
 
 @register(reg_label, 'ranks_number')
 def get_label_ranks_number(s, player):
@@ -118,104 +122,131 @@ def get_label_ranks_number(s, player):
     return a
 
 #
-# Cubes
+# Plane primitives
+#
+# The cubes are made of named plane primitives, which are computed from
+# named intermediate features (color masks, liberties, history, ...).
+# Each feature declares the features it depends on, and when a cube is
+# evaluated (see evaluate), each feature is computed at most once and
+# the planes are written into one preallocated cube. A new cube thus only
+# needs to register its new primitives, see register_spec.
 #
 
-@register(reg_cube, 'nop')
-def get_cube_nop(state, player):
-    return np.zeros((1, state.board.side, state.board.side), dtype='float32')
-
-@register(reg_cube, 'clark_storkey_2014')
-def get_cube_clark_storkey_2014(*args):
-    """
-    Planes compatible with the Clark and Storkey 2014 paper
-    (arXiv:1412.3409v1)
-    """
-
-    return get_cube_basic_7_channel(*args)
+# name -> Feature
+reg_feature = {}
 
-@register(reg_cube, 'basic_7_channel')
-def get_cube_basic_7_channel(state, player):
-    cube = np.zeros((7, state.board.side, state.board.side), dtype='uint8')
+# function  computes the feature from the values of the dependencies
+# deps      names of the features passed to the function as arguments,
+#           'state' and 'player' are always available
+# planes    number of planes of a plane primitive, None for intermediate
+#           features which cannot be used in a cube directly
+Feature = namedtuple('Feature', 'function deps planes')
 
-    # count liberties
-    string_lib = analyze_board.board2string_lib(state.board)
-    lib_count = analyze_board.liberties_count(state.board, string_lib)
+def feature(name, deps, planes=None):
+    def registrator(func):
+        reg_feature[name] = Feature(func, deps, planes)
+        return func
+    return registrator
 
-    # mask for different colors
-    empty, friend, enemy = analyze_board.board2color_mask(state.board, player)
+def plane(name, deps, planes=1):
+    """
+    Registers a plane primitive, the function returns array of shape
+    (side, side), or (planes, side, side), or anything that can be assigned
+    into it (e.g. a bool mask or a scalar).
+    """
+    return feature(name, deps, planes)
 
-    our_liberties = friend * lib_count
-    enemy_liberties = enemy * lib_count
+## intermediate features
 
-    cube[0] = our_liberties == 1
-    cube[1] = our_liberties == 2
-    cube[2] = our_liberties >= 3
-    cube[3] = enemy_liberties == 1
-    cube[4] = enemy_liberties == 2
-    cube[5] = enemy_liberties >= 3
-    if state.ko_point is not None:
-        ko_row, ko_col = state.ko_point
-        cube[6][ko_row][ko_col] = 1
+@feature('side', ['state'])
+def feature_side(state):
+    return state.board.side
 
-    return cube
+@feature('color_mask', ['state', 'player'])
+def feature_color_mask(state, player):
+    return backends.get_backend().color_mask(state, player)
 
-@register(reg_cube, 'clark_storkey_2014_packed')
-def get_cube_clark_storkey_2014_packed(*args):
-    cube = get_cube_clark_storkey_2014(*args)
-    return np.packbits(cube)
+@feature('lib_count', ['state'])
+def feature_lib_count(state):
+    return backends.get_backend().liberties_count(state)
 
-@register(reg_cube, 'deepcl')
-def get_cube_deepcl(*args):
-    """v2 version compatible planes
-    https://github.com/hughperkins/kgsgo-dataset-preprocessor
-    """
-
-    cube = get_cube_basic_7_channel(*args)
-
-    return np.array(255 * cube, dtype='float32')
+@feature('lib_count_lib', ['state'])
+def feature_lib_count_lib(state):
+    # for liberties themselves
+    return backends.get_backend().lib_nbs_to_lib_count(state)
 
-@register(reg_cube, 'tian_zhu_2015')
-def get_cube_tian_zhu_2015(state, player):
-    """
-    Planes compatible with the
-    Yuandong Tian, Yan Zhu, 2015
-    Better Computer Go Player with Neural Network and Long-term Prediction
-    (arXiv:1511.06410)
-    """
-    cube = np.zeros((25, state.board.side, state.board.side), dtype='float32')
+@feature('our_liberties', ['friend', 'lib_count'])
+def feature_our_liberties(friend, lib_count):
+    return friend * lib_count
 
-    # count liberties
-    string_lib = analyze_board.board2string_lib(state.board)
-    lib_count = analyze_board.liberties_count(state.board, string_lib)
+@feature('enemy_liberties', ['enemy', 'lib_count'])
+def feature_enemy_liberties(enemy, lib_count):
+    return enemy * lib_count
 
-    # mask for different colors
-    empty, friend, enemy = analyze_board.board2color_mask(state.board, player)
+@feature('lib_liberties', ['empty', 'lib_count_lib'])
+def feature_lib_liberties(empty, lib_count_lib):
+    return empty * lib_count_lib
 
-    our_liberties = friend * lib_count
-    enemy_liberties = enemy * lib_count
+@feature('history', ['state'])
+def feature_history(state):
+    # watch out, history gives -1 for empty points
+    if state.history_tracker is not None:
+        return state.history_tracker.raw_history()
+    return raw_history(state.board, state.history)
 
+@feature('exp_history', ['history'])
+def feature_exp_history(history):
+    return np.exp(- 0.1 * history)
 
-    cube[0] = our_liberties == 1
-    cube[1] = our_liberties == 2
-    cube[2] = our_liberties >= 3
-    cube[3] = enemy_liberties == 1
-    cube[4] = enemy_liberties == 2
-    cube[5] = enemy_liberties >= 3
+@feature('dist_from_stones', ['state', 'player'])
+def feature_dist_from_stones(state, player):
+    # distances from stones ~ cfg
+    return analyze_board.board2dist_from_stones(state.board, player)
+
+## planes
+
+# the color masks are planes as well
+for num, name in enumerate(['empty', 'friend', 'enemy']):
+    plane(name, ['color_mask'])(lambda color_mask, num=num : color_mask[num])
+
+# e.g. our_liberties_2 (exactly 2 liberties), our_liberties_3+ (3 or more)
+for prefix in ['our', 'enemy', 'lib']:
+    liberties = '%s_liberties'%prefix
+    for count in [1, 2, 3]:
+        plane('%s_%d'%(liberties, count), [liberties])(
+            lambda libs, count=count : libs == count)
+    for count in [3, 4]:
+        plane('%s_%d+'%(liberties, count), [liberties])(
+            lambda libs, count=count : libs >= count)
+
+# history_1 is the last move, history_2 the second last, ...
+for count in [1, 2, 3, 4]:
+    plane('history_%d'%count, ['history'])(
+        lambda history, count=count : history == count)
+
+@plane('ones', [])
+def plane_ones():
+    return 1
+
+@plane('ko', ['state', 'side'])
+def plane_ko(state, side):
+    ret = np.zeros((side, side), dtype='uint8')
     if state.ko_point is not None:
         ko_row, ko_col = state.ko_point
-        cube[6][ko_row][ko_col] = 1
+        ret[ko_row][ko_col] = 1
+    return ret
 
-    cube[7] = friend * 1
-    cube[8] = enemy * 1
-    cube[9] = empty * 1
+@plane('our_exp_history', ['friend', 'exp_history'])
+def plane_our_exp_history(friend, exp_history):
+    return friend * exp_history
 
-    # watch out, history since it gives -1 for empty points
-    history = np.exp(- 0.1 * raw_history(state.board, state.history))
-    cube[10] = friend * history
-    cube[11] = enemy * history
+@plane('enemy_exp_history', ['enemy', 'exp_history'])
+def plane_enemy_exp_history(enemy, exp_history):
+    return enemy * exp_history
 
-    # rank_planes
+@plane('enemy_rank_dan', ['state', 'player', 'side'], planes=9)
+def plane_enemy_rank_dan(state, player, side):
+    ret = np.zeros((9, side, side), dtype='uint8')
     enemy_rank = state.ranks.wr if player == 'b' else state.ranks.br
     # key maps: (30k, 1k) = (30, 1), (1d, 9d) = (0, -8), (1p, 9p) = (-9, ..)
     # in case of None rank, make all rank planes 0
@@ -223,190 +254,158 @@ def get_cube_tian_zhu_2015(state, player):
     for r in xrange(9):
         # one plane per dan, pros have all ones
         if enemy_rank_key == -r or enemy_rank_key < -8:
-            cube[12 + r][:] = 1
+            ret[r] = 1
+    return ret
 
-    cube[21] = static_planes.get_border_mark(state.board.side)
-    cube[22] = np.exp(-0.5 * static_planes.get_sqd_from_center(state.board.side))
+@plane('border', ['side'])
+def plane_border(side):
+    return static_planes.get_border_mark(side)
 
-    # distances from stones ~ cfg
-    dist_friend, dist_enemy = analyze_board.board2dist_from_stones(state.board, player)
-    cube[23] = empty * (dist_friend < dist_enemy)
-    cube[24] = empty * (dist_friend > dist_enemy)
+@plane('exp_sqd_from_center', ['side'])
+def plane_exp_sqd_from_center(side):
+    return static_planes.get_exp_sqd_from_center(side, -0.5)
 
-    return cube
+@plane('closer_to_friend', ['empty', 'dist_from_stones'])
+def plane_closer_to_friend(empty, (dist_friend, dist_enemy)):
+    return empty * (dist_friend < dist_enemy)
 
-@register(reg_cube, 'detlef')
-def get_cube_detlef(state, player):
+@plane('closer_to_enemy', ['empty', 'dist_from_stones'])
+def plane_closer_to_enemy(empty, (dist_friend, dist_enemy)):
+    return empty * (dist_friend > dist_enemy)
+
+class CubeSpec(object):
     """
-    Planes compatible with the
-    CNN kindly provided by Detlef Schmicker. See
-    http://computer-go.org/pipermail/computer-go/2015-December/008324.html
-
-    The net should (as of January 2016) be available here:
-    http://physik.de/CNNlast.tar.gz
-
-    Description:
-    1
-    2
-    3
-    > 4 libs playing color
-    1
-    2
-    3
-    > 4 libs opponent color
-    Empty points
-    last move
-    second last move
-    third last move
-    forth last move
+    Cube made of the plane primitives `planes` (names in reg_feature),
+    of the given dtype.
     """
-    cube = np.zeros((13, state.board.side, state.board.side), dtype='float32')
-
-    # count liberties
-    string_lib = analyze_board.board2string_lib(state.board)
-    lib_count = analyze_board.liberties_count(state.board, string_lib)
-
-    # mask for different colors
-    empty, friend, enemy = analyze_board.board2color_mask(state.board, player)
-
-    our_liberties = friend * lib_count
-    enemy_liberties = enemy * lib_count
-
-    cube[0] = our_liberties == 1
-    cube[1] = our_liberties == 2
-    cube[2] = our_liberties == 3
-    cube[3] = our_liberties >= 4
-    cube[4] = enemy_liberties == 1
-    cube[5] = enemy_liberties == 2
-    cube[6] = enemy_liberties == 3
-    cube[7] = enemy_liberties >= 4
-
-    cube[8] = empty * 1
-
-    # watch out, history gives -1 for empty points
-    history = raw_history(state.board, state.history)
-    cube[9]  = 1*(history == 1)
-    cube[10] = 1*(history == 2)
-    cube[11] = 1*(history == 3)
-    cube[12] = 1*(history == 4)
-
-    return cube
-
-@register(reg_cube, 'detlefko')
-def get_cube_detlefko(state, player):
-    cube = np.zeros((14, state.board.side, state.board.side), dtype='float32')
-
-    string_lib = analyze_board.board2string_lib(state.board)
-    lib_count = analyze_board.liberties_count(state.board, string_lib)
-
-    empty, friend, enemy = analyze_board.board2color_mask(state.board, player)
-
-    our_liberties, enemy_liberties = friend * lib_count, enemy * lib_count
-
-    cube[0] = our_liberties == 1
-    cube[1] = our_liberties == 2
-    cube[2] = our_liberties == 3
-    cube[3] = our_liberties >= 4
-    cube[4] = enemy_liberties == 1
-    cube[5] = enemy_liberties == 2
-    cube[6] = enemy_liberties == 3
-    cube[7] = enemy_liberties >= 4
-
-    cube[8] = empty * 1
-
-    # watch out, history gives -1 for empty points
-    history = raw_history(state.board, state.history)
-    cube[9]  = 1*(history == 1)
-    cube[10] = 1*(history == 2)
-    cube[11] = 1*(history == 3)
-    cube[12] = 1*(history == 4)
-    if state.ko_point is not None:
-        ko_row, ko_col = state.ko_point
-        cube[13][ko_row][ko_col] = 1
-
+    def __init__(self, planes, dtype):
+        self.planes = []
+        offset = 0
+        for name in planes:
+            count = reg_feature[name].planes
+            if not count:
+                raise ValueError("Feature '%s' is not a plane."%name)
+            self.planes.append((name, slice(offset, offset + count)))
+            offset += count
+        self.num_planes = offset
+        self.dtype = np.dtype(dtype)
+
+def evaluate(spec, state, player):
+    """
+    Computes the cube of the `spec`, each feature is computed at most once.
+    """
+    values = {'state' : state, 'player' : player}
+    def get(name):
+        if name not in values:
+            function, deps, planes = reg_feature[name]
+            values[name] = function(*map(get, deps))
+        return values[name]
+
+    side = state.board.side
+    cube = np.zeros((spec.num_planes, side, side), dtype=spec.dtype)
+    for name, planes in spec.planes:
+        cube[planes] = get(name)
     return cube
 
+def register_spec(name, planes, dtype):
+    """
+    Registers cube `name` made of the plane primitives.
 
-@register(reg_cube, 'detlefko_conthist')
-def get_cube_detlefko_conthist(state, player):
-    cube = np.zeros((12, state.board.side, state.board.side), dtype='float32')
-
-    string_lib = analyze_board.board2string_lib(state.board)
-    lib_count = analyze_board.liberties_count(state.board, string_lib)
-
-    empty, friend, enemy = analyze_board.board2color_mask(state.board, player)
-
-    our_liberties, enemy_liberties = friend * lib_count, enemy * lib_count
-
-    cube[0] = our_liberties == 1
-    cube[1] = our_liberties == 2
-    cube[2] = our_liberties == 3
-    cube[3] = our_liberties >= 4
-    cube[4] = enemy_liberties == 1
-    cube[5] = enemy_liberties == 2
-    cube[6] = enemy_liberties == 3
-    cube[7] = enemy_liberties >= 4
-
-    cube[8] = empty * 1
-
-    if state.ko_point is not None:
-        ko_row, ko_col = state.ko_point
-        cube[9][ko_row][ko_col] = 1
-
-    # watch out, history since it gives -1 for empty points
-    history = np.exp(- 0.1 * raw_history(state.board, state.history))
-    cube[10] = friend * history
-    cube[11] = enemy * history
-    return cube
-
-@register(reg_cube, 'jm2017')
-def get_cube_jm(state, player):
-    cube = np.zeros((22, state.board.side, state.board.side), dtype='float32')
+    :returns: the cube function
+    """
+    spec = CubeSpec(planes, dtype)
+    def get_cube(state, player):
+        return evaluate(spec, state, player)
+    get_cube.spec = spec
+    reg_cube[name] = get_cube
+    return get_cube
 
-    string_lib = analyze_board.board2string_lib(state.board)
-    lib_count = analyze_board.liberties_count(state.board, string_lib)
-    # for liberties themselves
-    lib_count_lib = analyze_board.lib_nbs_to_lib_count(state.board, string_lib.liberties_nb_count)
+#
+# Cubes
+#
 
-    empty, friend, enemy = analyze_board.board2color_mask(state.board, player)
+@register(reg_cube, 'nop')
+def get_cube_nop(state, player):
+    return np.zeros((1, state.board.side, state.board.side), dtype='float32')
 
-    lib_liberties = empty * lib_count_lib
-    our_liberties = friend * lib_count
-    enemy_liberties = enemy * lib_count
+@register(reg_cube, 'clark_storkey_2014')
+def get_cube_clark_storkey_2014(*args):
+    """
+    Planes compatible with the Clark and Storkey 2014 paper
+    (arXiv:1412.3409v1)
+    """
 
-    cube[0] = lib_liberties == 1
-    cube[1] = lib_liberties == 2
-    cube[2] = lib_liberties == 3
-    cube[3] = lib_liberties >= 4
+    return get_cube_basic_7_channel(*args)
 
-    cube[4] = our_liberties == 1
-    cube[5] = our_liberties == 2
-    cube[6] = our_liberties == 3
-    cube[7] = our_liberties >= 4
+get_cube_basic_7_channel = register_spec('basic_7_channel', [
+    'our_liberties_1', 'our_liberties_2', 'our_liberties_3+',
+    'enemy_liberties_1', 'enemy_liberties_2', 'enemy_liberties_3+',
+    'ko'], 'uint8')
 
-    cube[8] = enemy_liberties == 1
-    cube[9] = enemy_liberties == 2
-    cube[10] = enemy_liberties == 3
-    cube[11] = enemy_liberties >= 4
+@register(reg_cube, 'clark_storkey_2014_packed')
+def get_cube_clark_storkey_2014_packed(*args):
+    cube = get_cube_clark_storkey_2014(*args)
+    return np.packbits(cube)
 
-    cube[12] = empty * 1
-    cube[13] = friend * 1
-    cube[14] = enemy * 1
-    cube[15] = 1
+@register(reg_cube, 'deepcl')
+def get_cube_deepcl(*args):
+    """v2 version compatible planes
+    https://github.com/hughperkins/kgsgo-dataset-preprocessor
+    """
 
-    # watch out, history gives -1 for empty points
-    history = raw_history(state.board, state.history)
-    cube[16] = 1*(history == 1)
-    cube[17] = 1*(history == 2)
-    cube[18] = 1*(history == 3)
-    cube[19] = 1*(history == 4)
-    if state.ko_point is not None:
-        ko_row, ko_col = state.ko_point
-        cube[20][ko_row][ko_col] = 1
+    cube = get_cube_basic_7_channel(*args)
 
-    cube[21] = static_planes.get_exp_sqd_from_center(state.board.side, -0.5)
+    return np.array(255 * cube, dtype='float32')
 
-    return cube
+# Planes compatible with the
+# Yuandong Tian, Yan Zhu, 2015
+# Better Computer Go Player with Neural Network and Long-term Prediction
+# (arXiv:1511.06410)
+get_cube_tian_zhu_2015 = register_spec('tian_zhu_2015', [
+    'our_liberties_1', 'our_liberties_2', 'our_liberties_3+',
+    'enemy_liberties_1', 'enemy_liberties_2', 'enemy_liberties_3+',
+    'ko',
+    'friend', 'enemy', 'empty',
+    'our_exp_history', 'enemy_exp_history',
+    'enemy_rank_dan',
+    'border', 'exp_sqd_from_center',
+    'closer_to_friend', 'closer_to_enemy'], 'float32')
+
+# Planes compatible with the
+# CNN kindly provided by Detlef Schmicker. See
+# http://computer-go.org/pipermail/computer-go/2015-December/008324.html
+#
+# The net should (as of January 2016) be available here:
+# http://physik.de/CNNlast.tar.gz
+#
+# Description:
+# 1, 2, 3, >= 4 libs playing color
+# 1, 2, 3, >= 4 libs opponent color
+# Empty points
+# last move, second last move, third last move, forth last move
+DETLEF_PLANES = [
+    'our_liberties_1', 'our_liberties_2', 'our_liberties_3', 'our_liberties_4+',
+    'enemy_liberties_1', 'enemy_liberties_2', 'enemy_liberties_3', 'enemy_liberties_4+',
+    'empty',
+    'history_1', 'history_2', 'history_3', 'history_4']
+
+get_cube_detlef = register_spec('detlef', DETLEF_PLANES, 'float32')
+
+get_cube_detlefko = register_spec('detlefko', DETLEF_PLANES + ['ko'], 'float32')
+
+get_cube_detlefko_conthist = register_spec('detlefko_conthist', [
+    'our_liberties_1', 'our_liberties_2', 'our_liberties_3', 'our_liberties_4+',
+    'enemy_liberties_1', 'enemy_liberties_2', 'enemy_liberties_3', 'enemy_liberties_4+',
+    'empty', 'ko',
+    'our_exp_history', 'enemy_exp_history'], 'float32')
+
+get_cube_jm = register_spec('jm2017', [
+    'lib_liberties_1', 'lib_liberties_2', 'lib_liberties_3', 'lib_liberties_4+',
+    'our_liberties_1', 'our_liberties_2', 'our_liberties_3', 'our_liberties_4+',
+    'enemy_liberties_1', 'enemy_liberties_2', 'enemy_liberties_3', 'enemy_liberties_4+',
+    'empty', 'friend', 'enemy', 'ones',
+    'history_1', 'history_2', 'history_3', 'history_4',
+    'ko', 'exp_sqd_from_center'], 'float32')
 
 if __name__ == "__main__":
     def test_cube():
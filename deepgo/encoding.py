@@ -0,0 +1,764 @@
+import os
+import time
+import logging
+import traceback
+import cPickle
+import hashlib
+from Queue import Queue
+import multiprocessing
+from itertools import islice, takewhile
+from collections import namedtuple
+import numpy as np
+
+import gomill
+import gomill.sgf, gomill.sgf_moves
+from gomill.gtp_states import History_move
+
+import cubes, state, rank, string_tracker, backends, fast_board, fast_sgf, symmetry
+from utils import HistoryTracker, ListTail
+from game_archive import GameArchive
+
+"""
+Encoding of the games into the examples of the planes and labels, the worker
+side of make_dataset.py and deepgo.stream.
+
+The worker is set up by init_subprocess (in the processes of a pool, or in the
+current process) and process_game encodes one game. streaming_imap runs the
+workers in a multiprocessing pool.
+"""
+
+# how the examples are stored in the dataset
+# shape             shape of one example in the dataset
+# dtype             dtype of the dataset
+# original_shape    shape of the example as returned by the cube/label
+# original_dtype    dtype of the example as returned by the cube/label
+Layout = namedtuple('Layout', 'shape dtype original_shape original_dtype')
+
+# version of the encoding of the games, part of the GameCache keys
+# increase when the output of the cubes or labels (or the format
+# of the cache entries) changes
+ENCODER_VERSION = 4
+
+# examples of a game stored in a SharedRing slot
+SlotRef = namedtuple('SlotRef', 'slot size')
+
+def get_encoders(planes, labels):
+    """
+    :returns: list of the cube functions for the planes,
+              followed by the label functions for the labels
+    """
+    return ([ cubes.reg_cube[plane] for plane in planes ]
+            + [ cubes.reg_label[label] for label in labels ])
+
+def get_samples(planes, labels, boardsize):
+    """
+    Returns sample xs and ys (in the order of get_encoders),
+    to determine the shapes and dtypes of the examples.
+    """
+    b = fast_board.Board(boardsize)
+    s = state.State(b, None, [], [('b',(3,3))], rank.BrWr(rank.Rank.from_key(1), # 1k
+                                               rank.Rank.from_key(2)  # 2k
+                                               ))
+    return [ encoder(s, 'b') for encoder in get_encoders(planes, labels) ]
+
+def make_layout(sample, flatten=False, shrink_units=False, dtype=None):
+    """
+    Determines how to store examples like the `sample` in the dataset.
+    """
+    shape = sample.shape
+    ## shrink unit dimension
+    # one dimensional values can be stored flattened
+    # s.t.
+    # 1000 examples of dimensions 1 have shape (1000,)
+    # instead of (1000, 1)
+    # this is probably the case only for the labels
+    # but support xs anyways
+    if shrink_units and shape == (1, ):
+        shape = tuple()
+
+    ## flatten
+    # do not flatten units
+    if flatten and shape:
+        shape = (reduce((lambda x,y : x*y), shape), )
+
+    ## dtype
+    dtype = np.dtype(dtype) if dtype else sample.dtype
+
+    return Layout(shape, dtype, sample.shape, sample.dtype)
+
+def alloc_block(size, layout):
+    """
+    Allocates block for `size` examples, stored in the `layout`.
+
+    :returns: the block, and its view with examples in the original shape
+              (s.t. the cubes can be directly assigned into the view,
+              which does both the flattening and the dtype conversion)
+    """
+    block = np.empty((size,) + layout.shape, dtype=layout.dtype)
+    return block, block.reshape((size,) + layout.original_shape)
+
+class Timer(object):
+    __slots__ = ['profile', 'stage', 'start']
+    def __init__(self, profile, stage):
+        self.profile = profile
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, *args):
+        self.profile.add(self.stage, time.time() - self.start)
+
+class NullTimer(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+class Profile(object):
+    """
+    Accumulates the time spent in the stages of the processing.
+
+        with profile.timed('parse'):
+            ...
+
+    Profiles of the workers are sent to the master and merged.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.times = {}
+        self.counts = {}
+
+    def add(self, stage, seconds, count=1):
+        self.times[stage] = self.times.get(stage, 0.0) + seconds
+        self.counts[stage] = self.counts.get(stage, 0) + count
+
+    def timed(self, stage):
+        return Timer(self, stage)
+
+    def merge(self, other):
+        for stage, seconds in other.times.iteritems():
+            self.add(stage, seconds, other.counts[stage])
+
+    def pop(self):
+        """
+        :returns: Profile with the times accumulated so far, and resets this one
+        """
+        ret = Profile()
+        ret.times, ret.counts = self.times, self.counts
+        self.times, self.counts = {}, {}
+        return ret
+
+    def report(self):
+        total = sum(self.times.values())
+        lines = ["%-10s %10s %6s %10s %10s"%('stage', 'time [s]', '%', 'calls', 'ms/call')]
+        for stage, seconds in sorted(self.times.iteritems(), key=lambda (st, sec) : -sec):
+            count = self.counts[stage]
+            lines.append("%-10s %10.2f %6.1f %10d %10.3f"%(stage, seconds,
+                                                          100.0 * seconds / total if total else 0,
+                                                          count, 1000.0 * seconds / count))
+        return '\n'.join(lines)
+
+class NullProfile(object):
+    """
+    Profile which does not measure anything.
+    """
+    enabled = False
+    timer = NullTimer()
+
+    def add(self, stage, seconds, count=1):
+        pass
+
+    def timed(self, stage):
+        return self.timer
+
+profile = NullProfile()
+
+def set_profile(enabled):
+    global profile
+    profile = Profile() if enabled else NullProfile()
+
+class SharedRing(object):
+    """
+    Shared memory transport of the encoded games from the workers to the master.
+
+    The shared memory is divided into slots, each holding blocks for up to
+    `capacity` examples of the layouts. Workers encode a game directly into
+    a free slot and send only SlotRef to the master, which writes the examples
+    straight from the shared memory and releases the slot. This replaces
+    pickling the blocks through the pool's pipe.
+
+    Must be created before the workers are forked.
+    """
+    def __init__(self, slots, capacity, layouts):
+        self.capacity = capacity
+        self.layouts = layouts
+        self.free = multiprocessing.Queue()
+        self.arrays = []
+        for layout in layouts:
+            dtype = np.dtype(layout.dtype)
+            shape = (slots, capacity) + layout.shape
+            raw = multiprocessing.RawArray('b', int(np.prod(shape)) * dtype.itemsize)
+            self.arrays.append(np.frombuffer(raw, dtype=dtype).reshape(shape))
+        for slot in xrange(slots):
+            self.free.put(slot)
+
+    def acquire(self):
+        """
+        Waits for a free slot.
+
+        :returns: the slot, list of its blocks (see alloc_block) for each layout
+        """
+        with profile.timed('wait slot'):
+            slot = self.free.get()
+        return slot, [ (a[slot], a[slot].reshape((self.capacity,) + layout.original_shape))
+                       for a, layout in zip(self.arrays, self.layouts) ]
+
+    def get(self, ref):
+        """
+        :returns: list of views of the examples in the slot for each layout
+        """
+        return [ a[ref.slot, :ref.size] for a in self.arrays ]
+
+    def release(self, slot):
+        self.free.put(slot)
+
+def original_layout(layout):
+    """
+    Layout which stores the examples as returned by the cube/label.
+    """
+    return Layout(layout.original_shape, layout.original_dtype,
+                  layout.original_shape, layout.original_dtype)
+
+def cache_params(planes, labels, allowed_boardsizes, allowed_ranks):
+    """
+    Parameters which determine the encoding of a game, see GameCache.
+    """
+    return ("plane=%s label=%s boardsizes=%s ranks=%s version=%d"
+            %(','.join(planes), ','.join(labels), sorted(allowed_boardsizes),
+              sorted(allowed_ranks) if allowed_ranks is not None else None,
+              ENCODER_VERSION))
+
+class GameCache(object):
+    """
+    On-disk cache of the encoded games, so that a rebuild of the dataset
+    (with more games, or e.g. a different --dtype) only encodes new games.
+
+    The entries are addressed by the hash of the sgf file content and of the
+    encoding parameters (see cache_params). They store the examples in the
+    original shape and dtype of the cube/label (compressed npz), or a mark
+    that the game was skipped. The cache is shared by the workers, the entries
+    are written atomically.
+    """
+    def __init__(self, directory, params):
+        self.directory = directory
+        self.params = params
+
+    def key(self, data):
+        h = hashlib.sha1(self.params)
+        h.update('\0')
+        h.update(data)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.npz')
+
+    def get(self, key):
+        """
+        :returns: hit, list of the arrays of the examples, e.g. [Xs, ys]
+                  (or None if the game was skipped)
+        """
+        path = self.path(key)
+        if not os.path.exists(path):
+            return False, None
+
+        try:
+            with np.load(path) as npz:
+                if 'skip' in npz.files:
+                    arrays = None
+                else:
+                    arrays = [ npz['arr_%d'%num] for num in xrange(len(npz.files)) ]
+        except Exception as e:
+            logging.warn("Invalid cache entry '%s': %s"%(path, str(e)))
+            return False, None
+
+        # the entries are evicted by the time of the last use
+        os.utime(path, None)
+        return True, arrays
+
+    def put(self, key, arrays):
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # created by other worker
+                pass
+
+        tmp = '%s.%d.tmp'%(path, os.getpid())
+        with open(tmp, 'wb') as fout:
+            if arrays is None:
+                np.savez(fout, skip=np.ones(1, dtype='uint8'))
+            else:
+                np.savez_compressed(fout, *arrays)
+        os.rename(tmp, path)
+
+    def evict(self, limit):
+        """
+        Removes the least recently used entries,
+        until the cache takes at most `limit` bytes.
+
+        :returns: number of entries removed
+        """
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename.endswith('.npz'):
+                    path = os.path.join(dirpath, filename)
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for mtime, size, path in entries)
+        removed = 0
+        for mtime, size, path in sorted(entries):
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+            removed += 1
+
+        return removed
+
+def init_subprocess(planes, labels, allowed_boardsizes, allowed_ranks, backend='python',
+                    dataset_layouts=None, shared_ring=None,
+                    profiling=False, cache_dir=None, archive_dir=None, prefilter=True,
+                    fast_sgf=True, symmetries=False):
+    """
+    :param planes, labels: lists of the names of the planes and labels
+    :param dataset_layouts: list of the layouts, in the order of get_encoders
+    """
+    global get_cubes, get_labels, board_filter, ranks_filter, layouts, ring, cache
+    global archive, size_filter, use_prefilter, use_fast_sgf, transforms
+    # the analysis of a position is shared by the cubes
+    backends.set_backend(backend, memoize=len(planes) + len(labels) > 2)
+    set_profile(profiling)
+    get_cubes = get_encoders(planes, [])
+    get_labels = get_encoders([], labels)
+    if dataset_layouts is None:
+        dataset_layouts = map(make_layout, get_samples(planes, labels, max(allowed_boardsizes)))
+    layouts = dataset_layouts
+    ring = shared_ring
+
+    transforms = None
+    if symmetries:
+        transforms = [ symmetry.SymmetryTransform(name, max(allowed_boardsizes),
+                                                  layout.shape, layout.original_shape)
+                       for name, layout in zip(planes + labels, layouts) ]
+
+    # memory-mapped, after the fork
+    archive = GameArchive(archive_dir) if archive_dir is not None else None
+
+    cache = None
+    if cache_dir is not None:
+        cache = GameCache(cache_dir, cache_params(planes, labels, allowed_boardsizes,
+                                                  allowed_ranks))
+
+    size_filter = lambda side : side in allowed_boardsizes
+    board_filter = lambda board : size_filter(board.side)
+    use_prefilter = prefilter
+    use_fast_sgf = fast_sgf
+
+    def filter_one_rank(rank):
+        if allowed_ranks is None:
+            return True
+        if not rank:
+            return None in allowed_ranks
+        return rank.key() in allowed_ranks
+
+    def ranks_filter(brwr):
+        return all(map(filter_one_rank, brwr))
+
+def process_game(item):
+    """
+    :param item: path of the sgf file (a line from the input),
+                 index of the game in the --archive,
+                 or pair (name, content of the sgf) from the --sgf-archive
+    """
+    try :
+        with profile.timed('read'):
+            sgf_fn, data = read_game(item)
+    except Exception as e:
+        logging.warn("Error processing '%s': %s"%(str(item).strip()[:200], str(e)))
+        return None
+
+    if use_prefilter and archive is None:
+        with profile.timed('prefilter'):
+            passed = prefilter_game(data)
+        if not passed:
+            logging.info("Skipping game '%s': boardsize or rank not allowed"%(sgf_fn))
+            return None
+
+    if cache is not None:
+        return process_game_cached(item, sgf_fn, data)
+
+    game = parse_game(item, sgf_fn, data)
+    if game is None:
+        return None
+
+    board, moves, ranks = game
+    return store_game(count_positions(moves),
+                      lambda blocks : encode_game(sgf_fn, board, moves, ranks, blocks))
+
+def read_game(item):
+    """
+    :returns: name of the game, the game's data
+    """
+    if archive is not None:
+        return archive.name(item), archive.raw(item)
+    if isinstance(item, tuple):
+        # read from the sgf archive by the master
+        return item
+
+    sgf_fn = item.strip()
+    with open(sgf_fn, 'r') as fin:
+        return sgf_fn, fin.read()
+
+def prefilter_game(data):
+    """
+    Cheap check of the boardsize and ranks in the root properties of the raw
+    sgf, before the full parse. Only rejects games which would be certainly
+    skipped by the filters in parse_game.
+    """
+    props = fast_sgf.root_properties(data)
+    if props is None:
+        return True
+
+    side = fast_sgf.root_size(props)
+    if side is not None and not size_filter(side):
+        return False
+
+    ranks = root_ranks(props)
+    return ranks is None or ranks_filter(ranks)
+
+def root_ranks(props):
+    """
+    Same as rank.get_rank, from the raw root properties (see fast_sgf.root_properties).
+
+    :returns: rank.BrWr, or None if the ranks cannot be read without gomill
+    """
+    ranks = []
+    for key in ['BR', 'WR']:
+        known, value = fast_sgf.root_text(props, key)
+        if not known:
+            return None
+        ranks.append(rank.Rank.from_string(value, True) if value is not None else None)
+
+    return rank.BrWr(*ranks)
+
+def fast_parse(data):
+    """
+    Reads the game by fast_sgf, without the gomill game tree.
+
+    :returns: board, moves, ranks of the game,
+              or None if the game has to be parsed by gomill
+    """
+    game = fast_sgf.get_setup_and_moves(data)
+    if game is None:
+        return None
+
+    props, board, moves = game
+    ranks = root_ranks(props)
+    if ranks is None:
+        return None
+
+    return board, moves, ranks
+
+def process_game_cached(item, sgf_fn, data):
+    key = cache.key(data)
+    with profile.timed('cache'):
+        hit, arrays = cache.get(key)
+
+    if not hit:
+        logging.debug("Cache miss '%s'"%sgf_fn)
+        arrays = None
+        game = parse_game(item, sgf_fn, data)
+        if game is not None:
+            board, moves, ranks = game
+            # cached in the original shape and dtype,
+            # so that the layout in the dataset can change
+            blocks = [ alloc_block(count_positions(moves), original_layout(layout))
+                       for layout in layouts ]
+            size = encode_game(sgf_fn, board, moves, ranks, blocks)
+            if size is not None:
+                arrays = [ block[:size] for block, view in blocks ]
+
+        with profile.timed('cache'):
+            cache.put(key, arrays)
+
+    if arrays is None:
+        return None
+
+    def fill(blocks):
+        with profile.timed('transform'):
+            for (block, view), a in zip(blocks, arrays):
+                view[:len(a)] = a
+        return len(arrays[0])
+
+    return store_game(len(arrays[0]), fill)
+
+def parse_game(item, sgf_fn, data):
+    """
+    :returns: board, moves, ranks of the game,
+              or None if the game should be skipped
+    """
+    try :
+        with profile.timed('parse'):
+            logging.info("Processing '%s'"%sgf_fn)
+            if archive is not None:
+                board, moves = archive.game(item)
+                ranks = archive.get_ranks(item)
+            else:
+                game = fast_parse(data) if use_fast_sgf else None
+                if game is not None:
+                    board, moves, ranks = game
+                else:
+                    game = gomill.sgf.Sgf_game.from_string(data)
+
+                    board, moves = gomill.sgf_moves.get_setup_and_moves(game,
+                                                    fast_board.Board(game.get_size()))
+                    root = game.get_root()
+                    ranks = rank.BrWr(rank.get_rank(root, 'BR'),
+                                      rank.get_rank(root, 'WR'))
+
+    except Exception as e:
+        logging.warn("Error processing '%s': %s"%(sgf_fn, str(e)))
+        return None
+
+
+    with profile.timed('filter'):
+        if not board_filter(board) or not moves:
+            logging.info("Skipping game '%s': boardsize not allowed"%(sgf_fn))
+            return None
+
+        if not ranks_filter(ranks):
+            logging.info("Skipping game '%s': rank not allowed"%(sgf_fn))
+            return None
+
+    return board, moves, ranks
+
+def count_positions(moves):
+    # only positions before the first pass are encoded
+    return len(list(takewhile(lambda (player, move) : move, moves)))
+
+def add_symmetries(fill):
+    """
+    Wraps the `fill` function of store_game, s.t. the examples are followed
+    by the examples transformed by the other symmetries of the board.
+    """
+    def fill_symmetries(blocks):
+        size = fill(blocks)
+        if size is None:
+            return None
+
+        with profile.timed('symmetry'):
+            for (block, view), transform in zip(blocks, transforms):
+                for k in xrange(1, symmetry.NUM_SYMMETRIES):
+                    block[k * size:(k + 1) * size] = transform.apply(block[:size], k)
+        return size * symmetry.NUM_SYMMETRIES
+
+    return fill_symmetries
+
+def store_game(num_positions, fill):
+    """
+    The whole game is stored into preallocated blocks, in a SharedRing slot
+    if possible.
+
+    :param fill: function filling the blocks (see encode_game), returning
+                 number of examples, or None if the game should be skipped
+    :returns: None if the game was skipped, SlotRef, or list of the arrays
+              of the examples for each layout (e.g. [Xs, ys])
+    """
+    if transforms is not None:
+        num_positions *= symmetry.NUM_SYMMETRIES
+        fill = add_symmetries(fill)
+
+    if ring is not None and num_positions <= ring.capacity:
+        slot, blocks = ring.acquire()
+        try:
+            size = fill(blocks)
+        except:
+            ring.release(slot)
+            raise
+        if size is None:
+            ring.release(slot)
+            return None
+        return SlotRef(slot, size)
+
+    blocks = [ alloc_block(num_positions, layout) for layout in layouts ]
+    size = fill(blocks)
+    if size is None:
+        return None
+
+    return [ block[:size] for block, view in blocks ]
+
+def encode_game(sgf_fn, board, moves, ranks, blocks):
+    """
+    Replays the game, encoding the positions into the blocks.
+
+    :param blocks: [(Xs, Xs_view), (ys, ys_view)] (more of them with more
+                   planes or labels), see alloc_block
+    :returns: number of examples encoded, or None if the game should be skipped
+    """
+    views = [ view for block, view in blocks ]
+    size = 0
+
+    ko_move = None
+    history = []
+    tracker = string_tracker.StringTracker(board)
+    history_tracker = HistoryTracker(board.side)
+    for num, (player, move) in enumerate(moves):
+        # pass
+        if not move:
+            break
+
+        try:
+            # encode current position
+            s = state.State(board, ko_move, history, ListTail(moves, num), ranks,
+                            tracker.string_lib(), history_tracker)
+            with profile.timed('cube'):
+                examples = [ get_cube(s, player) for get_cube in get_cubes ]
+            # get y data from future moves
+            # (usually only first element will be taken in account)
+            with profile.timed('label'):
+                examples.extend(get_label(s, player) for get_label in get_labels)
+        except cubes.SkipGame as e:
+            logging.info("Skipping game '%s': %s"%(sgf_fn, str(e)))
+            return None
+        except Exception as e:
+            logging.exception("Error encoding '%s' - move %d"%(sgf_fn, num + 1))
+            # TODO Should we use the data we have already?
+            return None
+
+        # None skips
+        if all(example is not None for example in examples):
+            with profile.timed('transform'):
+                for view, example, layout in zip(views, examples, layouts):
+                    assert example.shape == layout.original_shape
+                    view[size] = example
+            size += 1
+
+        row, col = move
+        try:
+            with profile.timed('replay'):
+                ko_move = board.play(row, col, player)
+                tracker.play(row, col, player)
+        except Exception as e:
+            logging.warn("Error re-playing '%s' - move %d : '%s'"%(sgf_fn, num + 1, str(e)))
+            # this basically means that the game has illegal moves
+            # lets skip it altogether in case it is garbled
+            return None
+        history.append(History_move(player, move))
+        history_tracker.add(move)
+
+    return size
+
+class SchedulerStats(object):
+    """
+    Counters of the streaming_imap scheduler.
+
+    starved     number of results, after which less tasks were unfinished
+                than there are workers, while there was more input
+                (i.e. some workers were idle because the window was full of
+                results the master did not consume yet)
+    stalls      number of times the master waited for a result
+    stall_time  total time the master waited for the results (s)
+    """
+    def __init__(self):
+        self.tasks = 0
+        self.starved = 0
+        self.stalls = 0
+        self.stall_time = 0.0
+
+    def __str__(self):
+        return ("tasks=%d, workers starved=%d, writer stalls=%d (%.1fs)"
+                % (self.tasks, self.starved, self.stalls, self.stall_time))
+
+def call_job(function, item):
+    """
+    Runs function(item) in the worker,
+    passing the exception to the master as a traceback.
+
+    :returns: ok, value, profile
+              when profiling, the value is pickled (s.t. the master can measure
+              the unpickling) and the worker's profile since the last job is
+              sent along
+    """
+    try:
+        value = function(item)
+    except Exception:
+        return False, traceback.format_exc(), None
+
+    if not profile.enabled:
+        return True, value, None
+
+    with profile.timed('pickle'):
+        value = cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+    return True, value, profile.pop()
+
+def streaming_imap(pool, processes, function, input_iterator, window, stats):
+    """
+        Runs `function` on the items of `input_iterator` in the `pool`
+        and yields pairs (item, result) as they are finished (unordered).
+
+        At most `window` tasks are in flight (submitted, but the result not
+        consumed yet), a new task is submitted whenever a result is consumed.
+        This keeps the workers busy all the time, while the results which
+        might use up a lot of memory cannot pile up in the master.
+
+        :param stats: SchedulerStats to update
+    """
+    input_iterator = iter(input_iterator)
+    results = Queue()
+    exhausted = [False]
+
+    def submit(count):
+        submitted = 0
+        for item in islice(input_iterator, count):
+            pool.apply_async(call_job, (function, item),
+                             callback=lambda (ok, value, worker_profile), item=item :
+                                           results.put((item, ok, value, worker_profile)))
+            submitted += 1
+        if submitted < count:
+            exhausted[0] = True
+        return submitted
+
+    in_flight = submit(window)
+    while in_flight:
+        if results.empty():
+            stats.stalls += 1
+            start = time.time()
+            item, ok, value, worker_profile = results.get()
+            stats.stall_time += time.time() - start
+        else:
+            item, ok, value, worker_profile = results.get()
+        in_flight -= 1
+        stats.tasks += 1
+
+        in_flight += submit(1)
+        if not exhausted[0] and in_flight - results.qsize() < processes:
+            stats.starved += 1
+
+        if not ok:
+            raise RuntimeError("Error in worker:\n%s"%value)
+
+        if worker_profile is not None:
+            profile.merge(worker_profile)
+            with profile.timed('unpickle'):
+                value = cPickle.loads(value)
+        yield item, value
@@ -0,0 +1,219 @@
+from itertools import chain
+import numpy as np
+
+from analyze_board_np import EMPTY, BLACK, WHITE, COLOR2INT, get_nbhs_index
+from static_planes import cached
+
+"""
+Array backed Go board.
+
+Drop-in replacement for gomill.boards.Board (play, get, side,
+list_occupied_points, apply_setup, ...), which keeps the position in a flat
+int8 numpy array (values analyze_board_np.EMPTY, BLACK and WHITE) exposed as
+Board.array, so that the vectorized analysis can read the position without
+any conversion (see analyze_board_np.board2array).
+
+Unlike the gomill board, which looks for surrounded groups on the whole board
+after each move, play() only examines strings neighboring the played stone,
+using precomputed neighbor index tables.
+"""
+
+INT2COLOR = {EMPTY : None,
+             BLACK : 'b',
+             WHITE : 'w'}
+
+@cached
+def get_nbhs_lists(side):
+    """
+    :returns: list, i-th element is a tuple of flat indices of the neighbors
+              of i-th point
+    """
+    size = side * side
+    return [ tuple(nb for nb in nbs if nb < size)
+             for nbs in get_nbhs_index(side).tolist() ]
+
+class Board(object):
+    """
+    A legal Go position, see gomill.boards.Board for the semantics.
+
+    Public attributes:
+      side         -- board size (int >= 2)
+      board_points -- list of coordinates of all points on the board
+      array        -- flat int8 numpy array of size side * side,
+                      point (row, col) has index row * side + col
+    """
+    def __init__(self, side):
+        if side < 2:
+            raise ValueError
+        self.side = side
+        self.board_points = [(_row, _col) for _row in range(side)
+                             for _col in range(side)]
+        self.array = np.zeros(side * side, dtype='int8')
+        self.nbhs = get_nbhs_lists(side)
+        self._is_empty = True
+
+    @staticmethod
+    def from_board(board):
+        """
+        Returns a Board with the same position as the given
+        (e.g. gomill.boards.Board) board.
+        """
+        b = Board(board.side)
+        for color, (row, col) in board.list_occupied_points():
+            b.array[row * b.side + col] = COLOR2INT[color]
+        b._is_empty = not b.array.any()
+        return b
+
+    def copy(self):
+        """Return an independent copy of this Board."""
+        b = Board(self.side)
+        b.array[:] = self.array
+        b._is_empty = self._is_empty
+        return b
+
+    def _check_coords(self, row, col):
+        if not (0 <= row < self.side and 0 <= col < self.side):
+            raise IndexError
+
+    def _make_group(self, point):
+        """
+        Finds solidly connected group of stones.
+
+        :returns: list of the group's points (flat indices),
+                  bool saying whether the group has a liberty
+        """
+        a, nbhs = self.array, self.nbhs
+        colour = a.item(point)
+        points = [point]
+        handled = set(points)
+        has_liberty = False
+        for pt in points:
+            for nb in nbhs[pt]:
+                nb_colour = a.item(nb)
+                if nb_colour == EMPTY:
+                    has_liberty = True
+                elif nb_colour == colour and nb not in handled:
+                    handled.add(nb)
+                    points.append(nb)
+        return points, has_liberty
+
+    def _remove(self, points):
+        for pt in points:
+            self.array.itemset(pt, EMPTY)
+
+    def is_empty(self):
+        """Say whether the board is empty."""
+        return self._is_empty
+
+    def get(self, row, col):
+        """
+        Return the state of the specified point.
+
+        Returns a colour, or None for an empty point.
+
+        Raises IndexError if the coordinates are out of range.
+        """
+        self._check_coords(row, col)
+        return INT2COLOR[self.array.item(row * self.side + col)]
+
+    def play(self, row, col, colour):
+        """
+        Play a move on the board.
+
+        Raises IndexError if the coordinates are out of range.
+
+        Raises ValueError if the specified point isn't empty.
+
+        Performs any necessary captures. Allows self-captures. Doesn't enforce
+        any ko rule.
+
+        Returns the point forbidden by simple ko, or None
+        """
+        self._check_coords(row, col)
+        point = row * self.side + col
+        a = self.array
+        if a.item(point) != EMPTY:
+            raise ValueError
+
+        player = COLOR2INT[colour]
+        a.itemset(point, player)
+        self._is_empty = False
+
+        # surrounded groups of the opponent
+        to_capture = []
+        handled = set()
+        has_empty_nb = False
+        for nb in self.nbhs[point]:
+            nb_colour = a.item(nb)
+            if nb_colour == EMPTY:
+                has_empty_nb = True
+            elif nb_colour == -player and nb not in handled:
+                group, has_liberty = self._make_group(nb)
+                handled.update(group)
+                if not has_liberty:
+                    to_capture.append(group)
+
+        if has_empty_nb:
+            self._remove(chain.from_iterable(to_capture))
+            return None
+
+        group, has_liberty = self._make_group(point)
+        if has_liberty:
+            self._remove(chain.from_iterable(to_capture))
+            return None
+
+        # the same logic as in gomill.boards.Board.play()
+        if not to_capture:
+            # self capture
+            self._remove(group)
+            if len(group) == self.side * self.side:
+                self._is_empty = True
+            return None
+
+        self._remove(chain.from_iterable(to_capture))
+        if len(to_capture) == 1 and len(to_capture[0]) == 1 and len(group) == 1:
+            return divmod(to_capture[0][0], self.side)
+        return None
+
+    def apply_setup(self, black_points, white_points, empty_points):
+        """
+        Add setup stones or removals to the position.
+
+        See gomill.boards.Board.apply_setup()
+
+        Returns a boolean saying whether the position was legal as specified.
+
+        Raises IndexError if any coordinates are out of range.
+        """
+        for (row, col) in chain(black_points, white_points, empty_points):
+            self._check_coords(row, col)
+        for value, points in [(BLACK, black_points),
+                              (WHITE, white_points),
+                              (EMPTY, empty_points)]:
+            for (row, col) in points:
+                self.array[row * self.side + col] = value
+
+        captured = []
+        handled = set()
+        for point in np.flatnonzero(self.array).tolist():
+            if point in handled:
+                continue
+            group, has_liberty = self._make_group(point)
+            handled.update(group)
+            if not has_liberty:
+                captured.append(group)
+
+        self._remove(chain.from_iterable(captured))
+        self._is_empty = not self.array.any()
+        return not captured
+
+    def list_occupied_points(self):
+        """
+        List all nonempty points.
+
+        Returns a list of pairs (colour, (row, col))
+        """
+        occupied = np.flatnonzero(self.array)
+        return [ (INT2COLOR[value], divmod(point, self.side))
+                 for point, value in zip(occupied.tolist(),
+                                         self.array[occupied].tolist()) ]
@@ -0,0 +1,221 @@
+import re
+import string
+import codecs
+
+from gomill import sgf_properties
+
+import fast_board
+
+"""
+Fast reading of the raw sgf data, without building the gomill game tree.
+
+The tokens are recognized the same way as in gomill.sgf_grammar.tokenise(),
+anything unusual is reported as unknown, so that the caller can fall back
+to the full gomill parse.
+
+get_setup_and_moves() reads only the main line of games without variations,
+which is all that is needed to encode a game.
+"""
+
+_find_start_re = re.compile(r"\(\s*;")
+_tokenise_re = re.compile(r"""
+\s*
+(?:
+    \[ (?P<V> [^\\\]]* (?: \\. [^\\\]]* )* ) \]   # PropValue
+    |
+    (?P<I> [A-Za-z]{1,64} )                       # PropIdent (accepting lc)
+    |
+    (?P<D> [;()] )                                # delimiter
+)
+""", re.VERBOSE | re.DOTALL)
+
+# the same tokens, all found by one findall(), the value keeps its brackets
+# so that an empty value can be told from a missing group
+_all_tokens_re = re.compile(r"""
+\s*
+(?:
+    ( \[ [^\\\]]* (?: \\. [^\\\]]* )* \] )   # PropValue
+    |
+    ( [A-Za-z]{1,64} )                         # PropIdent
+    |
+    ( [;()] )                                  # delimiter
+    |
+    ( . )                                      # not a token
+)
+""", re.VERBOSE | re.DOTALL)
+
+# printable ascii without backslash, these raw SimpleText values
+# are the same as the values interpreted by gomill
+_simple_text_re = re.compile(r"\A[ -\[\]-~]*\Z")
+
+def root_properties(data):
+    """
+    Reads the properties of the root node.
+
+    :returns: dict identifier -> list of raw values,
+              or None if the root node cannot be read
+    """
+    m = _find_start_re.search(data)
+    if not m:
+        return None
+
+    props = {}
+    ident = None
+    i = m.end()
+    while True:
+        m = _tokenise_re.match(data, i)
+        if not m:
+            return None
+        i = m.end()
+
+        group = m.lastgroup
+        token = m.group(m.lastindex)
+        if group == 'D':
+            return props
+        elif group == 'I':
+            ident = token.translate(None, string.ascii_lowercase)
+            props.setdefault(ident, [])
+        else:
+            if ident is None:
+                return None
+            props[ident].append(token)
+
+def root_size(props):
+    """
+    :returns: the board size (19 by default), or None if unknown
+    """
+    values = props.get('SZ', ['19'])
+    if len(values) != 1:
+        return None
+    try:
+        return int(values[0])
+    except ValueError:
+        return None
+
+def root_text(props, ident):
+    """
+    Value of a SimpleText property (e.g. BR), as it would be returned by
+    gomill's node.get().
+
+    :returns: known, value (None if the property is missing)
+    """
+    if ident not in props:
+        return True, None
+
+    values = props[ident]
+    if len(values) != 1 or not _simple_text_re.match(values[0]):
+        return False, None
+    value = values[0]
+
+    # ascii value could still mean something else in an exotic charset
+    if 'CA' in props:
+        try:
+            charset = props['CA'][0]
+            if value.decode(codecs.lookup(charset).name).encode('utf-8') != value:
+                return False, None
+        except (LookupError, UnicodeError, IndexError):
+            return False, None
+
+    return True, value
+
+def read_nodes(data):
+    """
+    Reads the nodes of a game without variations.
+
+    :returns: list of nodes (dicts identifier -> list of raw values),
+              or None if the game has variations or cannot be read
+    """
+    m = _find_start_re.search(data)
+    if not m:
+        return None
+
+    props = {}
+    nodes = [props]
+    ident = None
+    # property without a value yet
+    pending = False
+    for value, token, delimiter, other in _all_tokens_re.findall(data, m.end()):
+        if value:
+            if ident is None:
+                return None
+            props[ident].append(value[1:-1])
+            pending = False
+            continue
+
+        if pending or other:
+            return None
+        if token:
+            ident = token.translate(None, string.ascii_lowercase)
+            props.setdefault(ident, [])
+            pending = True
+        elif delimiter == ';':
+            props = {}
+            nodes.append(props)
+            ident = None
+        elif delimiter == ')':
+            return nodes
+        else:
+            # variation
+            return None
+
+    # unexpected end
+    return None
+
+_point_tables = {}
+def point_table(side):
+    """
+    :returns: dict raw value -> move, as from sgf_properties.interpret_go_point()
+    """
+    if side not in _point_tables:
+        table = { '' : None }
+        if side <= 19:
+            table['tt'] = None
+        for row in xrange(side):
+            for col in xrange(side):
+                table[chr(97 + col) + chr(97 + side - 1 - row)] = row, col
+        _point_tables[side] = table
+    return _point_tables[side]
+
+def get_setup_and_moves(data):
+    """
+    Fast variant of gomill.sgf_moves.get_setup_and_moves(), for games without
+    variations. The board and moves are the same as from gomill.
+
+    :returns: root properties (see root_properties), board (fast_board.Board)
+              after the setup, list of moves; or None if gomill should be used
+    """
+    nodes = read_nodes(data)
+    if nodes is None:
+        return None
+
+    root = nodes[0]
+    side = root_size(root)
+    if side is None or not 1 <= side <= 26:
+        return None
+
+    try:
+        presenter = sgf_properties.Presenter(side, root.get('CA', ['ISO-8859-1'])[0])
+        board = fast_board.Board(side)
+
+        ab, aw, ae = [ presenter.interpret(ident, root[ident]) if ident in root else set()
+                       for ident in ['AB', 'AW', 'AE'] ]
+        if ab or aw:
+            if not board.apply_setup(ab, aw, ae):
+                return None
+            if 'B' in root or 'W' in root:
+                return None
+            nodes = nodes[1:]
+
+        points = point_table(side)
+        moves = []
+        for node in nodes:
+            if 'AB' in node or 'AW' in node or 'AE' in node:
+                return None
+            if 'B' in node:
+                moves.append(('b', points[node['B'][0]]))
+            elif 'W' in node:
+                moves.append(('w', points[node['W'][0]]))
+    except (ValueError, KeyError):
+        return None
+
+    return root, board, moves
@@ -0,0 +1,193 @@
+import os
+from array import array
+from collections import namedtuple
+import numpy as np
+
+import fast_board
+from rank import Rank, BrWr
+
+"""
+Compact binary archive of games, so that the sgf files do not have to be
+parsed again for every dataset made from the same games.
+
+The archive is a directory of .npy arrays, which are memory-mapped when read:
+    sizes.npy           uint8, board size of each game
+    ranks.npy           int16 (num_games, 2), BR and WR rank keys (Rank.key()),
+                        NO_RANK if the rank is missing
+    setup.npy           int16, stones of the position after the setup
+    setup_offsets.npy   int64, setup of i-th game is setup[offsets[i]:offsets[i+1]]
+    moves.npy           int16, the moves of all the games
+    move_offsets.npy    int64, moves of i-th game
+    names.txt           name (e.g. path of the sgf) of each game, one per line
+
+The stones and moves are encoded by encode_move().
+"""
+
+NO_RANK = np.iinfo('int16').min
+
+# one game, as stored in the archive
+# name      name of the game
+# side      board size
+# setup     int16 array of the setup stones (encode_move)
+# moves     int16 array of the moves (encode_move)
+# ranks     pair of rank keys (or NO_RANK)
+GameRecord = namedtuple('GameRecord', 'name side setup moves ranks')
+
+def encode_move(colour, move, side):
+    """
+    :returns: index of the point + 1, positive for black and negative for
+              white, pass (move None) is encoded as side * side + 1
+    """
+    if move is None:
+        value = side * side + 1
+    else:
+        row, col = move
+        value = row * side + col + 1
+    return value if colour == 'b' else -value
+
+def decode_move(value, side):
+    """
+    Inverse of encode_move.
+
+    :returns: colour, move
+    """
+    colour = 'b' if value > 0 else 'w'
+    value = abs(value) - 1
+    if value == side * side:
+        return colour, None
+    return colour, divmod(value, side)
+
+def rank_key(rank):
+    return rank.key() if rank else NO_RANK
+
+_RANKS = {}
+def key_rank(key):
+    """
+    Inverse of rank_key.
+    """
+    if key == NO_RANK:
+        return None
+    if key not in _RANKS:
+        _RANKS[key] = Rank.from_key(key)
+    return _RANKS[key]
+
+def make_record(name, board, moves, ranks):
+    """
+    :param board: position after the setup
+    :param moves: list of (colour, move) pairs, see gomill.sgf_moves.get_setup_and_moves
+    :param ranks: rank.BrWr
+    """
+    side = board.side
+    setup = [ encode_move(colour, point, side)
+              for colour, point in board.list_occupied_points() ]
+    encoded = [ encode_move(colour, move, side) for colour, move in moves ]
+    return GameRecord(name, side,
+                      np.array(setup, dtype='int16'),
+                      np.array(encoded, dtype='int16'),
+                      (rank_key(ranks.br), rank_key(ranks.wr)))
+
+class ArchiveWriter(object):
+    """
+    Collects the GameRecords and writes the archive on close().
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.sizes = array('B')
+        self.ranks = array('h')
+        self.setup, self.setup_offsets = array('h'), [0]
+        self.moves, self.move_offsets = array('h'), [0]
+        self.names = []
+
+    def add(self, record):
+        if '\n' in record.name:
+            raise ValueError("Name of the game cannot contain newline.")
+        self.names.append(record.name)
+        self.sizes.append(record.side)
+        self.ranks.extend(record.ranks)
+        self.setup.extend(record.setup.tolist())
+        self.setup_offsets.append(len(self.setup))
+        self.moves.extend(record.moves.tolist())
+        self.move_offsets.append(len(self.moves))
+
+    def close(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        def save(name, a):
+            np.save(os.path.join(self.directory, name + '.npy'), a)
+
+        save('sizes', np.array(self.sizes, dtype='uint8'))
+        save('ranks', np.array(self.ranks, dtype='int16').reshape((-1, 2)))
+        save('setup', np.array(self.setup, dtype='int16'))
+        save('setup_offsets', np.array(self.setup_offsets, dtype='int64'))
+        save('moves', np.array(self.moves, dtype='int16'))
+        save('move_offsets', np.array(self.move_offsets, dtype='int64'))
+        with open(os.path.join(self.directory, 'names.txt'), 'w') as fout:
+            for name in self.names:
+                fout.write(name + '\n')
+
+class GameArchive(object):
+    """
+    Reads the games from an archive written by ArchiveWriter.
+    """
+    def __init__(self, directory):
+        def load(name):
+            return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+        self.sizes = load('sizes')
+        self.ranks = load('ranks')
+        self.setup = load('setup')
+        self.setup_offsets = load('setup_offsets')
+        self.moves = load('moves')
+        self.move_offsets = load('move_offsets')
+        with open(os.path.join(directory, 'names.txt'), 'r') as fin:
+            self.names = [ line.rstrip('\n') for line in fin ]
+
+        assert len(self.names) == len(self.sizes) == len(self.ranks)
+
+    def __len__(self):
+        return len(self.names)
+
+    def name(self, index):
+        return self.names[index]
+
+    def side(self, index):
+        return int(self.sizes[index])
+
+    def get_ranks(self, index):
+        """
+        :returns: rank.BrWr
+        """
+        br, wr = self.ranks[index].tolist()
+        return BrWr(key_rank(br), key_rank(wr))
+
+    def record(self, index):
+        return GameRecord(self.names[index], self.side(index),
+                          self.setup[self.setup_offsets[index]:self.setup_offsets[index + 1]],
+                          self.moves[self.move_offsets[index]:self.move_offsets[index + 1]],
+                          tuple(self.ranks[index].tolist()))
+
+    def raw(self, index):
+        """
+        :returns: the game's data as a string, e.g. to compute its hash
+        """
+        record = self.record(index)
+        return ''.join([chr(record.side), np.array(record.ranks, dtype='int16').tostring(),
+                        record.setup.tostring(), '\0\0', record.moves.tostring()])
+
+    def game(self, index):
+        """
+        :returns: board (fast_board.Board) after the setup, list of moves
+                  (see gomill.sgf_moves.get_setup_and_moves)
+        """
+        record = self.record(index)
+        side = record.side
+        board = fast_board.Board(side)
+        setup = { 'b' : [], 'w' : [] }
+        for value in record.setup.tolist():
+            colour, point = decode_move(value, side)
+            setup[colour].append(point)
+        board.apply_setup(setup['b'], setup['w'], [])
+
+        moves = [ decode_move(value, side) for value in record.moves.tolist() ]
+        return board, moves
@@ -9,7 +9,8 @@ import gomill
 from gomill import common, boards, sgf, sgf_moves, gtp_states
 
 import utils
-import analyze_board
+import backends
+from state import State
 
 """
 Basic Player / Bot objects;
@@ -204,7 +205,8 @@ class DistributionBot(object):
         dist = self.gen_probdist_raw(game_state, player)
 
         if dist is not None:
-            correct_moves = analyze_board.board2correct_move_mask(game_state.board,  player)
+            correct_moves = backends.get_backend().correct_moves_mask(
+                                State(game_state.board, None, [], [], None), player)
             if game_state.ko_point:
                 correct_moves[game_state.ko_point[0]][game_state.ko_point[1]] = 0
 
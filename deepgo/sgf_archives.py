@@ -0,0 +1,39 @@
+import tarfile
+import zipfile
+
+"""
+Reading sgf files directly from tar (possibly compressed) and zip archives,
+without unpacking them.
+"""
+
+SGF_SUFFIX = '.sgf'
+
+def is_sgf(name):
+    return name.lower().endswith(SGF_SUFFIX)
+
+def iter_tar(filename):
+    # stream mode, the members are read sequentially,
+    # the compression is detected automatically
+    with tarfile.open(filename, 'r|*') as tar:
+        for member in tar:
+            if member.isfile() and is_sgf(member.name):
+                yield member.name, tar.extractfile(member).read()
+
+def iter_zip(filename):
+    with zipfile.ZipFile(filename, 'r') as zf:
+        for info in zf.infolist():
+            if not info.filename.endswith('/') and is_sgf(info.filename):
+                yield info.filename, zf.read(info)
+
+def iter_sgfs(filename):
+    """
+    Yields pairs (name, content) of the sgf files in the archive,
+    name is 'ARCHIVE:MEMBER'.
+    """
+    if zipfile.is_zipfile(filename):
+        members = iter_zip(filename)
+    else:
+        members = iter_tar(filename)
+
+    for member, data in members:
+        yield '%s:%s'%(filename, member), data
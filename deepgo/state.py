@@ -3,7 +3,12 @@ from collections import namedtuple
 from rank import BrWr
 
 # this is the state which is passed to the cubes
-State = namedtuple('State', 'board ko_point history future ranks')
+# string_lib is optional, it is the analyze_board.StringLib of the board,
+# if it is already known (e.g. tracked by the string_tracker.StringTracker)
+# history_tracker is optional, utils.HistoryTracker of the history,
+# if the history is tracked incrementally
+State = namedtuple('State', 'board ko_point history future ranks string_lib history_tracker')
+State.__new__.__defaults__ = (None, None)
 
 def gomill_gamestate2state(game_state):
     return State(game_state.board,
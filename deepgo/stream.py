@@ -0,0 +1,181 @@
+import multiprocessing
+from itertools import imap
+
+import numpy as np
+
+import encoding, sgf_archives, symmetry
+from game_archive import GameArchive
+
+"""
+Training batches encoded on the fly from the games, without making a dataset
+by make_dataset.py first, e.g.
+
+    games = stream.sgf_list(open('filelist'))
+    for X, y in stream.iter_batches(games, 'detlefko', 'simple_label', 128, proc=4):
+        ...
+
+The games are replayed in a pool of workers by deepgo.encoding, exactly as
+by make_dataset.py, and the positions are mixed across the games in a
+ShuffleBuffer.
+"""
+
+def sgf_list(lines):
+    """
+    Games from the paths of the sgf files, one per line.
+    """
+    return (line for line in lines if line.strip())
+
+def sgf_archive_games(filenames):
+    """
+    Games from the tar or zip archives of the sgf files.
+    """
+    for filename in filenames:
+        for item in sgf_archives.iter_sgfs(filename):
+            yield item
+
+def archive_games(directory):
+    """
+    Games from the archive made by sgf2archive.py, use with
+    `archive_dir=directory` in iter_batches.
+    """
+    return xrange(len(GameArchive(directory)))
+
+class ShuffleBuffer(object):
+    """
+    Mixes the examples of the games, the batches are sampled randomly from
+    the buffer of `capacity` examples, which is refilled by the next games.
+    """
+    def __init__(self, capacity, layouts, rng=np.random, shuffle=True):
+        """
+        :param layouts: list of the encoding.Layouts of the examples
+        :param shuffle: False takes the batches in the order of the examples
+        """
+        self.capacity = capacity
+        self.arrays = [ np.empty((capacity,) + layout.shape, dtype=layout.dtype)
+                        for layout in layouts ]
+        self.size = 0
+        self.rng = rng
+        self.shuffle = shuffle
+
+    def add(self, arrays, batch_size):
+        """
+        Adds the examples, yielding batches whenever the buffer gets full.
+
+        :param arrays: list of the examples for each layout (e.g. [Xs, ys])
+        :returns: iterator of the lists of the batches
+        """
+        start, end = 0, len(arrays[0])
+        while start < end:
+            add = min(end - start, self.capacity - self.size)
+            for buf, a in zip(self.arrays, arrays):
+                buf[self.size:self.size + add] = a[start:start + add]
+            self.size += add
+            start += add
+
+            if self.size == self.capacity:
+                yield self.pop(batch_size)
+
+    def drain(self, batch_size):
+        """
+        Yields the full batches left in the buffer, the rest is dropped.
+        """
+        while self.size >= batch_size:
+            yield self.pop(batch_size)
+        self.size = 0
+
+    def pop(self, batch_size):
+        """
+        Removes `batch_size` examples (random ones when shuffling) from the buffer.
+        """
+        last = self.size - batch_size
+        if not self.shuffle:
+            batch = [ buf[:batch_size].copy() for buf in self.arrays ]
+            for buf in self.arrays:
+                buf[:last] = buf[batch_size:self.size]
+            self.size = last
+            return batch
+
+        index = self.rng.choice(self.size, batch_size, replace=False)
+        batch = [ buf[index] for buf in self.arrays ]
+
+        # the last examples fill the holes
+        holes = index[index < last]
+        moved = np.setdiff1d(np.arange(last, self.size), index)
+        for buf in self.arrays:
+            buf[holes] = buf[moved]
+        self.size = last
+
+        return batch
+
+def iter_games(games, planes, labels, layouts, boardsize=19, rankspec=None,
+               archive_dir=None, proc=1, backend='python', window=None):
+    """
+    Encodes the games in a pool of `proc` workers (see encoding.process_game).
+
+    :returns: iterator of the lists of the examples of the games
+              (in the order of encoding.get_encoders), unordered
+    """
+    initargs = (planes, labels, (boardsize, ), rankspec, backend, layouts,
+                None, False, None, archive_dir)
+    if proc <= 1:
+        encoding.init_subprocess(*initargs)
+        results = imap(encoding.process_game, games)
+    else:
+        pool = multiprocessing.Pool(proc, initializer=encoding.init_subprocess,
+                                    initargs=initargs)
+        window = window if window else 4 * proc
+        results = (ret for item, ret in encoding.streaming_imap(
+                        pool, proc, encoding.process_game, games,
+                        window, encoding.SchedulerStats()))
+
+    try:
+        for arrays in results:
+            if arrays:
+                yield arrays
+    finally:
+        if proc > 1:
+            pool.terminate()
+            pool.join()
+
+def iter_batches(games, plane, label, batch_size, boardsize=19, rankspec=None,
+                 archive_dir=None, proc=1, backend='python', shuffle_buffer=100000,
+                 flatten=False, dtype=None, symmetries=False, rng=np.random):
+    """
+    Encodes the games into batches of the examples of the plane and label
+    (see cubes.reg_cube and cubes.reg_label). The examples which do not fill
+    the last batch are dropped.
+
+    :param games: paths of the sgf files (see sgf_list), pairs (name, sgf data)
+                  (see sgf_archive_games) or indexes of the games in the archive
+                  from `archive_dir` (see archive_games)
+    :param rankspec: set of the allowed rank keys as from
+                     rank.parse_rank_specification, None allows all
+    :param shuffle_buffer: number of the examples mixed together,
+                           0 keeps the order of the positions in the games
+    :param flatten, dtype: the same as in make_dataset.py
+    :param symmetries: transform each position by a random symmetry
+    :returns: iterator of pairs (X, y)
+    """
+    samples = encoding.get_samples([plane], [label], boardsize)
+    layouts = [ encoding.make_layout(sample, flatten, dtype=dtype) for sample in samples ]
+    transforms = None
+    if symmetries:
+        transforms = [ symmetry.SymmetryTransform(name, boardsize, layout.shape,
+                                                  layout.original_shape)
+                       for name, layout in zip([plane, label], layouts) ]
+
+    buf = ShuffleBuffer(max(shuffle_buffer, batch_size), layouts, rng,
+                        shuffle=bool(shuffle_buffer))
+
+    def batches():
+        for arrays in iter_games(games, [plane], [label], layouts, boardsize, rankspec,
+                                 archive_dir, proc, backend):
+            for batch in buf.add(arrays, batch_size):
+                yield batch
+        for batch in buf.drain(batch_size):
+            yield batch
+
+    for batch in batches():
+        if transforms is not None:
+            batch = symmetry.random_symmetries(batch, transforms, rng)
+        yield tuple(batch)
@@ -0,0 +1,180 @@
+from gomill.common import opponent_of
+
+import analyze_board
+from analyze_board import StringLib, NBCOORD
+from static_planes import cached
+
+"""
+Incremental strings & liberties tracking.
+
+analyze_board.board2string_lib rebuilds the strings and liberties of a position
+from scratch, which is fine for a single position (e.g. when generating a
+move), but wasteful when replaying a whole game, since each move only changes
+the direct neighborhood of the played stone.
+
+The StringTracker keeps the very same StringLib data up to date as the moves
+are played, so that the cubes can use it without analysing the whole board
+again. Strings are merged on play (the smaller string is relabeled to the
+number of the bigger one) and split only by captures, which remove them.
+"""
+
+@cached
+def get_nbhs_table(side):
+    """
+    :returns: dict coord => tuple of coords of the neighbors
+    """
+    table = {}
+    for row in xrange(side):
+        for col in xrange(side):
+            table[row, col] = tuple((row + dx, col + dy) for dx, dy in NBCOORD
+                                    if 0 <= row + dx < side and 0 <= col + dy < side)
+    return table
+
+class StringTracker(object):
+    """
+    Tracks strings and their liberties of a position, as moves are played.
+
+    The play() semantics is the same as that of gomill.boards.Board.play()
+    (captures, self-captures and simple ko), so that the tracker can be run
+    in parallel with the board, e.g.:
+
+        tracker = StringTracker(board)
+        for colour, (row, col) in moves:
+            s = State(board, ko, history, future, ranks, tracker.string_lib())
+            ...
+            ko = board.play(row, col, colour)
+            tracker.play(row, col, colour)
+    """
+    def __init__(self, board):
+        """
+        :param board: the initial position (e.g. the setup of a game),
+                      must be a legal position
+        """
+        self.side = board.side
+        self.nbhs = get_nbhs_table(board.side)
+
+        # coord => color
+        self.colors = dict((pt, color) for (color, pt) in board.list_occupied_points())
+
+        sl = analyze_board.board2string_lib(board)
+        # coord => string number
+        self.string = sl.string
+        # string number => set of liberties coords
+        self.liberties = sl.liberties
+        # liberty coord => number of neighboring stones
+        self.lib_nb_cnt = sl.liberties_nb_count
+
+        # string number => set of stones of the string
+        self.stones = {}
+        for pt, si in self.string.iteritems():
+            self.stones.setdefault(si, set()).add(pt)
+
+        self.next_string = len(self.stones)
+
+    def string_lib(self):
+        """
+        Returns the StringLib of the current position.
+
+        The StringLib is not copied, so it is only valid until the next play().
+        """
+        return StringLib(self.string, self.liberties, self.lib_nb_cnt)
+
+    def play(self, row, col, colour):
+        """
+        Plays a move and updates the strings and liberties.
+
+        Raises ValueError if the specified point isn't empty.
+
+        Returns the point forbidden by simple ko, or None
+        """
+        pt = (row, col)
+        if pt in self.colors:
+            raise ValueError
+
+        nbhs = self.nbhs[pt]
+        opponent = opponent_of(colour)
+
+        # the point is not a liberty any more
+        self.lib_nb_cnt.pop(pt, None)
+        self.colors[pt] = colour
+
+        # new string consisting of the single stone
+        si = self.next_string
+        self.next_string += 1
+        self.string[pt] = si
+        self.stones[si] = set([pt])
+        self.liberties[si] = set()
+
+        for nb in nbhs:
+            nb_color = self.colors.get(nb)
+            if nb_color is None:
+                self.liberties[si].add(nb)
+                self.lib_nb_cnt[nb] = self.lib_nb_cnt.get(nb, 0) + 1
+            else:
+                self.liberties[self.string[nb]].discard(pt)
+
+        # connect to friends
+        for nb in nbhs:
+            if self.colors.get(nb) == colour:
+                si = self._merge(si, self.string[nb])
+
+        # same logic as in gomill.boards.Board.play()
+        surrounded = set(self.string[nb] for nb in nbhs
+                         if self.colors.get(nb) == opponent
+                         and not self.liberties[self.string[nb]])
+        simple_ko_point = None
+        if not self.liberties[si]:
+            if not surrounded:
+                # self capture
+                surrounded.add(si)
+            elif len(surrounded) == 1 and len(self.stones[si]) == 1:
+                (captured,) = surrounded
+                if len(self.stones[captured]) == 1:
+                    (simple_ko_point,) = self.stones[captured]
+
+        for captured in surrounded:
+            self._remove(captured)
+
+        return simple_ko_point
+
+    def _merge(self, s1, s2):
+        """
+        Merges two strings, returns number of the resulting string.
+        """
+        if s1 == s2:
+            return s1
+        # relabel the smaller one
+        if len(self.stones[s1]) < len(self.stones[s2]):
+            s1, s2 = s2, s1
+
+        for pt in self.stones[s2]:
+            self.string[pt] = s1
+        self.stones[s1].update(self.stones.pop(s2))
+        self.liberties[s1].update(self.liberties.pop(s2))
+
+        return s1
+
+    def _remove(self, si):
+        """
+        Removes a (captured) string from the board.
+        """
+        removed = self.stones.pop(si)
+        del self.liberties[si]
+        for pt in removed:
+            del self.colors[pt]
+            del self.string[pt]
+
+        for pt in removed:
+            # stones around the new empty point
+            nb_count = 0
+            for nb in self.nbhs[pt]:
+                if nb in self.colors:
+                    nb_count += 1
+                    self.liberties[self.string[nb]].add(pt)
+                elif nb not in removed:
+                    # empty point which lost its neighboring stone
+                    self.lib_nb_cnt[nb] -= 1
+                    if not self.lib_nb_cnt[nb]:
+                        del self.lib_nb_cnt[nb]
+            if nb_count:
+                self.lib_nb_cnt[pt] = nb_count
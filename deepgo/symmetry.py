@@ -0,0 +1,166 @@
+import ast
+import numpy as np
+
+from static_planes import cached
+
+"""
+The 8 dihedral symmetries of the board, applied to whole batches of examples.
+
+Symmetry k (0 <= k < 8) transposes the board if k >= 4 and then rotates it
+k % 4 times by 90 degrees, symmetry 0 is the identity. The cubes and labels
+of a position must be transformed by the same symmetry, SymmetryTransform
+knows how to do it for the examples of a dataset:
+
+    'planes'    the board is in the last two dimensions of the example
+                (most of the cubes, expanded labels)
+    'packed'    np.packbits of the planes (e.g. clark_storkey_2014_packed)
+    'index'     index of a point, side * row + col (simple_label)
+    None        the example does not depend on the board (ranks_number)
+
+The examples can be flattened or converted to other dtype (see --flatten and
+--dtype of make_dataset.py).
+"""
+
+NUM_SYMMETRIES = 8
+
+# name of the plane or label -> kind, DEFAULT_KIND for the others
+KINDS = {
+    'simple_label' : 'index',
+    'expanded_label_packed' : 'packed',
+    'clark_storkey_2014_packed' : 'packed',
+    'ranks_number' : None,
+}
+DEFAULT_KIND = 'planes'
+
+# the packed examples are unpacked to (planes, side, side), except of these
+UNPACKED_SHAPES = {
+    'expanded_label_packed' : lambda side : (side, side),
+}
+
+def transform_planes(a, k):
+    """
+    :param a: array of shape (..., side, side)
+    :returns: view of the array transformed by the symmetry k
+    """
+    if k >= 4:
+        a = np.swapaxes(a, -1, -2)
+    return np.rot90(a, k % 4, axes=(-2, -1))
+
+@cached
+def point_permutation(side, k):
+    """
+    :returns: array perm, perm[side * row + col] is the index of the point
+              (row, col) transformed by the symmetry k
+    """
+    points = np.arange(side * side).reshape((side, side))
+    perm = np.empty(side * side, dtype='int64')
+    perm[transform_planes(points, k).ravel()] = np.arange(side * side)
+    return perm
+
+def unpacked_shape(name, side, original_shape):
+    """
+    :param original_shape: shape of the packed example
+    :returns: shape of the planes, (planes, side, side) (see UNPACKED_SHAPES)
+    """
+    nbytes = int(np.prod(original_shape))
+    planes = nbytes * 8 // (side * side)
+    if not planes or (planes * side * side + 7) // 8 != nbytes:
+        raise ValueError("Cannot unpack examples of '%s' with shape %s to %dx%d planes."
+                         %(name, repr(tuple(original_shape)), side, side))
+    if name in UNPACKED_SHAPES:
+        return UNPACKED_SHAPES[name](side)
+    return (planes, side, side)
+
+class SymmetryTransform(object):
+    """
+    Transforms the examples of a dataset.
+    """
+    def __init__(self, name, side, shape, original_shape, kind=None):
+        """
+        :param name: name of the plane or label
+        :param side: board size
+        :param shape: shape of the example in the dataset
+        :param original_shape: shape of the example as returned by the cube or label
+        :param kind: overrides the kind of the examples given by the name,
+                     e.g. 'planes' for the unpacked examples
+        """
+        self.kind = kind if kind is not None else KINDS.get(name, DEFAULT_KIND)
+        self.side = side
+        self.shape = tuple(shape)
+        self.planes_shape = tuple(original_shape)
+
+        if self.kind == 'packed':
+            self.planes_shape = unpacked_shape(name, side, original_shape)
+        elif self.kind == 'planes':
+            if self.planes_shape[-2:] != (side, side):
+                raise ValueError("Examples of '%s' with shape %s are not %dx%d planes."
+                                 %(name, repr(self.planes_shape), side, side))
+
+    @staticmethod
+    def from_dataset(dset):
+        """
+        Transform of the dataset made by make_dataset.py, from its attributes.
+        """
+        return SymmetryTransform(dset.attrs['name'], int(dset.attrs['boardsize']),
+                                 dset.shape[1:],
+                                 ast.literal_eval(dset.attrs['original_example_shape']))
+
+    def apply(self, batch, k):
+        """
+        :param batch: array of the examples, of shape (num_examples,) + shape
+        :returns: the examples transformed by the symmetry k
+        """
+        if self.kind is None or k == 0:
+            return batch
+
+        n = len(batch)
+        if self.kind == 'index':
+            # the labels can be stored as floats (--dtype)
+            return point_permutation(self.side, k)[batch.astype(np.intp)].astype(batch.dtype)
+
+        if self.kind == 'planes':
+            planes = batch.reshape((n,) + self.planes_shape)
+            return transform_planes(planes, k).reshape((n,) + self.shape)
+
+        bits = np.unpackbits(batch.reshape((n, -1)).astype('uint8'), axis=1)
+        planes = bits[:, :int(np.prod(self.planes_shape))].reshape((n,) + self.planes_shape)
+        packed = np.packbits(transform_planes(planes, k).reshape((n, -1)), axis=1)
+        return packed.astype(batch.dtype).reshape((n,) + self.shape)
+
+    def apply_each(self, batch, ks):
+        """
+        :param ks: array of the symmetries for each of the examples
+        :returns: the examples, each transformed by its symmetry
+        """
+        out = np.empty_like(batch)
+        for k in np.unique(ks):
+            which = ks == k
+            out[which] = self.apply(batch[which], k)
+        return out
+
+def random_symmetries(arrays, transforms, rng=np.random):
+    """
+    Transforms each position by a random symmetry, e.g. when reading
+    the batches for training.
+
+    :param arrays: list of the batches of the examples of the positions
+                   (e.g. [xs, ys]), the i-th example of each is the same position
+    :param transforms: list of the SymmetryTransforms of the arrays
+    :returns: list of the transformed arrays
+    """
+    ks = rng.randint(NUM_SYMMETRIES, size=len(arrays[0]))
+    return [ transform.apply_each(a, ks) for a, transform in zip(arrays, transforms) ]
+
+def iter_batches(dsets, batch_size, rng=np.random):
+    """
+    Reads the datasets made by make_dataset.py in batches and transforms
+    each position by a random symmetry.
+
+    :param dsets: list of aligned datasets, e.g. [f['xs'], f['ys']]
+    :returns: iterator of lists of the batches
+    """
+    transforms = map(SymmetryTransform.from_dataset, dsets)
+    size = dsets[0].shape[0]
+    for start in xrange(0, size, batch_size):
+        arrays = [ dset[start:start + batch_size] for dset in dsets ]
+        yield random_symmetries(arrays, transforms, rng)
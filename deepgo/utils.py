@@ -104,6 +104,60 @@ def raw_history(board, history):
     # The first one now will later be last!
     return empty * (-1) + full * (time + 1 - a)
 
+class HistoryTracker(object):
+    """
+    Incremental raw_history, the moves are added as the game is replayed,
+    so that the history of each position is not walked again (which is
+    quadratic in the length of the game).
+    """
+    def __init__(self, side):
+        # time of the last move played at the point, 0 if none
+        self.times = np.zeros((side, side))
+        self.time = 0
+        self.last = None
+
+    def add(self, move):
+        assert move is not None
+        self.time += 1
+        self.times[move] = self.time
+        self.last = None
+
+    def raw_history(self):
+        """
+        :returns: the same as raw_history() of the moves added so far
+        """
+        if self.last is None:
+            empty, full = self.times == 0, self.times != 0
+            self.last = empty * (-1) + full * (self.time + 1 - self.times)
+        return self.last
+
+class ListTail(object):
+    """
+    Read-only view of lst[start:], e.g. the future moves of a position,
+    without copying the list.
+    """
+    __slots__ = ['lst', 'start']
+
+    def __init__(self, lst, start):
+        self.lst = lst
+        self.start = start
+
+    def __len__(self):
+        return max(0, len(self.lst) - self.start)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [ self.lst[self.start + i] for i in xrange(*key.indices(len(self))) ]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("index out of range")
+        return self.lst[self.start + key]
+
+    def __iter__(self):
+        for i in xrange(self.start, len(self.lst)):
+            yield self.lst[i]
+
 def get_gnu_go_response(sgf_filename, color):
     """
     returns None if we could not get gnugo move.
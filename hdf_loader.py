@@ -0,0 +1,240 @@
+import re
+import ast
+import threading
+from Queue import Queue, Full
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import h5py
+
+from deepgo import symmetry
+
+"""
+Loading of the batches for training from the datasets made by make_dataset.py,
+e.g.
+
+    loader = BatchLoader('dataset.hdf5', ['xs', 'ys'], batch_size=128)
+    for epoch in xrange(10):
+        for X, y in loader:
+            ...
+    loader.close()
+
+The datasets are read in whole chunks by background threads. The batches are
+shuffled by reading the chunks in a random order and mixing the examples
+of several chunks together. The examples are decoded to the shape and dtype
+returned by the cube or label (see the 'original_example_shape' and
+'original_dtype' attributes), the packed planes are unpacked.
+"""
+
+# sent by the producer after the last batch of the epoch
+_END = object()
+
+def parse_dtype(s):
+    """
+    Reads the dtype stored by make_dataset.dataset_attrs, e.g. "dtype('uint8')".
+    """
+    m = re.match(r"\A\s*dtype\((.*)\)\s*\Z", s)
+    if not m:
+        raise ValueError("Unknown dtype '%s'."%s)
+    return np.dtype(ast.literal_eval(m.group(1)))
+
+class ExampleDecoder(object):
+    """
+    Decodes the examples of a dataset to the original shape and dtype.
+    """
+    def __init__(self, dset, dtype=None):
+        """
+        :param dtype: dtype of the decoded examples, the original dtype by default
+        """
+        attrs = dset.attrs
+        for key in ['name', 'boardsize', 'original_example_shape', 'original_dtype']:
+            if key not in attrs:
+                raise ValueError("Cannot decode the dataset '%s', attribute '%s' is missing."
+                                 %(dset.name, key))
+
+        self.name = attrs['name']
+        self.side = int(attrs['boardsize'])
+        self.original_shape = ast.literal_eval(attrs['original_example_shape'])
+        self.packed = symmetry.KINDS.get(self.name, symmetry.DEFAULT_KIND) == 'packed'
+        if self.packed:
+            self.shape = symmetry.unpacked_shape(self.name, self.side, self.original_shape)
+            original_dtype = np.dtype('uint8')
+        else:
+            self.shape = self.original_shape
+            original_dtype = parse_dtype(attrs['original_dtype'])
+        self.dtype = np.dtype(dtype) if dtype else original_dtype
+
+    def decode(self, batch):
+        n = len(batch)
+        if self.packed:
+            bits = np.unpackbits(batch.reshape((n, -1)).astype('uint8'), axis=1)
+            batch = bits[:, :int(np.prod(self.shape))]
+        return batch.reshape((n,) + self.shape).astype(self.dtype, copy=False)
+
+    def symmetry_transform(self):
+        """
+        :returns: SymmetryTransform of the decoded examples
+        """
+        kind = 'planes' if self.packed else None
+        return symmetry.SymmetryTransform(self.name, self.side, self.shape, self.shape, kind)
+
+class BatchLoader(object):
+    """
+    Iterates over the batches of aligned datasets, once for every iteration
+    of the loader. The batches are lists of arrays, one for each of the datasets.
+    """
+    def __init__(self, filename, keys=('xs', 'ys'), batch_size=128, shuffle=True,
+                 chunks_mixed=8, prefetch=8, threads=2, decode=True, dtypes=None,
+                 symmetries=False, drop_last=False, rng=np.random):
+        """
+        :param keys: names of the datasets
+        :param chunks_mixed: number of chunks whose examples are mixed together
+        :param prefetch: number of the batches kept ready
+        :param threads: number of the threads reading the chunks
+        :param decode: decode the examples (see ExampleDecoder), the examples
+                       are returned as stored in the datasets otherwise
+        :param dtypes: list of the dtypes of the decoded examples (None keeps
+                       the original dtype), e.g. ['float32', None]
+        :param symmetries: transform each position by a random symmetry
+        :param drop_last: drop the last batch of the epoch if it is not full
+        """
+        self.f = h5py.File(filename, 'r')
+        self.dsets = [ self.f[key] for key in keys ]
+        self.size = self.dsets[0].shape[0]
+        for dset in self.dsets:
+            if dset.shape[0] != self.size:
+                raise ValueError("Datasets %s have different lengths."%repr(list(keys)))
+
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.chunks_mixed = chunks_mixed
+        self.prefetch = prefetch
+        self.threads = threads
+        self.drop_last = drop_last
+        self.rng = rng
+
+        # a read of the biggest chunk touches as few chunks of the others as possible
+        dset = max(self.dsets, key=lambda dset : dset.dtype.itemsize * np.prod(dset.shape[1:]))
+        self.chunk_rows = dset.chunks[0] if dset.chunks else batch_size
+
+        self.decoders = None
+        if decode:
+            self.decoders = [ ExampleDecoder(dset, dtype)
+                              for dset, dtype in zip(self.dsets, dtypes or [None] * len(keys)) ]
+        elif dtypes:
+            raise ValueError("The dtypes cannot be changed without decoding.")
+
+        self.transforms = None
+        if symmetries:
+            if self.decoders is not None:
+                self.transforms = [ decoder.symmetry_transform() for decoder in self.decoders ]
+            else:
+                self.transforms = map(symmetry.SymmetryTransform.from_dataset, self.dsets)
+
+        self.stop = None
+        self.producer = None
+
+    def __len__(self):
+        if self.drop_last:
+            return self.size // self.batch_size
+        return (self.size + self.batch_size - 1) // self.batch_size
+
+    def read_chunk(self, start):
+        end = min(start + self.chunk_rows, self.size)
+        arrays = [ dset[start:end] for dset in self.dsets ]
+        if self.decoders is not None:
+            arrays = [ decoder.decode(a) for decoder, a in zip(self.decoders, arrays) ]
+        return arrays
+
+    def iter_groups(self, read_chunks):
+        """
+        Yields the lists of arrays of `chunks_mixed` chunks.
+
+        :param read_chunks: function reading the chunks starting at the given rows
+        """
+        starts = np.arange(0, self.size, self.chunk_rows)
+        if self.shuffle:
+            self.rng.shuffle(starts)
+
+        for first in xrange(0, len(starts), self.chunks_mixed):
+            group = starts[first:first + self.chunks_mixed]
+            chunks = read_chunks(group)
+            yield [ np.concatenate(arrays) for arrays in zip(*chunks) ]
+
+    def iter_batches(self, read_chunks):
+        rest = None
+        for arrays in self.iter_groups(read_chunks):
+            if rest is not None:
+                arrays = [ np.concatenate([r, a]) for r, a in zip(rest, arrays) ]
+            if self.shuffle:
+                perm = self.rng.permutation(len(arrays[0]))
+                arrays = [ a[perm] for a in arrays ]
+
+            full = len(arrays[0]) - len(arrays[0]) % self.batch_size
+            for start in xrange(0, full, self.batch_size):
+                yield [ a[start:start + self.batch_size] for a in arrays ]
+            rest = [ a[full:] for a in arrays ]
+
+        if rest is not None and len(rest[0]) and not self.drop_last:
+            yield rest
+
+    def produce(self, queue, stop):
+        workers = ThreadPool(self.threads)
+        read_chunks = lambda starts : workers.map(self.read_chunk, starts)
+        try:
+            for batch in self.iter_batches(read_chunks):
+                if self.transforms is not None:
+                    batch = symmetry.random_symmetries(batch, self.transforms, self.rng)
+                if not put(queue, batch, stop):
+                    return
+            put(queue, _END, stop)
+        except Exception as e:
+            put(queue, e, stop)
+        finally:
+            workers.terminate()
+
+    def __iter__(self):
+        self.close_producer()
+        queue = Queue(maxsize=self.prefetch)
+        self.stop = threading.Event()
+        self.producer = threading.Thread(target=self.produce, args=(queue, self.stop))
+        self.producer.daemon = True
+        self.producer.start()
+
+        while True:
+            batch = queue.get()
+            if batch is _END:
+                return
+            if isinstance(batch, Exception):
+                raise batch
+            yield batch
+
+    def close_producer(self):
+        if self.producer is not None:
+            self.stop.set()
+            self.producer.join()
+            self.producer = None
+
+    def close(self):
+        self.close_producer()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def put(queue, item, stop):
+    """
+    Puts the item to the queue, unless the stop is set while waiting.
+
+    :returns: whether the item was put
+    """
+    while not stop.is_set():
+        try:
+            queue.put(item, timeout=0.1)
+            return True
+        except Full:
+            pass
+    return False
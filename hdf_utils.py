@@ -1,12 +1,38 @@
 #!/usr/bin/env python
 from __future__ import print_function
 
+import os
+import re
+import sys
+import argparse
+import tempfile
 import h5py
+import numpy as np
 from collections import namedtuple
 
 HdfLoc = namedtuple('HdfDestination', ['filename', 'xkey', 'ykey'])
+# any number of aligned datasets, e.g. HdfData('dataset.hdf5', ['xs_detlefko', 'ys'])
+HdfData = namedtuple('HdfData', ['filename', 'keys'])
 SplitTo = namedtuple('SplitTo', ['dest', 'at'])
 
+# index of the first example of each game, as stored by make_dataset.py
+GAME_STARTS = 'game_starts'
+
+
+def dataset_keys(loc):
+    if isinstance(loc, HdfData):
+        return list(loc.keys)
+    return [loc.xkey, loc.ykey]
+
+
+def dataset_size(dsets):
+    size = dsets[0].shape[0]
+    for dset in dsets:
+        if dset.shape[0] != size:
+            raise ValueError("Datasets %s have different lengths."
+                             % [dset.name for dset in dsets])
+    return size
+
 
 def print_stats(files):
     def print_one_obj(key, obj):
@@ -45,127 +71,608 @@ def append_data(source, dest, start, end):
     return add
 
 
-def open_copy_output(dest, orig_x, orig_y):
-    fout = h5py.File(dest.filename, 'a')
-    dset_x = fout.create_dataset(dest.xkey,
-                                 (0,) + orig_x.shape[1:],
-                                 maxshape=(None,) + orig_x.shape[1:],
-                                 dtype=orig_x.dtype,
-                                 # we will have a lot of zeros in the data
-                                 compression='lzf')
-
-    dset_y = fout.create_dataset(dest.ykey,
-                                 (0,) + orig_y.shape[1:],
-                                 maxshape=(None,) + orig_y.shape[1:],
-                                 dtype=orig_y.dtype,
-                                 # we will have a lot of zeros in the data
-                                 compression='lzf')
-
-    copy_attrs(orig_x, dset_x)
-    copy_attrs(orig_y, dset_y)
-
-    return dset_x, dset_y, fout
+# filters of the chunked datasets, kept by the copies (see create_copy)
+FILTER_PROPERTIES = ['compression', 'compression_opts', 'shuffle', 'fletcher32', 'scaleoffset']
+
+
+def parse_compression(spec):
+    """
+    :param spec: 'same' (as the source), 'none', 'lzf', 'gzip' or 'gzip0' to 'gzip9'
+    :returns: kwargs of the compression for create_copy, None for 'same'
+    """
+    if spec == 'same':
+        return None
+    if spec == 'none':
+        return {}
+    if spec == 'lzf':
+        return {'compression': 'lzf'}
+    m = re.match(r'\Agzip([0-9]?)\Z', spec)
+    if not m:
+        raise ValueError("Unknown compression '%s'." % spec)
+    kwargs = {'compression': 'gzip'}
+    if m.group(1):
+        kwargs['compression_opts'] = int(m.group(1))
+    return kwargs
+
+
+def create_copy(fout, key, orig, compression=None):
+    """
+    Creates an empty resizable dataset for the examples of the orig,
+    with the same chunks and compression, if the orig is chunked.
+
+    :param compression: kwargs of the compression (see parse_compression),
+                        None keeps the compression of the orig
+    """
+    kwargs = {}
+    if compression is not None:
+        kwargs['chunks'] = orig.chunks or True
+        kwargs.update(compression)
+    elif orig.chunks:
+        kwargs['chunks'] = orig.chunks
+        for prop in FILTER_PROPERTIES:
+            if getattr(orig, prop):
+                kwargs[prop] = getattr(orig, prop)
+    else:
+        # we will have a lot of zeros in the data
+        kwargs['compression'] = 'lzf'
+
+    dset = fout.create_dataset(key,
+                               (0,) + orig.shape[1:],
+                               maxshape=(None,) + orig.shape[1:],
+                               dtype=orig.dtype,
+                               **kwargs)
+    copy_attrs(orig, dset)
+
+    return dset
+
+
+def open_copy_output(dest, origs, compression=None):
+    keys = dataset_keys(dest)
+    if len(keys) != len(origs):
+        raise ValueError("%d datasets cannot be copied to %s." % (len(origs), keys))
 
+    fout = h5py.File(dest.filename, 'a')
+    dsets = [create_copy(fout, key, orig, compression) for key, orig in zip(keys, origs)]
+
+    return dsets, fout
+
+
+def game_starts_between(starts, start, end):
+    """
+    :returns: starts of the games in rows start:end, relative to the start;
+              the game cut by the start (if any) starts at 0
+    """
+    inside = starts[(starts >= start) & (starts < end)] - start
+    if end > start and (not len(inside) or inside[0] != 0):
+        inside = np.concatenate([[0], inside])
+    return inside
+
+
+def store_game_starts(fout, starts):
+    if GAME_STARTS not in fout:
+        fout.create_dataset(GAME_STARTS, data=np.asarray(starts, dtype='int64'),
+                            maxshape=(None,))
+
+
+def merged_game_starts(fins, sizes):
+    """
+    :returns: game starts of the concatenation of the files,
+              None if some of them has no game starts
+    """
+    if not all(GAME_STARTS in fin for fin in fins):
+        return None
+    offsets = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    return np.concatenate([fin[GAME_STARTS][:] + offset for fin, offset in zip(fins, offsets)])
+
+
+def copy_rows(source, dest, start, end, blocksize=100000):
+    """
+    Appends rows start:end of the source to the dest, by blocks of rows.
+    """
+    added = 0
+    while start < end:
+        added += append_data(source, dest, start, min(start + blocksize, end))
+        start += blocksize
+    return added
+
+
+def split_points(total, sizes, game_starts=None, chunk_rows=None):
+    """
+    Converts the sizes of the splits to the rows where they start and end.
+
+    :param sizes: list of the sizes, ratios of the total (floats, e.g. 0.9),
+                  numbers of rows (ints), at most one None for the rest;
+                  the rows after the splits are left out
+    :param game_starts: the splits are moved to the nearest game starts, so that
+                        no game is in two splits
+    :param chunk_rows: without the game_starts, the splits are moved to the nearest
+                       multiples of the chunk_rows, so that no chunk of the source
+                       is read for two splits
+    :returns: list of the rows, the split i is rows points[i]:points[i + 1]
+    """
+    if sum(size is None for size in sizes) > 1:
+        raise ValueError("At most one of the splits can take the rest.")
+
+    rows = [total * size if isinstance(size, float) else size for size in sizes]
+    fixed = sum(r for r in rows if r is not None)
+    rows = [total - fixed if r is None else r for r in rows]
+    if any(r < 0 for r in rows) or int(round(fixed)) > total:
+        raise ValueError("Splits %s do not fit in %d rows." % (sizes, total))
+
+    points = [0] + [int(round(point)) for point in np.cumsum(rows)]
+    if game_starts is not None:
+        bounds = np.union1d(game_starts, [0, total])
+        for i, point in enumerate(points):
+            right = np.searchsorted(bounds, point)
+            if bounds[right] != point:
+                left = right - 1
+                points[i] = int(bounds[left] if point - bounds[left] <= bounds[right] - point
+                                else bounds[right])
+    elif chunk_rows:
+        points = [point if point == total
+                  else min(total, int(round(float(point) / chunk_rows)) * chunk_rows)
+                  for point in points]
+    return points
+
+
+def copy_rows_all(sources, dests, start, end, blocksize):
+    added = [copy_rows(source, dest, start, end, blocksize)
+             for source, dest in zip(sources, dests)]
+    assert len(set(added)) == 1
+
+
+def split_rows(source, outputs, points, compression=None, blocksize=100000):
+    """
+    Copies the rows points[i]:points[i + 1] of the source to the outputs[i].
+    The source is read once, in order, by blocks of whole chunks; each block
+    is appended to the outputs it overlaps. The copy is sequential, h5py
+    serializes all the calls to the HDF5 library (reads, compression, writes)
+    anyway.
+
+    :param outputs: list of HdfLocs or HdfDatas, more can be in the same file
+    :param compression: kwargs of the compression (see parse_compression),
+                        None keeps the compression of the source
+    """
+    assert len(points) == len(outputs) + 1
+    for dest in outputs:
+        if os.path.abspath(dest.filename) == os.path.abspath(source.filename):
+            raise ValueError("Cannot split into the source file '%s'." % source.filename)
 
-def split(source, splits, blocksize=100000):
     fin = h5py.File(source.filename, 'r')
-    dshape_x = fin[source.xkey].shape
-    dshape_y = fin[source.ykey].shape
+    dsets = [fin[key] for key in dataset_keys(source)]
+    dataset_size(dsets)
+
+    fouts, outs = {}, []
+    try:
+        for dest in outputs:
+            path = os.path.abspath(dest.filename)
+            if path not in fouts:
+                fouts[path] = h5py.File(dest.filename, 'a')
+            keys = dataset_keys(dest)
+            if len(keys) != len(dsets):
+                raise ValueError("%d datasets cannot be copied to %s." % (len(dsets), keys))
+            outs.append([create_copy(fouts[path], key, dset, compression)
+                         for key, dset in zip(keys, dsets)])
+
+        step = block_rows(dsets[0], blocksize)
+        for start in range(points[0] - points[0] % step, points[-1], step):
+            for dests, begin, end in zip(outs, points[:-1], points[1:]):
+                begin, end = max(begin, start), min(end, start + step)
+                if begin < end:
+                    copy_rows_all(dsets, dests, begin, end, blocksize)
+
+        if GAME_STARTS in fin:
+            starts = fin[GAME_STARTS][:]
+            paths = [os.path.abspath(dest.filename) for dest in outputs]
+            for path, begin, end in zip(paths, points[:-1], points[1:]):
+                # more outputs in the file would need more game starts
+                if paths.count(path) == 1:
+                    store_game_starts(fouts[path], game_starts_between(starts, begin, end))
+    finally:
+        for fout in fouts.values():
+            fout.close()
+        fin.close()
+
+
+def split_sizes(source, outputs, sizes, games=False, compression=None, blocksize=100000):
+    """
+    Splits the source to the outputs by the sizes (see split_points),
+    with games=True at the game starts stored by make_dataset.py,
+    at the chunk boundaries of the source otherwise.
+    """
+    with h5py.File(source.filename, 'r') as fin:
+        dsets = [fin[key] for key in dataset_keys(source)]
+        total = dataset_size(dsets)
+        chunk_rows = dsets[0].chunks[0] if dsets[0].chunks else None
+        game_starts = None
+        if games:
+            if GAME_STARTS not in fin:
+                raise ValueError("The source '%s' has no dataset '%s', cannot split by games."
+                                 % (source.filename, GAME_STARTS))
+            game_starts = fin[GAME_STARTS][:]
+
+    split_rows(source, outputs, split_points(total, sizes, game_starts, chunk_rows),
+               compression, blocksize)
 
-    lx, ly = dshape_x[0], dshape_y[0]
-    assert lx == ly
 
-    start = 0
+def split(source, splits, blocksize=100000):
+    """
+    Splits the source by SplitTos, each of them ends at the row `at`
+    (-1 for the end of the source), the splits after the end are left out.
+    """
+    with h5py.File(source.filename, 'r') as fin:
+        total = dataset_size([fin[key] for key in dataset_keys(source)])
+
+    outputs, points = [], [0]
     for current_split in splits:
-        dset_x, dset_y, fout = open_copy_output(current_split.dest, fin[source.xkey], fin[source.ykey])
-        # print split.dest.filename
-
-        finsize = min(dshape_x[0], current_split.at if current_split.at >= 0 else dshape_x[0])
-        while start < finsize:
-            end = min(start + blocksize, finsize)
-            # print start, end, finsize
-            added_x = append_data(fin[source.xkey], dset_x, start, end)
-            added_y = append_data(fin[source.ykey], dset_y, start, end)
-            # TODO we should really check for exceptions in append data
-            # and rollback the block in case of failure
-            assert added_x == added_y
-
-            start += blocksize
-
-        fout.close()
-
+        outputs.append(current_split.dest)
+        end = min(total, current_split.at if current_split.at >= 0 else total)
+        points.append(max(points[-1], end))
         # we have walked through the whole input file
-        if start >= dshape_x[0]:
+        if points[-1] >= total:
             break
 
-        # we just finished last split
-        # so continue from where we left off
-        start = finsize
-        assert start < dshape_x[0]
+    split_rows(source, outputs, points, blocksize=blocksize)
 
 
-def merge(target, sources, blocksize=100000):
-    assert len(sources) >= 2
+def copy_whole(fout, key, orig, compression=None):
+    """
+    Copies the whole orig to a new dataset by h5py's copy (H5Ocopy), which
+    copies the compressed chunks as they are, if the copy is resizable
+    and keeps the compression.
 
-    dset_x, dset_y, fout = None, None, None
-    for source in sources:
-        fin = h5py.File(source.filename, 'r')
-        dshape_x = fin[source.xkey].shape
-        dshape_y = fin[source.ykey].shape
+    :returns: the new dataset, or None if it cannot be copied this way
+    """
+    if compression is not None or not orig.chunks or orig.maxshape[0] is not None:
+        return None
+    fout.copy(orig, key)
+    return fout[key]
 
-        lx, ly = dshape_x[0], dshape_y[0]
-        assert lx == ly
 
-        if fout is None:
-            dset_x, dset_y, fout = open_copy_output(target, fin[source.xkey], fin[source.ykey])
+def merge(target, sources, blocksize=100000, compression=None):
+    """
+    Concatenates the sources to the target. The first source is copied whole
+    if possible (see copy_whole), the others are appended by blocks of rows.
+    """
+    assert len(sources) >= 2
 
-        # we append the source onto fout
-        start, finsize = 0, lx
-        while start < finsize:
-            end = min(start + blocksize, finsize)
-            # print start, end, finsize
+    dsets, fout = None, None
+    fins = [h5py.File(source.filename, 'r') for source in sources]
+    try:
+        sizes = []
+        for source, fin in zip(sources, fins):
+            source_dsets = [fin[key] for key in dataset_keys(source)]
+            size = dataset_size(source_dsets)
+
+            if fout is None:
+                keys = dataset_keys(target)
+                if len(keys) != len(source_dsets):
+                    raise ValueError("%d datasets cannot be copied to %s."
+                                     % (len(source_dsets), keys))
+                fout = h5py.File(target.filename, 'a')
+                dsets = [copy_whole(fout, key, dset, compression)
+                         for key, dset in zip(keys, source_dsets)]
+                if all(dset is not None for dset in dsets):
+                    sizes.append(size)
+                    continue
+                # all the datasets are copied the same way
+                for key, dset in zip(keys, dsets):
+                    if dset is not None:
+                        del fout[key]
+                dsets = [create_copy(fout, key, dset, compression)
+                         for key, dset in zip(keys, source_dsets)]
+
+            # we append the source onto fout
+            copy_rows_all(source_dsets, dsets, 0, size, blocksize)
+            sizes.append(size)
+
+        starts = merged_game_starts(fins, sizes)
+        if starts is not None:
+            store_game_starts(fout, starts)
+    finally:
+        if fout is not None:
+            fout.close()
+        for fin in fins:
+            fin.close()
+
+
+def merge_virtual(target, sources):
+    """
+    Merges the sources without copying the data, the target datasets
+    are virtual datasets over the datasets of the sources, which must stay
+    in place (the paths are relative to the directory of the target).
+    """
+    assert len(sources) >= 2
+
+    fins = [h5py.File(source.filename, 'r') for source in sources]
+    target_dir = os.path.dirname(os.path.abspath(target.filename))
+    with h5py.File(target.filename, 'a') as fout:
+        for i, key in enumerate(dataset_keys(target)):
+            dsets = [fin[dataset_keys(source)[i]] for fin, source in zip(fins, sources)]
+            shape, dtype = dsets[0].shape[1:], dsets[0].dtype
+            for dset in dsets:
+                assert dset.shape[1:] == shape and dset.dtype == dtype
+
+            layout = h5py.VirtualLayout(shape=(sum(dset.shape[0] for dset in dsets),) + shape,
+                                        dtype=dtype)
+            start = 0
+            for source, dset in zip(sources, dsets):
+                size = dset.shape[0]
+                filename = os.path.relpath(os.path.abspath(source.filename), target_dir)
+                layout[start:start + size] = h5py.VirtualSource(filename, dset.name,
+                                                                shape=dset.shape)
+                start += size
+
+            copy_attrs(dsets[0], fout.create_virtual_dataset(key, layout))
+
+        sizes = [fin[dataset_keys(source)[0]].shape[0] for fin, source in zip(fins, sources)]
+        starts = merged_game_starts(fins, sizes)
+        if starts is not None:
+            store_game_starts(fout, starts)
+
+    for fin in fins:
+        fin.close()
+
+
+def example_nbytes(dsets):
+    return sum(dset.dtype.itemsize * int(np.prod(dset.shape[1:])) for dset in dsets)
+
+
+def block_rows(dset, rows):
+    """
+    Number of rows to read at once, rounded down to whole chunks of the dataset.
+    """
+    if dset.chunks and rows >= dset.chunks[0]:
+        return rows - rows % dset.chunks[0]
+    return max(1, rows)
+
+
+def append_arrays(dsets, arrays):
+    for dset, data in zip(dsets, arrays):
+        add = data.shape[0]
+        dset.resize((dset.shape[0] + add,) + dset.shape[1:])
+        dset[-add:] = data
+
+
+# fewest rows in a chunk of the bucket datasets of shuffle, smaller chunks make
+# the scatter (and the reads of the buckets) slow; when the memory does not allow
+# more buckets, a bucket which is still too big is scattered again
+MIN_CHUNK_ROWS = 256
+
+
+def scatter(dsets, buckets, tmpfile, rows, rng):
+    """
+    Distributes the rows of the datasets to random buckets in the tmpfile.
+    Half of the `rows` are read at once, the other half buffers the rows
+    of the buckets, which are appended by whole chunks of the bucket datasets.
+
+    :returns: list of the buckets, lists of the datasets
+    """
+    chunk = max(1, rows // (2 * buckets))
+    out = [[tmpfile.create_dataset('%d/%d' % (bucket, i), (0,) + dset.shape[1:],
+                                   maxshape=(None,) + dset.shape[1:], dtype=dset.dtype,
+                                   chunks=(chunk,) + dset.shape[1:], compression='lzf')
+            for i, dset in enumerate(dsets)]
+           for bucket in range(buckets)]
+    buffers = [[np.empty((chunk,) + dset.shape[1:], dtype=dset.dtype) for dset in dsets]
+               for bucket in range(buckets)]
+    buffered = [0] * buckets
+
+    size = dsets[0].shape[0]
+    step = block_rows(dsets[0], max(1, rows // 2))
+    for start in range(0, size, step):
+        arrays = [dset[start:start + step] for dset in dsets]
+        which = rng.randint(buckets, size=len(arrays[0]))
+        order = np.argsort(which, kind='mergesort')
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(which, minlength=buckets))])
+        arrays = [data[order] for data in arrays]
+        for bucket in range(buckets):
+            begin, end = bounds[bucket], bounds[bucket + 1]
+            while begin < end:
+                add = min(end - begin, chunk - buffered[bucket])
+                for buf, data in zip(buffers[bucket], arrays):
+                    buf[buffered[bucket]:buffered[bucket] + add] = data[begin:begin + add]
+                buffered[bucket] += add
+                begin += add
+                if buffered[bucket] == chunk:
+                    append_arrays(out[bucket], buffers[bucket])
+                    buffered[bucket] = 0
+
+    for bucket in range(buckets):
+        if buffered[bucket]:
+            append_arrays(out[bucket], [buf[:buffered[bucket]] for buf in buffers[bucket]])
+
+    return out
+
+
+def shuffle_rows(dsets, outs, rows, tmpdir, rng):
+    """
+    Appends the rows of the datasets to the outs, in a random order.
+    At most `rows` rows are in memory at once, the datasets bigger than
+    that are first scattered to random buckets, which are shuffled
+    in turn (recursively, if a bucket is still too big).
+    """
+    size = dsets[0].shape[0]
+    if not size:
+        return
+    if size <= rows:
+        arrays = [dset[:] for dset in dsets]
+        perm = rng.permutation(size)
+        append_arrays(outs, [data[perm] for data in arrays])
+        return
+
+    # half the memory, so that the buckets which happen to be bigger
+    # than average still fit, but at most as many buckets as allow
+    # the chunks of MIN_CHUNK_ROWS in the buffers of scatter
+    buckets = -(-size // max(1, rows // 2))
+    buckets = max(2, min(buckets, rows // (2 * MIN_CHUNK_ROWS)))
+    fd, tmpname = tempfile.mkstemp(prefix='shuffle_', suffix='.hdf', dir=tmpdir)
+    os.close(fd)
+    try:
+        with h5py.File(tmpname, 'w') as tmpfile:
+            for bucket_dsets in scatter(dsets, buckets, tmpfile, rows, rng):
+                shuffle_rows(bucket_dsets, outs, rows, tmpdir, rng)
+    finally:
+        os.unlink(tmpname)
+
+
+def shuffle(source, target, memory=1024 * 1024 * 1024, tmpdir=None, rng=np.random,
+            compression=None):
+    """
+    Shuffles the examples of the source to the target, the xs and ys
+    (or all the datasets of HdfData) together. Datasets bigger than the memory
+    (in bytes) are shuffled through temporary files in the tmpdir
+    (the directory of the target by default).
+    """
+    if os.path.abspath(source.filename) == os.path.abspath(target.filename):
+        raise ValueError("Cannot shuffle into the source file '%s'." % source.filename)
 
-            added_x = append_data(fin[source.xkey], dset_x, start, end)
-            added_y = append_data(fin[source.ykey], dset_y, start, end)
-            assert added_x == added_y
+    fin = h5py.File(source.filename, 'r')
+    dsets = [fin[key] for key in dataset_keys(source)]
+    dataset_size(dsets)
+    if tmpdir is None:
+        tmpdir = os.path.dirname(os.path.abspath(target.filename))
+
+    outs, fout = open_copy_output(target, dsets, compression)
+    # the data read, and its permuted copy
+    rows = max(1, memory // (2 * example_nbytes(dsets)))
+    shuffle_rows(dsets, outs, rows, tmpdir, rng)
+
+    fout.close()
+    fin.close()
+
+
+def parse_split_output(arg):
+    """
+    Reads OUTPUT:SIZE, the size is a ratio (0.9), percent (90%), number of rows
+    (10000), or * for the rest.
+    """
+    filename, sep, size = arg.rpartition(':')
+    if not sep or not filename:
+        raise argparse.ArgumentTypeError("Expected OUTPUT:SIZE, got '%s'." % arg)
+    try:
+        if size == '*':
+            return filename, None
+        if size.endswith('%'):
+            return filename, float(size[:-1]) / 100
+        if '.' in size:
+            return filename, float(size)
+        return filename, int(size)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid size '%s' of '%s'." % (size, filename))
+
+
+def keys_list(arg):
+    return [key for key in arg.split(',') if key]
+
+
+# short names of the commands
+ALIASES = {
+    'i': ['identify'],
+    's': ['split'],
+    'sh': ['shuffle'],
+    'm': ['merge'],
+    'v': ['merge', '--virtual'],
+    'vmerge': ['merge', '--virtual'],
+}
+
+
+def parse_args(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv and argv[0].lower() in ALIASES:
+        argv = ALIASES[argv[0].lower()] + argv[1:]
+
+    parser = argparse.ArgumentParser(
+                description='Inspects, splits, merges and shuffles the hdf datasets.'
+                            ' The aligned datasets (e.g. xs and ys) are processed together.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    identify = subparsers.add_parser('identify', help='print info of groups in the hdf files')
+    identify.add_argument('files', metavar='FILE', nargs='+')
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-k', '--keys', type=keys_list, default=['xs', 'ys'],
+                        help='comma separated names of the datasets, default xs,ys')
+    common.add_argument('--output-keys', dest='output_keys', type=keys_list, default=None,
+                        help='names of the datasets in the outputs, the same as --keys'
+                             ' by default')
+    common.add_argument('--compression', type=parse_compression, default=None,
+                        help='compression of the outputs: same (as the source),'
+                             ' none, lzf, gzip, gzip0 to gzip9; default same')
+    common.add_argument('--blocksize', type=int, default=100000,
+                        help='number of rows read at once')
+
+    split = subparsers.add_parser('split', parents=[common],
+                                  help='split the source into the outputs in one pass')
+    split.add_argument('source', metavar='SOURCE')
+    split.add_argument('outputs', metavar='OUTPUT:SIZE', nargs='+', type=parse_split_output,
+                       help='the output file and its size: ratio (0.9), percent (90%%),'
+                            ' number of rows (10000) or * for the rest,'
+                            ' in the order of the rows; rounded to the chunks'
+                            ' of the source')
+    split.add_argument('--games', action='store_true',
+                       help='split at the game starts stored by make_dataset.py,'
+                            ' so that no game is in two outputs (the sizes are'
+                            ' approximate)')
+
+    merge = subparsers.add_parser('merge', parents=[common],
+                                  help='concatenate the sources into the target')
+    merge.add_argument('target', metavar='TARGET')
+    merge.add_argument('sources', metavar='SOURCE', nargs='+')
+    merge.add_argument('--virtual', action='store_true',
+                       help='make virtual datasets, without copying the data')
+
+    shuffle = subparsers.add_parser('shuffle', parents=[common],
+                                    help='shuffle the examples of the source to the target')
+    shuffle.add_argument('source', metavar='SOURCE')
+    shuffle.add_argument('target', metavar='TARGET')
+    shuffle.add_argument('memory', metavar='MEMORY', type=int, nargs='?', default=1024,
+                         help='memory used (in MB), bigger datasets are shuffled through'
+                              ' temporary files; default 1024')
+    shuffle.add_argument('--tmpdir', default=None,
+                         help='directory of the temporary files, the directory of the'
+                              ' target by default')
+
+    args = parser.parse_args(argv)
+    if args.command == 'merge' and len(args.sources) < 2:
+        parser.error("merge needs at least two sources")
+    if args.command != 'identify':
+        if args.output_keys is None:
+            args.output_keys = args.keys
+        if len(args.output_keys) != len(args.keys):
+            parser.error("--output-keys must have as many names as --keys")
+        if args.command == 'merge' and args.virtual and args.compression is not None:
+            parser.error("virtual datasets cannot be compressed")
+    return args
 
-            start += blocksize
 
-    if fout is not None:
-        fout.close()
+def main():
+    ## ARGS
+    args = parse_args()
 
+    if args.command == 'identify':
+        print_stats(args.files)
 
+    elif args.command == 'split':
+        split_sizes(HdfData(args.source, args.keys),
+                    [HdfData(filename, args.output_keys) for filename, _ in args.outputs],
+                    [size for _, size in args.outputs],
+                    games=args.games, compression=args.compression,
+                    blocksize=args.blocksize)
 
-def usage():
-    print("""%s <command> [args]
-Command can be one of:
-    i, identify     print info of groups in the hdf files [args]
-    s, split        args:
-    """)
+    elif args.command == 'merge':
+        sources = [HdfData(filename, args.keys) for filename in args.sources]
+        if args.virtual:
+            merge_virtual(HdfData(args.target, args.output_keys), sources)
+        else:
+            merge(HdfData(args.target, args.output_keys), sources,
+                  blocksize=args.blocksize, compression=args.compression)
 
+    elif args.command == 'shuffle':
+        shuffle(HdfData(args.source, args.keys), HdfData(args.target, args.output_keys),
+                memory=args.memory * 1024 * 1024, tmpdir=args.tmpdir,
+                compression=args.compression)
 
-"""
-def main():
-    ## ARGS
-    args = parse_args()
-"""
 
 if __name__ == "__main__":
-    import sys
-
-    argc, argv = len(sys.argv), sys.argv
-    if argc > 2 and argv[1].lower() in ['i', 'identify']:
-        print_stats(argv[2:])
-
-    if argc >= 2 and argv[1].lower() in ['s', 'split']:
-        split(HdfLoc('gokifu_1_20000.hdf', 'xs', 'ys'),
-              #[SplitTo(HdfLoc('gokifu_validation.hdf', 'xs', 'ys'), 200000),
-              [SplitTo(HdfLoc('output_0.hdf', 'foo/xs1', 'foo/ys1'), 10),
-               SplitTo(HdfLoc('output_0.hdf', 'foo/xs2', 'foo/ys2'), 17),
-               ],
-              blocksize=4)
-
-    if argc >= 5 and argv[1].lower() in ['m', 'merge']:
-        target, rest = argv[2], argv[3:]
-        merge(HdfLoc(target, 'xs', 'ys'),
-              [HdfLoc(t, 'xs', 'ys') for t in rest])
+    main()
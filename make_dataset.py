@@ -1,34 +1,46 @@
 #!/usr/bin/env python
 
+import os
 import sys
+import time
 import logging
 import multiprocessing
-from itertools import imap, chain, islice
+from itertools import imap, chain
+from collections import namedtuple
 import argparse
 import numpy as np
 
 import h5py
-import gomill
-import gomill.sgf, gomill.sgf_moves
-from gomill.gtp_states import History_move
 
-from deepgo import cubes, state, rank
+from deepgo import cubes, rank, backends, encoding
+from deepgo.encoding import Layout, SlotRef, SharedRing, GameCache, SchedulerStats
+from deepgo.encoding import get_samples, make_layout, streaming_imap
+from deepgo.game_archive import GameArchive
+from deepgo import sgf_archives, symmetry
 
 """
 This reads sgf's from stdin, processes them in a parallel manner to extract
 pairs (cube_encoding_position, move_to_play) and writes the data into a file.
+The games are encoded by the workers in deepgo.encoding.
 
 Some comments about speed:
 
 Most time in workers is currently spent in routines for analysing the goban
-in the cubes submodule, where we analyse each position independently of
-the previous ones, while we could build strings/liberties data structures
-incrementaly and thus save resources.
+in the cubes submodule. The strings/liberties data structures are built
+incrementaly as the game is replayed (see deepgo.string_tracker), the rest
+of the analysis is done for each position independently of the previous ones.
 
 The workers do however scale up linearly with number of cores. What does not
 and what is the actual bottleneck on multicore machine (with slower & bigger
 cubes, such as the tian_zhu_2015 cube) is the serial HDF file io and compression
-in the master process. Truly parallel implementation using MPI is planned.
+in the master process. With --shards, each worker compresses and writes its
+examples into its own shard file, the master only collects the shard names and
+finally creates virtual datasets (HDF5 VDS) concatenating the shards.
+
+More planes and labels can be made in one run (e.g. -p detlefko,jm2017),
+each is stored into its own dataset and the positions are aligned across the
+datasets. The games are parsed and replayed only once and the board analysis
+of each position is shared by all the cubes (see backends.memoized).
 
 Currently, you can easily process 200 000 games in under a 24 hours on 4-core
 commodity laptop. The dataset is created (almost) only once and you will
@@ -36,156 +48,394 @@ probably be spending much more time training the CNN anyway.
 """
 
 
-def flatten(list_of_lists):
-    return chain.from_iterable(list_of_lists)
-
-def init_subprocess(plane, label, allowed_boardsizes, allowed_ranks):
-    global get_cube, get_label, board_filter, ranks_filter
-    get_cube = cubes.reg_cube[plane]
-    get_label = cubes.reg_label[label]
-    board_filter = lambda board : board.side in allowed_boardsizes
-
-    def filter_one_rank(rank):
-        if allowed_ranks is None:
-            return True
-        if not rank:
-            return None in allowed_ranks
-        return rank.key() in allowed_ranks
-
-    def ranks_filter(brwr):
-        return all(map(filter_one_rank, brwr))
-
-def get_rank(root_node, key):
-    try:
-        prop = root_node.get(key)
-    except:
-        return None
-
-    return rank.Rank.from_string(prop, True)
+# where the workers store their shards, see ShardWriter
+# prefix            shard filename prefix (the filename of the dataset)
+# names             names of the datasets in the shards, one for each layout
+# compression_kwargs, attrs, batch_size
+#                   passed to create_dataset(), attrs is a list of attrs
+#                   for each of the datasets
+# buffer_rows       passed to BufferedDataset
+ShardSpec = namedtuple('ShardSpec', 'prefix names compression_kwargs attrs'
+                                    ' batch_size buffer_rows')
 
-def process_game(sgf_fn):
-    sgf_fn = sgf_fn.strip()
-    try :
-        with open(sgf_fn, 'r') as fin:
-            game = gomill.sgf.Sgf_game.from_string(fin.read())
+# target size of a chunk in bytes, the size of the default HDF5 chunk cache
+CHUNK_BYTES = 1024 * 1024
 
-        logging.info("Processing '%s'"%sgf_fn)
-        board, moves = gomill.sgf_moves.get_setup_and_moves(game)
-
-    except Exception as e:
-        logging.warn("Error processing '%s': %s"%(sgf_fn, str(e)))
-        return None
+# dataset with the index of the first example of each game, so that
+# the datasets can be split at the game boundaries (see hdf_utils.py split)
+GAME_STARTS = 'game_starts'
+GAME_STARTS_LAYOUT = Layout((), np.dtype('int64'), (), np.dtype('int64'))
 
+def flatten(list_of_lists):
+    return chain.from_iterable(list_of_lists)
 
-    if not board_filter(board) or not moves:
-        logging.info("Skipping game '%s': boardsize not allowed"%(sgf_fn))
-        return None
+def dataset_names(xname, yname, planes, labels):
+    """
+    Names of the datasets for the planes and labels, the name of the plane
+    (label) is appended if there is more of them, e.g. xs_detlefko, xs_jm2017.
+    """
+    def names(name, encodings):
+        if len(encodings) == 1:
+            return [name]
+        return [ '%s_%s'%(name, enc) for enc in encodings ]
 
-    root = game.get_root()
-    ranks = rank.BrWr(get_rank(root, 'BR'),
-                      get_rank(root, 'WR'))
+    return names(xname, planes) + names(yname, labels)
 
-    if not ranks_filter(ranks):
-        logging.info("Skipping game '%s': rank not allowed"%(sgf_fn))
-        return None
+def example_nbytes(layout):
+    return np.dtype(layout.dtype).itemsize * int(np.prod(layout.shape))
 
-    Xs = []
-    ys = []
+def chunk_rows(layout, batch_size):
+    """
+    Number of examples in a chunk of the dataset. This is a multiple of the
+    batch_size, so that reading a batch touches as few chunks as possible, and
+    the chunk is at most CHUNK_BYTES big, unless the batch itself is bigger.
+    """
+    return batch_size * max(1, CHUNK_BYTES // (batch_size * example_nbytes(layout)))
 
-    ko_move = None
-    history = []
-    for num, (player, move) in enumerate(moves):
-        # pass
-        if not move:
-            break
+def get_buffer_rows(layouts, buffer_size):
+    """
+    Number of examples in BufferedDataset buffers, s.t. the buffers for all
+    the layouts take `buffer_size` bytes together.
+    """
+    return max(1, buffer_size // sum(example_nbytes(layout) for layout in layouts))
+
+def dataset_attrs(name, boardsize, layout):
+    return {'name' : name,
+            'boardsize' : boardsize,
+            'original_dtype' : repr(layout.original_dtype),
+            'original_example_shape' : repr(layout.original_shape)}
+
+def create_dataset(f, name, layout, compression_kwargs, attrs, batch_size):
+    kwargs = {
+        # infinite number of examples
+        'maxshape' :(None,) + layout.shape,
+        'dtype' : layout.dtype,
+        'chunks' : (chunk_rows(layout, batch_size),) + layout.shape,
+    }
+    kwargs.update(compression_kwargs)
+
+    dset = f.create_dataset(name, (0,) + layout.shape, **kwargs)
+    for key, value in attrs.iteritems():
+        dset.attrs[key] = value
+
+    return dset
+
+class BufferedDataset(object):
+    """
+    Appends examples to a resizable chunked dataset.
+
+    The examples are collected in an in-memory buffer of whole chunks and
+    written when the buffer is full, so that every write (except the last one)
+    covers whole chunks and the compressed chunks are never rewritten.
+    A flush() of a partly filled buffer (a checkpoint) writes the last chunk
+    partly, it stays in the buffer and is written again by the next write,
+    which starts at the chunk boundary.
+    The dataset is grown in large steps and trimmed to the number of examples
+    by close().
+    """
+    def __init__(self, dset, buffer_rows):
+        self.dset = dset
+        self.rows = dset.chunks[0]
+        self.buffer = np.empty((max(1, buffer_rows // self.rows) * self.rows,) + dset.shape[1:],
+                               dtype=dset.dtype)
+        # the buffer starts at a chunk boundary, the partial last chunk
+        # of the dataset (e.g. when resuming) is read into the buffer
+        self.buffered = dset.shape[0] % self.rows
+        self.start = dset.shape[0] - self.buffered
+        self.buffer[:self.buffered] = dset[self.start:]
+        # rows of the buffer which are already in the dataset
+        self.written = self.buffered
+
+    @property
+    def size(self):
+        return self.start + self.buffered
+
+    def append(self, block):
+        while len(block):
+            add = min(len(block), len(self.buffer) - self.buffered)
+            with encoding.profile.timed('store'):
+                self.buffer[self.buffered:self.buffered + add] = block[:add]
+            self.buffered += add
+            block = block[add:]
+
+            if self.buffered == len(self.buffer):
+                self.flush()
+
+    def flush(self):
+        if self.buffered == self.written:
+            return
+
+        end = self.size
+        if end > self.dset.shape[0]:
+            self.dset.resize((max(end, 2 * self.dset.shape[0]),) + self.dset.shape[1:])
+
+        with encoding.profile.timed('write'):
+            self.dset[self.start:end] = self.buffer[:self.buffered]
+
+        # the partial last chunk is kept for the next write
+        keep = self.buffered % self.rows
+        full = self.buffered - keep
+        self.buffer[:keep] = self.buffer[full:self.buffered]
+        self.start += full
+        self.buffered = self.written = keep
+
+    def close(self):
+        self.flush()
+        self.dset.resize((self.size,) + self.dset.shape[1:])
+
+def create_virtual_dataset(f, name, shards, layout, attrs):
+    """
+    Creates dataset `name`, which is a concatenation of datasets
+    of the same name in the shard files.
 
-        try:
-            # encode current position
-            s = state.State(board, ko_move, history, moves[num:len(moves)], ranks)
-            x = get_cube(s, player)
-            # get y data from future moves
-            # (usually only first element will be taken in account)
-            y = get_label(s, player)
-        except cubes.SkipGame as e:
-            logging.info("Skipping game '%s': %s"%(sgf_fn, str(e)))
-            return None
-        except Exception as e:
-            logging.exception("Error encoding '%s' - move %d"%(sgf_fn, num + 1))
-            # TODO Should we use the data we have already?
-            return None
+    :param shards: list of shard filenames
+    """
+    sizes = []
+    for filename in shards:
+        with h5py.File(filename, 'r') as fshard:
+            sizes.append(fshard[name].shape[0])
+
+    vlayout = h5py.VirtualLayout(shape=(sum(sizes),) + layout.shape, dtype=layout.dtype)
+    start = 0
+    for filename, size in zip(shards, sizes):
+        # shards are next to the file, relative paths are resolved
+        # relative to the file's directory
+        vsource = h5py.VirtualSource(os.path.basename(filename), name,
+                                     shape=(size,) + layout.shape)
+        vlayout[start:start + size] = vsource
+        start += size
+
+    dset = f.create_virtual_dataset(name, vlayout)
+    for key, value in attrs.iteritems():
+        dset.attrs[key] = value
+
+    return dset
+
+class Journal(object):
+    """
+    Durable record of the games stored in the dataset, so that an interrupted
+    build can be resumed.
 
-        # None skips
-        if x is not None and y is not None:
-            Xs.append(x)
-            ys.append(y)
+    The journal file lists the paths of the processed sgf files (stored or
+    skipped), each checkpoint is terminated by line '#checkpoint SIZE', where
+    SIZE is the number of examples in the datasets at the checkpoint.
+    Paths after the last checkpoint are not committed.
+    """
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.done, self.size = set(), 0
+        if resume and os.path.exists(filename):
+            self.done, self.size = Journal.read(filename)
+
+        # start with the committed part only
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as fout:
+            for path in sorted(self.done):
+                fout.write(path + '\n')
+            fout.write('#checkpoint %d\n'%self.size)
+            fout.flush()
+            os.fsync(fout.fileno())
+        os.rename(tmp, filename)
+
+        self.f = open(filename, 'a')
+        self.pending = []
+
+    @staticmethod
+    def read(filename):
+        """
+        :returns: set of the committed paths, size at the last checkpoint
+        """
+        done, size = set(), 0
+        pending = []
+        with open(filename, 'r') as fin:
+            for line in fin:
+                # unterminated line was not written completely
+                if not line.endswith('\n'):
+                    break
+                line = line[:-1]
+                if line.startswith('#checkpoint '):
+                    done.update(pending)
+                    pending = []
+                    size = int(line.split()[1])
+                else:
+                    pending.append(line)
+        return done, size
+
+    def add(self, path):
+        self.pending.append(path)
+
+    def checkpoint(self, size):
+        """
+        Commits the paths added since the last checkpoint, the data must
+        be already flushed to the disk.
+        """
+        for path in self.pending:
+            self.f.write(path + '\n')
+        self.f.write('#checkpoint %d\n'%size)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+        self.done.update(self.pending)
+        self.pending = []
+        self.size = size
+
+    def close(self):
+        self.f.close()
+
+def open_dataset(f, name, layout, size):
+    """
+    Opens existing dataset for resuming, removing examples after `size`.
+    """
+    dset = f[name]
+    if dset.shape[1:] != layout.shape or dset.dtype != layout.dtype:
+        raise RuntimeError("Dataset '%s' has shape %s and dtype %s, expected %s and %s."
+                           %(name, repr(dset.shape[1:]), dset.dtype,
+                             repr(layout.shape), layout.dtype))
+    if dset.shape[0] < size:
+        raise RuntimeError("Dataset '%s' has less examples than the journal says."%name)
+    dset.resize((size,) + dset.shape[1:])
+    return dset
+
+def open_game_starts(f, size):
+    """
+    Opens GAME_STARTS for resuming, removing the games after `size` examples.
 
-        row, col = move
-        try:
-            ko_move = board.play(row, col, player)
-        except Exception as e:
-            logging.warn("Error re-playing '%s' - move %d : '%s'"%(sgf_fn, num + 1, str(e)))
-            # this basically means that the game has illegal moves
-            # lets skip it altogether in case it is garbled
-            return None
-        history.append(History_move(player, move))
+    :returns: the dataset, or None if the dataset has no game starts
+    """
+    if GAME_STARTS not in f:
+        return None
 
-    return Xs, ys
+    dset = f[GAME_STARTS]
+    starts = dset[:]
+    # the dataset is grown in steps by BufferedDataset, the starts
+    # are increasing up to the end of the data written
+    written = len(starts)
+    decreasing = np.flatnonzero(np.diff(starts) <= 0)
+    if len(decreasing):
+        written = decreasing[0] + 1
+    dset.resize((np.searchsorted(starts[:written], size),))
+    return dset
+
+def merge_game_starts(f, shards, name):
+    """
+    Creates GAME_STARTS for the concatenation of the shards
+    (see create_virtual_dataset).
 
-def parse_rank_specification(s):
+    :param name: name of a dataset in the shards
     """
-    Parses info about rank specification, used to filter games by player's ranks.
-    Returns None (all ranks allowed),
-    or a set of possible values
-    (None as a possible value in the set means that we should include games without rank info)
+    starts, offset = [], 0
+    for filename in shards:
+        with h5py.File(filename, 'r') as fshard:
+            starts.append(fshard[GAME_STARTS][:] + offset)
+            offset += fshard[name].shape[0]
 
+    data = np.concatenate(starts) if starts else np.empty(0, dtype=GAME_STARTS_LAYOUT.dtype)
+    return f.create_dataset(GAME_STARTS, data=data, maxshape=(None,))
 
-    # returns None, all ranks possible
-    parse_rank_specification('')
+class ShardWriter(object):
+    """
+    Stores games encoded in a worker process into its own HDF5 file (shard),
+    so that the compression and file io is done by the workers in parallel,
+    instead of the master.
 
-    # returns set([1, 2, 3, None])), 1, 2, 3 allowed, as well as missing rank info
-    parse_rank_specification('1..3,')
+    The shard is created on the first append, so that idle workers do not
+    leave empty shards behind.
+    """
+    def __init__(self, filename, spec, layouts):
+        self.filename = filename
+        self.spec = spec
+        self.layouts = layouts
+        self.f = None
+        self.size = 0
+
+    def append(self, arrays):
+        """
+        :param arrays: examples for each of the layouts
+        """
+        if self.f is None:
+            self.f = h5py.File(self.filename, 'w')
+            self.writers = []
+            for name, layout, attrs in zip(self.spec.names, self.layouts, self.spec.attrs):
+                dset = create_dataset(self.f, name, layout, self.spec.compression_kwargs,
+                                      attrs, self.spec.batch_size)
+                self.writers.append(BufferedDataset(dset, self.spec.buffer_rows))
+            self.game_starts = BufferedDataset(create_dataset(self.f, GAME_STARTS,
+                                                              GAME_STARTS_LAYOUT,
+                                                              self.spec.compression_kwargs,
+                                                              {}, self.spec.batch_size), 1)
+
+        self.game_starts.append(np.array([self.size]))
+        for writer, block in zip(self.writers, arrays):
+            writer.append(block)
+        self.size += len(arrays[0])
+
+    def close(self):
+        if self.f is not None:
+            for writer in self.writers + [self.game_starts]:
+                writer.close()
+            self.f.close()
+            self.f = None
+
+def init_subprocess(shard, *initargs):
+    """
+    Sets up the worker (see deepgo.encoding.init_subprocess for the initargs)
+    and its ShardWriter.
 
-    # returns set([None])), only games WITHOUT rank info are allowed
-    parse_rank_specification(',')
+    :param shard: ShardSpec, or None if the examples are returned to the master
+    """
+    global shard_writer
+    encoding.init_subprocess(*initargs)
+
+    shard_writer = None
+    if shard is not None:
+        shard_writer = ShardWriter('%s.shard-%d'%(shard.prefix, os.getpid()),
+                                   shard, encoding.layouts)
+        # closed when the worker exits (see finish_subprocess for the master)
+        multiprocessing.util.Finalize(None, close_shard, exitpriority=10)
+
+def close_shard():
+    shard_writer.close()
+    # the last writes are done after the last profile was sent to the master
+    profile = encoding.profile
+    if profile.enabled and profile.times:
+        logging.info("Profile of closing the shard '%s':\n%s"%(shard_writer.filename,
+                                                               profile.report()))
+
+def finish_subprocess():
+    if shard_writer is not None:
+        shard_writer.close()
+
+def process_game_to_shard(item):
+    """
+    Processes the game and stores the examples into worker's shard.
 
-    See test for more examples.
+    :returns: None if the game was skipped, or pair
+              (shard filename, number of examples stored)
     """
-    if not s:
+    ret = encoding.process_game(item)
+    if not ret:
         return None
 
-    ret = []
-    s = s.replace(' ','')
-    categories = s.split(',')
-
-    for cat in categories:
-        cs = cat.split('..')
-        try:
-            if len(cs) == 1:
-                if not cs[0]:
-                    ret.append(None)
-                else:
-                    ret.append(int(cs[0]))
-            elif len(cs) == 2:
-                fr, to = map(int,cs)
-                if to < fr:
-                    raise RuntimeError('Empty range %s'%(cat))
+    size = len(ret[0])
+    if size:
+        shard_writer.append(ret)
+    return shard_writer.filename, size
 
-                ret.extend(range(fr, to+1))
-            else:
-                raise ValueError()
-
-        except ValueError:
-            raise RuntimeError('Could not parse rank info on token "%s"'%(cat))
-
-    return set(ret)
-
-class RankSpecAction(argparse.Action):
-    def __init__(self, option_strings, dest, nargs=None, **kwargs):
-        if nargs is not None:
-             raise ValueError("nargs not allowed")
-        super(RankSpecAction, self).__init__(option_strings, dest, **kwargs)
-    def __call__(self, parser, namespace, values, option_string=None):
-        setattr(namespace, self.dest, parse_rank_specification(values))
+def encodings_type(registry):
+    """
+    Argparse type of a comma separated list of the planes (labels)
+    registered in the `registry`.
+    """
+    def parse(s):
+        names = s.split(',')
+        for name in names:
+            if name not in registry:
+                raise argparse.ArgumentTypeError("invalid choice: '%s' (choose from %s)"
+                                                 %(name, ', '.join(sorted(registry))))
+        if len(set(names)) != len(names):
+            raise argparse.ArgumentTypeError("duplicate value in '%s'"%s)
+        return names
+    return parse
 
 
 def parse_args():
@@ -204,22 +454,31 @@ def parse_args():
     parser.add_argument('-y', '--y-name', dest='yname',
                         help='HDF5 dataset name to store the ys to',
                         default='ys')
-    parser.add_argument('-p', '--plane', type=str, choices=cubes.reg_cube.keys(),
+    parser.add_argument('-p', '--plane', type=encodings_type(cubes.reg_cube),
                         default='clark_storkey_2014',
-                        help='specify which method should be used to create the planes')
-    parser.add_argument('-l', '--label', type=str, choices=cubes.reg_label.keys(),
+                        help='specify which method should be used to create the planes,'
+                             ' more of them can be given separated by commas (e.g.'
+                             ' "detlefko,jm2017"), each is then stored into dataset'
+                             ' XNAME_PLANE. One of: %s'%', '.join(sorted(cubes.reg_cube)))
+    parser.add_argument('-l', '--label', type=encodings_type(cubes.reg_label),
                         default='simple_label',
-                        help='specify which method should be used to create the labels')
+                        help='specify which method should be used to create the labels,'
+                             ' more of them can be given the same way as the planes,'
+                             ' each is stored into dataset YNAME_LABEL. One of: %s'
+                             %', '.join(sorted(cubes.reg_label)))
+    parser.add_argument('-b', '--backend', type=str, choices=backends.reg_backend.keys(),
+                        default='python',
+                        help='specify which board analysis backend should be used to compute the planes')
     parser.add_argument('-q', '--quiet', dest='quiet', action='store_true',
                         default=False,
                         help='turn off the (stderr) debug logs')
     parser.add_argument('-s', dest='boardsize', type=int,
                         help='specify boardsize', default=19)
-    parser.add_argument('-r', '--rank', dest='rankspec', action=RankSpecAction,
+    parser.add_argument('-r', '--rank', dest='rankspec', action=rank.RankSpecAction,
                         help='Specify rank to be limited. 1kyu=1, 30kyu=30, 1dan=0,'
                              ' 10dan=-9. Example values "1,2,3", "1..30", "-10..30",'
                              ' etc. Empty string marks no limit on rank.',
-                        default=parse_rank_specification(''))
+                        default=rank.parse_rank_specification(''))
     parser.add_argument('--flatten', dest='flatten', action='store_true',
                         help='Flatten out the examples. (19, 19, 4) shape becomes ( 19 * 19 * 4,)', default=False)
     parser.add_argument('--shrink-units', dest='shrink_units', action='store_true',
@@ -230,33 +489,82 @@ def parse_args():
                         help='convert dtype of stored data to given numpy dtype (instead the default value defined by plane/label)', default=None)
     parser.add_argument('--compression', dest='compression',
                         help='Possible values: "lzf", "gzip10", "gzip9", ...', default='lzf')
+    parser.add_argument('--symmetries', dest='symmetries', action='store_true', default=False,
+                        help='Store each position transformed by all the 8 symmetries'
+                             ' of the board (rotations and reflections), the examples'
+                             ' of a game are followed by their transformations.')
+    parser.add_argument('--shards', dest='shards', action='store_true',
+                        help='Each worker stores (and compresses) its examples into its own'
+                             ' HDF5 shard file FILENAME.shard-PID in parallel. FILENAME then'
+                             ' contains virtual datasets concatenating the shards.'
+                             ' The shards must be kept next to the FILENAME.', default=False)
+    parser.add_argument('--batch-size', type=int, dest='batch_size', default=128,
+                        help='Training batch size, the datasets are chunked by a multiple'
+                             ' of it. Default %(default)s.')
+    parser.add_argument('--buffer-size', type=int, dest='buffer_size', default=64,
+                        help='Size of the write buffers in MB, examples are written'
+                             ' when the buffers are full. Default %(default)s.')
+    parser.add_argument('--shm-slots', type=int, dest='shm_slots', default=0,
+                        help='Number of shared memory slots used to transport the encoded'
+                             ' games from the workers, instead of pickling them. Each slot'
+                             ' holds --shm-slot-size examples, about 2 slots per worker'
+                             ' are enough. Default 0 turns the shared memory off.')
+    parser.add_argument('--shm-slot-size', type=int, dest='shm_slot_size', default=400,
+                        help='Maximal number of examples in a shared memory slot, longer'
+                             ' games are pickled. Default %(default)s.')
+    parser.add_argument('--window', type=int, dest='window', default=None,
+                        help='Maximal number of games being processed or waiting to be'
+                             ' stored. Default is 4 times --proc.')
+    parser.add_argument('--resume', dest='resume', action='store_true', default=False,
+                        help='Continue an interrupted build. The games committed in'
+                             ' the journal FILENAME.journal are skipped and the examples'
+                             ' are appended to the existing datasets. Not supported with'
+                             ' --shards.')
+    parser.add_argument('--checkpoint-interval', type=float, dest='checkpoint_interval',
+                        default=300,
+                        help='Seconds between the checkpoints, when the datasets are'
+                             ' flushed and the processed games are committed to the'
+                             ' journal. Default %(default)s.')
+    parser.add_argument('--archive', dest='archive', default=None, metavar='DIR',
+                        help='Read the games from an archive made by sgf2archive.py,'
+                             ' instead of the sgf files listed on STDIN.')
+    parser.add_argument('--sgf-archive', dest='sgf_archives', action='append', default=[],
+                        metavar='FILE',
+                        help='Read the sgf files from tar (.tar, .tar.gz, .tgz, ...) or zip'
+                             ' archive FILE, instead of the paths on STDIN. The archive is'
+                             ' read sequentially by the master, the workers get the'
+                             ' content of the files. Can be given more times.')
+    parser.add_argument('--no-prefilter', dest='prefilter', action='store_false', default=True,
+                        help='Do not check the boardsize and ranks in the sgf header before'
+                             ' parsing the whole sgf.')
+    parser.add_argument('--no-fast-sgf', dest='fast_sgf', action='store_false', default=True,
+                        help='Always parse the sgf files by gomill. By default, games'
+                             ' without variations are read by a faster minimal parser,'
+                             ' with the same result.')
+    parser.add_argument('--cache', dest='cache', default=None, metavar='DIR',
+                        help='Directory with cache of the encoded games. Games with'
+                             ' the same content encoded with the same plane, label,'
+                             ' boardsize and ranks are not encoded again.')
+    parser.add_argument('--cache-size', type=int, dest='cache_size', default=10240,
+                        help='Maximal size of the --cache in MB, least recently used'
+                             ' games are removed at the end of the run.'
+                             ' Default %(default)s.')
+    parser.add_argument('--profile', dest='profile', action='store_true', default=False,
+                        help='Measure the time spent in the stages of the processing'
+                             ' (summed over the workers), the breakdown is logged'
+                             ' periodically and at the end.')
+    parser.add_argument('--profile-interval', type=float, dest='profile_interval', default=60,
+                        help='Seconds between the --profile logs. Default %(default)s.')
     parser.add_argument('--proc', type=int,
                         default=multiprocessing.cpu_count(),
                         help='specify number of processes for parallelization')
 
-    return parser.parse_args()
-
-
-def batched_imap(function, input_iterator, batch_size=100, imap=imap):
-    """
-        Runs `function` using `imap` on batches of `batch_size`
-        taken from `input_iterator`.
-        yield results.
-
-        Only runs next imap when all previous results have been consumed.
-        This is useful if workers in the imap pool are faster than consumer
-        of the results, because the results might use up a lot of memory.
-    """
-    def next_batch():
-        # list is necessary s.t. we can test for emptiness
-        return list(islice(input_iterator, batch_size))
-
-    batch = next_batch()
-    while batch:
-        logging.debug('Starting next batch.')
-        for res in imap(function, batch):
-            yield res
-        batch = next_batch()
+    args = parser.parse_args()
+    if args.resume and args.shards:
+        parser.error("--resume is not supported with --shards")
+    if args.archive and args.sgf_archives:
+        parser.error("--archive and --sgf-archive cannot be combined")
+    return args
 
 
 def main():
@@ -269,71 +577,18 @@ def main():
 
     logging.info("args: %s"%args)
 
-    ## INIT pool of workers
-
-    initargs=(args.plane, args.label, (args.boardsize, ), args.rankspec)
-    p = multiprocessing.Pool(args.proc, initializer=init_subprocess, initargs=initargs)
-
     ## INIT shapes and transformations
     # the basic pathway is:
-    # imap job returns two lists [x1, x2, x3, ..], [y1, y2, y3, ..]
-    # of numpy arrays which we want to transform to be able to store in a dataset
-    # in a proper format
-
-    # first determine example shapes
-    b = gomill.boards.Board(args.boardsize)
-    init_subprocess(*initargs)
-    s = state.State(b, None, [], [('b',(3,3))], rank.BrWr(rank.Rank.from_key(1), # 1k
-                                               rank.Rank.from_key(2)  # 2k
-                                               ))
-    sample_x = get_cube(s, 'b')
-    sample_y = get_label(s, 'b')
-
-    # shape in dataset
-    dshape_x = sample_x.shape
-    dshape_y = sample_y.shape
-
-    # transformation of the returned lists
-    mapxs = lambda xs : xs
-    mapys = lambda ys : ys
-
-    ## shrink unit dimension
-    # one dimensional values can be stored flattened
-    # s.t.
-    # 1000 examples of dimensions 1 have shape (1000,)
-    # instead of (1000, 1)
-    # this is probably the case only for the labels
-    # but support xs anyways
-    if args.shrink_units and sample_x.shape == (1, ):
-        mapxs = lambda xs : np.ndarray.flatten(np.array(xs))
-        dshape_x = tuple()
-
-    if args.shrink_units and sample_y.shape == (1, ):
-        mapys = lambda ys : np.ndarray.flatten(np.array(ys))
-        dshape_y = tuple()
-
-    transform_example_x = lambda x : x
-    transform_example_y = lambda y : y
-
-    ## flatten
-    # do not flatten units
-    if args.flatten and dshape_x:
-        transform_example_x = np.ndarray.flatten
-        dshape_x = (reduce((lambda x,y : x*y), dshape_x), )
-
-    if args.flatten and dshape_y:
-        transform_example_y = np.ndarray.flatten
-        dshape_y = (reduce((lambda x,y : x*y), dshape_y), )
-
-    ## dtype
-    dtype_x = sample_x.dtype
-    dtype_y = sample_y.dtype
-
-    recast_dtype = lambda a : a
-    if args.dtype:
-        recast_dtype = lambda a : np.array(a, dtype=args.dtype)
-        dtype_x = args.dtype
-        dtype_y = args.dtype
+    # imap job encodes the whole game into two preallocated arrays
+    # (num_examples,) + layout.shape of the layout.dtype, in the format
+    # in which we store them in the dataset
+
+    # first determine example shapes,
+    # one layout and dataset for each plane, followed by the labels
+    samples = get_samples(args.plane, args.label, args.boardsize)
+    layouts = [ make_layout(sample, args.flatten, args.shrink_units, args.dtype)
+                for sample in samples ]
+    names = dataset_names(args.xname, args.yname, args.plane, args.label)
 
     ## compression
     compression_kwargs = {}
@@ -347,84 +602,204 @@ def main():
     else:
         raise RuntimeError("Invalid compression arg.")
 
+    ## buffering
+    # when sharding, the buffers are in every worker
+    buffer_rows = get_buffer_rows(layouts, args.buffer_size * 1024 * 1024)
+    if args.shards:
+        buffer_rows = max(1, buffer_rows // args.proc)
+
+    attrs = [ dataset_attrs(enc, args.boardsize, layout)
+              for enc, layout in zip(args.plane + args.label, layouts) ]
+    if args.symmetries:
+        for dset_attrs in attrs:
+            dset_attrs['symmetries'] = symmetry.NUM_SYMMETRIES
+
+    shard = None
+    if args.shards:
+        shard = ShardSpec(args.filename, names, compression_kwargs, attrs,
+                          args.batch_size, buffer_rows)
+
+    ## INIT pool of workers
+
+    shared_ring = None
+    if args.shm_slots and args.proc > 1 and not args.shards:
+        shared_ring = SharedRing(args.shm_slots, args.shm_slot_size, layouts)
+
+    encoding.set_profile(args.profile)
+    initargs=(shard, args.plane, args.label, (args.boardsize, ), args.rankspec, args.backend,
+              layouts, shared_ring, args.profile, args.cache,
+              args.archive, args.prefilter, args.fast_sgf, args.symmetries)
+    if args.proc > 1:
+        p = multiprocessing.Pool(args.proc, initializer=init_subprocess, initargs=initargs)
+
     ## INIT dataset
     with h5py.File(args.filename) as f:
         logging.debug("what: raw -> in dataset")
-        logging.debug("x.shape: %s -> %s"%(repr(sample_x.shape), repr(dshape_x) if dshape_x else 'flat'))
-        logging.debug("x.dtype: %s -> %s"%(sample_x.dtype, dtype_x))
-        logging.debug("y.shape: %s -> %s"%(repr(sample_y.shape), repr(dshape_y) if dshape_y else 'flat'))
-        logging.debug("y.dtype: %s -> %s"%(sample_y.dtype, dtype_y))
+        for name, sample, layout in zip(names, samples, layouts):
+            logging.debug("%s.shape: %s -> %s"%(name, repr(sample.shape),
+                                                repr(layout.shape) if layout.shape else 'flat'))
+            logging.debug("%s.dtype: %s -> %s"%(name, sample.dtype, layout.dtype))
 
+        journal = None
+        game_starts = None
         try:
-            kwargsx = {
-                # infinite number of examples
-                'maxshape' :(None,) + dshape_x,
-                'dtype' : dtype_x,
-            }
-            kwargsx.update(compression_kwargs)
-
-            dset_x = f.create_dataset(args.xname,
-                                      (0,) + dshape_x,
-                                      **kwargsx)
-            kwargsy = {
-                # infinite number of examples
-                'maxshape' :(None,) + dshape_y,
-                'dtype' : dtype_y,
-            }
-            kwargsy.update(compression_kwargs)
-
-            dset_y = f.create_dataset(args.yname,
-                                      (0,) + dshape_y,
-                                      **kwargsy)
+            if args.shards:
+                # the datasets are created when the shards are finished
+                for name in names:
+                    if name in f:
+                        raise RuntimeError("Dataset '%s' already exists."%name)
+            elif args.resume and names[0] in f:
+                journal_fn = args.filename + '.journal'
+                if not os.path.exists(journal_fn):
+                    raise RuntimeError("Cannot resume, journal '%s' not found."%journal_fn)
+                journal = Journal(journal_fn, resume=True)
+                logging.info("Resuming: %d games with %d examples done."%(len(journal.done),
+                                                                         journal.size))
+                dsets = [ open_dataset(f, name, layout, journal.size)
+                          for name, layout in zip(names, layouts) ]
+                writers = [ BufferedDataset(dset, buffer_rows) for dset in dsets ]
+                game_starts = open_game_starts(f, journal.size)
+                if game_starts is None:
+                    logging.warn("Dataset '%s' not found, the game starts are not stored."
+                                 %GAME_STARTS)
+            else:
+                dsets = [ create_dataset(f, name, layout, compression_kwargs,
+                                         dset_attrs, args.batch_size)
+                          for name, layout, dset_attrs in zip(names, layouts, attrs) ]
+                writers = [ BufferedDataset(dset, buffer_rows) for dset in dsets ]
+                if GAME_STARTS in f:
+                    logging.warn("Dataset '%s' already exists, the game starts are not stored."
+                                 %GAME_STARTS)
+                else:
+                    game_starts = create_dataset(f, GAME_STARTS, GAME_STARTS_LAYOUT,
+                                                 compression_kwargs, {}, args.batch_size)
+                journal = Journal(args.filename + '.journal')
         except Exception as e:
             logging.error("Cannot create dataset. File exists? (%s)"%(str(e)))
             sys.exit(1)
 
-
-        dset_x.attrs['name'] = args.plane
-        dset_y.attrs['name'] = args.label
-        dset_x.attrs['boardsize'] = args.boardsize
-        dset_y.attrs['boardsize'] = args.boardsize
-        dset_x.attrs['original_dtype'] = repr(sample_x.dtype)
-        dset_y.attrs['original_dtype'] = repr(sample_y.dtype)
-        dset_x.attrs['original_example_shape'] = repr(sample_x.shape)
-        dset_y.attrs['original_example_shape'] = repr(sample_y.shape)
+        starts_writer = None
+        if game_starts is not None:
+            starts_writer = BufferedDataset(game_starts, 1)
 
         ## map the job
 
+        job = process_game_to_shard if args.shards else encoding.process_game
+        stats = SchedulerStats()
+
+        if args.archive:
+            game_archive = GameArchive(args.archive)
+            games = xrange(len(game_archive))
+            game_name = game_archive.name
+            logging.info("Reading %d games from archive '%s'."%(len(game_archive), args.archive))
+        elif args.sgf_archives:
+            games = chain.from_iterable(sgf_archives.iter_sgfs(filename)
+                                        for filename in args.sgf_archives)
+            game_name = lambda (name, data) : name
+        else:
+            games = sys.stdin
+            game_name = lambda line : line.strip()
+
+        if journal is not None and journal.done:
+            games = (item for item in games if game_name(item) not in journal.done)
+
         if args.proc > 1:
-            def job_imap(*args):
-                return p.imap_unordered(*args)
+            window = args.window if args.window else 4 * args.proc
+            it = streaming_imap(p, args.proc, job, games, window, stats)
         else:
             # do not use pool if only one proc
             init_subprocess(*initargs)
-            def job_imap(*args):
-                return imap(*args)
-
-        it = batched_imap(process_game, sys.stdin, batch_size=1000, imap=job_imap)
+            it = imap(lambda item : (item, job(item)), games)
+
+        def checkpoint():
+            for writer in writers:
+                writer.flush()
+            if starts_writer is not None:
+                starts_writer.flush()
+            f.flush()
+            journal.checkpoint(writers[0].size)
+
+        size = journal.size if journal is not None else 0
+        shards = set()
+        last_report = last_checkpoint = time.time()
+        for num, (item, ret) in enumerate(it):
+            if encoding.profile.enabled and time.time() - last_report > args.profile_interval:
+                logging.info("Profile:\n%s"%encoding.profile.report())
+                last_report = time.time()
+
+            if journal is not None:
+                if time.time() - last_checkpoint > args.checkpoint_interval:
+                    checkpoint()
+                    logging.info("Checkpoint: %d examples."%size)
+                    last_checkpoint = time.time()
+                # the examples of the game are stored before the next checkpoint
+                journal.add(game_name(item))
 
-        size = 0
-        for num, ret in enumerate(it):
             if not ret:
                 continue
 
-            xs, ys = ret
-            assert len(xs) == len(ys)
-            assert all(x.shape == sample_x.shape for x in xs)
-            assert all(y.shape == sample_y.shape for y in ys)
-            if xs:
-                add = len(xs)
-                logging.info("Storing %d examples."%add)
-                dset_x.resize((size+add,) + dshape_x)
-                dset_y.resize((size+add,) + dshape_y)
+            if args.shards:
+                shard_filename, add = ret
+                if add:
+                    logging.info("Stored %d examples to shard '%s'."%(add, shard_filename))
+                    shards.add(shard_filename)
+                    size += add
+                continue
 
-                dset_x[-add:] = mapxs([transform_example_x(recast_dtype(x)) for x in xs])
-                dset_y[-add:] = mapys([transform_example_y(recast_dtype(y)) for y in ys])
+            if isinstance(ret, SlotRef):
+                # views of the shared memory
+                arrays = shared_ring.get(ret)
+            else:
+                arrays = ret
+            add = len(arrays[0])
+            assert all(len(a) == add for a in arrays)
+            if add:
+                logging.info("Storing %d examples."%add)
+                if starts_writer is not None:
+                    starts_writer.append(np.array([size]))
+                for writer, a in zip(writers, arrays):
+                    writer.append(a)
 
                 size += add
 
+            if isinstance(ret, SlotRef):
+                shared_ring.release(ret.slot)
+
+        if args.proc > 1:
+            p.close()
+            p.join()
+        else:
+            finish_subprocess()
+
+        if not args.shards:
+            for writer in writers:
+                writer.close()
+            if starts_writer is not None:
+                starts_writer.close()
+            checkpoint()
+            journal.close()
+        else:
+            shards = sorted(shards)
+            logging.info("Creating virtual datasets over %d shards."%len(shards))
+            dsets = [ create_virtual_dataset(f, name, shards, layout, dset_attrs)
+                      for name, layout, dset_attrs in zip(names, layouts, attrs) ]
+            if GAME_STARTS in f:
+                logging.warn("Dataset '%s' already exists, the game starts are not stored."
+                             %GAME_STARTS)
+            else:
+                merge_game_starts(f, shards, names[0])
+
+        if args.cache:
+            game_cache = GameCache(args.cache, None)
+            removed = game_cache.evict(args.cache_size * 1024 * 1024)
+            logging.info("Removed %d games from the cache."%removed)
+
         logging.info("Finished.")
-        for dset in [dset_x, dset_y]:
+        if args.proc > 1:
+            logging.info("Scheduler: %s"%stats)
+        if encoding.profile.enabled:
+            logging.info("Profile:\n%s"%encoding.profile.report())
+        for dset in dsets:
             logging.info("Dataset '%s': shape=%s, size=%s, dtype=%s"%(dset.name,
                                                                        repr(dset.shape),
                                                                        repr(dset.size),
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+import sys
+import logging
+import argparse
+import multiprocessing
+
+import gomill
+import gomill.sgf, gomill.sgf_moves
+
+from deepgo import fast_board, rank
+from deepgo.game_archive import ArchiveWriter, make_record
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+                description='Converts sgf files to a compact binary archive of'
+                            ' games, which make_dataset.py reads with the --archive'
+                            ' option without parsing the sgf files. Each sgf file'
+                            ' is read from STDIN.')
+    parser.add_argument('directory', metavar='DIRECTORY',
+                        help='directory to store the archive to')
+    parser.add_argument('--proc', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='specify number of processes for parallelization')
+
+    return parser.parse_args()
+
+def read_record(sgf_fn):
+    sgf_fn = sgf_fn.strip()
+    try:
+        with open(sgf_fn, 'r') as fin:
+            game = gomill.sgf.Sgf_game.from_string(fin.read())
+
+        board, moves = gomill.sgf_moves.get_setup_and_moves(game,
+                                        fast_board.Board(game.get_size()))
+        root = game.get_root()
+        ranks = rank.BrWr(rank.get_rank(root, 'BR'),
+                          rank.get_rank(root, 'WR'))
+        return make_record(sgf_fn, board, moves, ranks)
+
+    except Exception as e:
+        logging.warn("Error processing '%s': %s"%(sgf_fn, str(e)))
+        return None
+
+def main():
+    ## ARGS
+    args = parse_args()
+
+    ## INIT LOGGING
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                        level=logging.DEBUG) # if not args.quiet else logging.WARN)
+
+    logging.info("args: %s"%args)
+
+    writer = ArchiveWriter(args.directory)
+    if args.proc > 1:
+        p = multiprocessing.Pool(args.proc)
+        records = p.imap(read_record, sys.stdin, chunksize=100)
+    else:
+        records = (read_record(sgf_fn) for sgf_fn in sys.stdin)
+
+    num = 0
+    for record in records:
+        if record is None:
+            continue
+        writer.add(record)
+        num += 1
+        if num % 10000 == 0:
+            logging.info("Processed %d games."%num)
+
+    writer.close()
+    logging.info("Finished, %d games archived."%num)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import logging
+import argparse
+import multiprocessing
+import sqlite3
+
+import gomill
+import gomill.sgf, gomill.sgf_moves
+
+from deepgo import fast_board
+from deepgo.rank import get_rank, RankSpecAction, parse_rank_specification
+
+"""
+Persistent index of the sgf files metadata (boardsize, ranks, number of moves
+and result), so that lists of the games can be filtered without reading the
+sgf files, e.g.
+
+    find games/ -name '*.sgf' | ./sgf_index.py games.db build
+    ./sgf_index.py games.db query -s 19 -r 1..5 --min-moves 50 | ./make_dataset.py ...
+
+The index is a sqlite3 database, the ranks are stored as the rank keys
+(see deepgo.rank.Rank.key(), NULL for missing ranks). Building the index again
+only reads new or modified files.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS games (
+    path    TEXT PRIMARY KEY,
+    mtime   REAL,
+    size    INTEGER,
+    br      INTEGER,
+    wr      INTEGER,
+    moves   INTEGER,
+    result  TEXT
+)"""
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+                description='Indexes metadata of sgf files (read from STDIN) and'
+                            ' queries the index to produce filtered lists of'
+                            ' the sgf files.')
+    parser.add_argument('index', metavar='INDEX',
+                        help='filename of the index database')
+    subparsers = parser.add_subparsers(dest='command')
+
+    build = subparsers.add_parser('build', help='add the sgf files listed on STDIN to the index')
+    build.add_argument('--proc', type=int,
+                       default=multiprocessing.cpu_count(),
+                       help='specify number of processes for parallelization')
+
+    query = subparsers.add_parser('query', help='print paths of the games matching'
+                                                ' all of the criteria')
+    query.add_argument('-s', dest='boardsize', type=int, default=None,
+                       help='boardsize')
+    query.add_argument('-r', '--rank', dest='rankspec', action=RankSpecAction,
+                       help='rank of both players, same as in make_dataset.py',
+                       default=parse_rank_specification(''))
+    query.add_argument('--min-moves', dest='min_moves', type=int, default=None,
+                       help='minimal number of moves')
+    query.add_argument('--max-moves', dest='max_moves', type=int, default=None,
+                       help='maximal number of moves')
+    query.add_argument('--result', dest='result', default=None,
+                       help='prefix of the result, e.g. "B+" or "W+R"')
+
+    return parser.parse_args()
+
+def read_metadata(path):
+    path = path.strip()
+    try:
+        mtime = os.path.getmtime(path)
+        with open(path, 'r') as fin:
+            game = gomill.sgf.Sgf_game.from_string(fin.read())
+        board, moves = gomill.sgf_moves.get_setup_and_moves(game,
+                                        fast_board.Board(game.get_size()))
+
+        root = game.get_root()
+        ranks = [ get_rank(root, key) for key in ['BR', 'WR'] ]
+        result = root.get('RE') if root.has_property('RE') else None
+
+        return (path, mtime, game.get_size(),
+                ranks[0].key() if ranks[0] else None,
+                ranks[1].key() if ranks[1] else None,
+                len(moves), result)
+
+    except Exception as e:
+        logging.warn("Error processing '%s': %s"%(path, str(e)))
+        return None
+
+def build(db, paths, proc):
+    known = dict(db.execute('SELECT path, mtime FROM games'))
+
+    def is_new(path):
+        path = path.strip()
+        if path not in known:
+            return True
+        try:
+            return os.path.getmtime(path) != known[path]
+        except OSError:
+            return True
+
+    paths = (path for path in paths if is_new(path))
+    if proc > 1:
+        p = multiprocessing.Pool(proc)
+        rows = p.imap(read_metadata, paths, chunksize=100)
+    else:
+        rows = (read_metadata(path) for path in paths)
+
+    num = 0
+    for row in rows:
+        if row is None:
+            continue
+        db.execute('INSERT OR REPLACE INTO games VALUES (?, ?, ?, ?, ?, ?, ?)', row)
+        num += 1
+        if num % 10000 == 0:
+            db.commit()
+            logging.info("Indexed %d games."%num)
+
+    db.commit()
+    logging.info("Finished, %d games indexed."%num)
+
+def query(db, boardsize=None, rankspec=None, min_moves=None, max_moves=None, result=None):
+    """
+    :returns: list of paths of the games matching the criteria
+    """
+    conditions, params = [], []
+    if boardsize is not None:
+        conditions.append('size = ?')
+        params.append(boardsize)
+    if rankspec is not None:
+        keys = [ key for key in rankspec if key is not None ]
+        for column in ['br', 'wr']:
+            alternatives = [ '%s IN (%s)'%(column, ', '.join('?' * len(keys))) ]
+            if None in rankspec:
+                alternatives.append('%s IS NULL'%column)
+            conditions.append('(%s)'%' OR '.join(alternatives))
+            params.extend(keys)
+    if min_moves is not None:
+        conditions.append('moves >= ?')
+        params.append(min_moves)
+    if max_moves is not None:
+        conditions.append('moves <= ?')
+        params.append(max_moves)
+    if result is not None:
+        conditions.append('substr(result, 1, ?) = ?')
+        params.extend([len(result), result])
+
+    sql = 'SELECT path FROM games'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY path'
+
+    return [ path for (path, ) in db.execute(sql, params) ]
+
+def open_index(filename):
+    db = sqlite3.connect(filename)
+    db.text_factory = str
+    db.execute(SCHEMA)
+    return db
+
+def main():
+    ## ARGS
+    args = parse_args()
+
+    ## INIT LOGGING
+    logging.basicConfig(format='%(asctime)s %(levelname)s: %(message)s',
+                        level=logging.DEBUG) # if not args.quiet else logging.WARN)
+
+    db = open_index(args.index)
+    if args.command == 'build':
+        logging.info("args: %s"%args)
+        build(db, sys.stdin, args.proc)
+    else:
+        for path in query(db, args.boardsize, args.rankspec,
+                          args.min_moves, args.max_moves, args.result):
+            print path
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+from unittest import TestCase
+
+import numpy as np
+
+import gomill
+import gomill.boards, gomill.sgf, gomill.sgf_moves
+
+from deepgo import analyze_board, analyze_board_np
+from deepgo.backends import reg_backend, memoized
+from deepgo.state import State
+
+
+def reference_dist_from_stones(board, player, maxdepth):
+    """
+    The original set based bfs of analyze_board.board2dist_from_stones.
+    """
+    inf = board.side * 2
+
+    def bfs(a, fringe, depth=0):
+        if depth > maxdepth:
+            return a
+
+        f = set()
+        for pt in fringe:
+            a[pt] = depth
+            for nb in analyze_board.iter_nbhs(board, pt):
+                if a[nb] == inf and nb not in fringe:
+                    f.add(nb)
+        if f:
+            bfs(a, f, depth+1)
+        return a
+
+    us, them = set(), set()
+    for color, pt in board.list_occupied_points():
+        if color == player:
+            us.add(pt)
+        else:
+            them.add(pt)
+
+    def gd(fringe):
+        d = np.full((board.side, board.side), inf, dtype='uint8')
+        return bfs(d, fringe)
+
+    return gd(us), gd(them)
+
+
+def iter_positions(filename):
+    with open(filename, 'r') as fin:
+        game = gomill.sgf.Sgf_game.from_string(fin.read())
+
+    board, moves = gomill.sgf_moves.get_setup_and_moves(game)
+    yield board
+    for colour, move in moves:
+        if move:
+            row, col = move
+            board.play(row, col, colour)
+            yield board
+
+
+class TestBackends(TestCase):
+    def assertSame(self, a, b):
+        self.assertEqual(a.dtype, b.dtype)
+        self.assertEqual(a.shape, b.shape)
+        self.assertTrue(np.array_equal(a, b))
+
+    def check_position(self, board):
+        python, numpy = reg_backend['python'], reg_backend['numpy']
+        s = State(board, None, [], [], None)
+
+        self.assertSame(python.liberties_count(s), numpy.liberties_count(s))
+        self.assertSame(python.lib_nbs_to_lib_count(s), numpy.lib_nbs_to_lib_count(s))
+        for player in 'bw':
+            for a, b in zip(python.color_mask(s, player), numpy.color_mask(s, player)):
+                self.assertSame(a, b)
+            self.assertSame(python.correct_moves_mask(s, player),
+                            numpy.correct_moves_mask(s, player))
+
+    def test_games(self):
+        for filename in ['test_sgf/test1.sgf', 'test_sgf/correctness.sgf']:
+            for board in iter_positions(filename):
+                self.check_position(board)
+
+    def test_small_boards(self):
+        for side in [2, 3, 5]:
+            board = gomill.boards.Board(side)
+            self.check_position(board)
+            for num, (row, col) in enumerate(board.board_points[::2]):
+                board.play(row, col, 'bw'[num % 2])
+                self.check_position(board)
+
+    def test_memoized(self):
+        calls = []
+        def counted(function):
+            def f(*args):
+                calls.append(function)
+                return function(*args)
+            return f
+
+        python = reg_backend['python']
+        backend = memoized(type(python)(*map(counted, python)))
+        positions = iter_positions('test_sgf/test1.sgf')
+        for board in [positions.next().copy(), positions.next().copy()]:
+            s = State(board, None, [], [], None)
+            for repeat in xrange(2):
+                self.assertSame(backend.liberties_count(s), python.liberties_count(s))
+                for player in 'bw':
+                    for a, b in zip(backend.color_mask(s, player), python.color_mask(s, player)):
+                        self.assertSame(a, b)
+        # liberties_count and color_mask for both players, for both positions
+        self.assertEqual(len(calls), 6)
+
+    def test_dist_from_stones(self):
+        small = gomill.boards.Board(5)
+        small.play(1, 1, 'w')
+        positions = iter_positions('test_sgf/test1.sgf')
+        for board in [small] + [board.copy() for num, board in enumerate(positions) if not num % 10]:
+            for player in 'bw':
+                for maxdepth in [0, 1, 4, 40]:
+                    for a, b in zip(analyze_board.board2dist_from_stones(board, player, maxdepth),
+                                    reference_dist_from_stones(board, player, maxdepth)):
+                        self.assertSame(a, b)
+
+    def test_string_labels(self):
+        for board in iter_positions('test_sgf/test2.sgf'):
+            a = analyze_board_np.board2array(board)
+            labels = analyze_board_np.string_labels(a)
+            string_lib = analyze_board.board2string_lib(board)
+
+            pairs = set((si, labels[pt]) for pt, si in string_lib.string.items())
+            # one to one mapping of the strings
+            self.assertEqual(len(pairs), len(set(string_lib.string.values())))
+            self.assertEqual(len(pairs), len(set(labels[labels > 0])))
+            self.assertTrue((labels[a == analyze_board_np.EMPTY] == 0).all())
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
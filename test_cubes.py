@@ -0,0 +1,106 @@
+from unittest import TestCase
+import hashlib
+
+import numpy as np
+import gomill.boards
+
+from deepgo import cubes, backends, encoding
+from deepgo.state import State
+from deepgo.rank import BrWr
+
+
+class TestCubeSpec(TestCase):
+    def setUp(self):
+        self.registered = set(cubes.reg_feature), set(cubes.reg_cube)
+        board = gomill.boards.Board(5)
+        board.play(1, 1, 'b')
+        board.play(1, 2, 'w')
+        board.play(3, 3, 'b')
+        self.state = State(board, (0, 0), [], [], BrWr(None, None))
+
+    def tearDown(self):
+        features, cube_names = self.registered
+        for name in set(cubes.reg_feature) - features:
+            del cubes.reg_feature[name]
+        for name in set(cubes.reg_cube) - cube_names:
+            del cubes.reg_cube[name]
+
+    def test_custom(self):
+        calls = []
+
+        @cubes.feature('test_stones', ['friend', 'enemy'])
+        def stones(friend, enemy):
+            calls.append(1)
+            return friend + enemy
+
+        cubes.plane('test_stones_plane', ['test_stones'])(lambda stones : stones)
+        cubes.plane('test_no_stones', ['test_stones'])(lambda stones : 1 - stones)
+        get_cube = cubes.register_spec('test_cube', ['test_stones_plane', 'ko', 'test_no_stones'],
+                                       'float32')
+        self.assertIs(cubes.reg_cube['test_cube'], get_cube)
+
+        cube = get_cube(self.state, 'b')
+        self.assertEqual(cube.shape, (3, 5, 5))
+        self.assertEqual(cube.dtype, np.float32)
+        self.assertEqual(cube[0].sum(), 3)
+        self.assertEqual(cube[1][0][0], 1)
+        self.assertEqual(cube[1].sum(), 1)
+        self.assertTrue(np.array_equal(cube[0] + cube[2], np.ones((5, 5))))
+        # the intermediate feature is computed once per evaluation
+        self.assertEqual(len(calls), 1)
+
+    def test_more_planes(self):
+        get_cube = cubes.register_spec('test_cube', ['enemy_rank_dan', 'ones'], 'uint8')
+        self.assertEqual(get_cube.spec.num_planes, 10)
+        cube = get_cube(self.state, 'b')
+        self.assertEqual(cube[:9].sum(), 0)
+        self.assertEqual(cube[9].sum(), 25)
+
+    def test_not_a_plane(self):
+        self.assertRaises(ValueError, cubes.register_spec, 'test_cube', ['lib_count'], 'uint8')
+        self.assertRaises(KeyError, cubes.register_spec, 'test_cube', ['no_such_plane'], 'uint8')
+
+class TestLabels(TestCase):
+    def test_simple_and_expanded(self):
+        for side in [9, 19]:
+            state = State(gomill.boards.Board(side), None, [], [('b', (side - 1, 2))],
+                          BrWr(None, None))
+            simple = cubes.reg_label['simple_label'](state, 'b')
+            expanded = cubes.reg_label['expanded_label'](state, 'b')
+            packed = cubes.reg_label['expanded_label_packed'](state, 'b')
+            self.assertEqual(simple[0], side * (side - 1) + 2)
+            self.assertEqual(expanded.ravel().argmax(), simple[0])
+            self.assertTrue(np.array_equal(np.unpackbits(packed)[:side * side],
+                                           expanded.ravel()))
+
+# sha1 of the cubes of the positions of test1.sgf and test2.sgf,
+# as made by the cubes before the CubeSpecs
+GOLDEN_CUBES = {
+    'basic_7_channel' : 'c2dcff5e259b4b8900051204f8dbd3a3b74e0a64',
+    'clark_storkey_2014' : 'c2dcff5e259b4b8900051204f8dbd3a3b74e0a64',
+    'clark_storkey_2014_packed' : '0ff91b205d5f15f76570530d38f2df4e3aee67c5',
+    'deepcl' : '94166e3328c50694a8ad5c630deadfab2ac13bc3',
+    'detlef' : 'd64543906439300b56a5f6501846ac051ce1ab51',
+    'detlefko' : 'eb5a31f011aae5e903ba2131a5eca097fd96b72c',
+    'detlefko_conthist' : '5892d673e82bd25f64b46102807318602cd74684',
+    'jm2017' : '8c4a1261fea1d7e4a0b36038fe77691a641f17e0',
+    'tian_zhu_2015' : 'b0a228d82f37be9cf44e4c37da68a7acf6f511ad',
+}
+
+class TestGolden(TestCase):
+    def tearDown(self):
+        backends.set_backend('python')
+
+    def test_same_as_before(self):
+        for backend in ['python', 'numpy']:
+            for name, digest in sorted(GOLDEN_CUBES.items()):
+                encoding.init_subprocess([name], ['simple_label'], (19, ), None, backend)
+                xs = [ encoding.process_game(path)[0]
+                       for path in ['test_sgf/test1.sgf', 'test_sgf/test2.sgf'] ]
+                self.assertEqual(hashlib.sha1(np.concatenate(xs).tobytes()).hexdigest(), digest,
+                                 "%s with the %s backend"%(name, backend))
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
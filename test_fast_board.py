@@ -0,0 +1,69 @@
+from unittest import TestCase
+import random
+
+import numpy as np
+
+import gomill
+import gomill.boards, gomill.sgf, gomill.sgf_moves
+
+from deepgo import analyze_board_np
+from deepgo.fast_board import Board
+
+
+class TestFastBoard(TestCase):
+    def assertSamePosition(self, fast, board):
+        self.assertEqual(fast.list_occupied_points(), board.list_occupied_points())
+        self.assertEqual(fast.is_empty(), board.is_empty())
+        for row, col in board.board_points:
+            self.assertEqual(fast.get(row, col), board.get(row, col))
+        self.assertTrue(np.array_equal(analyze_board_np.board2array(fast),
+                                       analyze_board_np.board2array(board)))
+
+    def test_games(self):
+        for filename in ['test_sgf/test1.sgf', 'test_sgf/test2.sgf', 'test_sgf/correctness.sgf']:
+            with open(filename, 'r') as fin:
+                game = gomill.sgf.Sgf_game.from_string(fin.read())
+
+            board, moves = gomill.sgf_moves.get_setup_and_moves(game)
+            fast, fast_moves = gomill.sgf_moves.get_setup_and_moves(game, Board(game.get_size()))
+            self.assertEqual(moves, fast_moves)
+            self.assertSamePosition(fast, board)
+
+            for colour, move in moves:
+                if move:
+                    row, col = move
+                    self.assertEqual(fast.play(row, col, colour),
+                                     board.play(row, col, colour))
+                    self.assertSamePosition(fast, board)
+
+    def test_random_playouts(self):
+        rnd = random.Random(1)
+        for side in [2, 3, 5, 9]:
+            for _ in xrange(10):
+                board = gomill.boards.Board(side)
+                fast = Board.from_board(board)
+                for num in xrange(3 * side * side):
+                    empty = [pt for pt in board.board_points if board.get(*pt) is None]
+                    if not empty:
+                        break
+                    row, col = rnd.choice(empty)
+                    colour = rnd.choice('bw')
+                    self.assertEqual(fast.play(row, col, colour),
+                                     board.play(row, col, colour))
+                    self.assertSamePosition(fast, board)
+
+                self.assertSamePosition(fast.copy(), board)
+                self.assertSamePosition(Board.from_board(board), board)
+
+    def test_errors(self):
+        fast = Board(3)
+        fast.play(1, 1, 'b')
+        self.assertRaises(ValueError, fast.play, 1, 1, 'w')
+        for row, col in [(-1, 0), (0, -1), (3, 0), (0, 3)]:
+            self.assertRaises(IndexError, fast.play, row, col, 'w')
+            self.assertRaises(IndexError, fast.get, row, col)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
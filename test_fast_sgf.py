@@ -0,0 +1,101 @@
+from unittest import TestCase
+
+import gomill
+import gomill.sgf, gomill.sgf_moves
+
+from deepgo import fast_sgf, fast_board
+
+
+def gomill_root(data):
+    game = gomill.sgf.Sgf_game.from_string(data)
+    return game.get_size(), game.get_root()
+
+def gomill_setup_and_moves(data):
+    game = gomill.sgf.Sgf_game.from_string(data)
+    return gomill.sgf_moves.get_setup_and_moves(game, fast_board.Board(game.get_size()))
+
+
+class TestRootProperties(TestCase):
+    def test_files(self):
+        for filename in ['test_sgf/test1.sgf', 'test_sgf/test2.sgf', 'test_sgf/correctness.sgf']:
+            with open(filename, 'r') as fin:
+                data = fin.read()
+
+            size, root = gomill_root(data)
+            props = fast_sgf.root_properties(data)
+            self.assertEqual(sorted(props.keys()), sorted(root.properties()))
+            for ident, values in props.items():
+                self.assertEqual(values, root.get_raw_list(ident))
+            self.assertEqual(fast_sgf.root_size(props), size)
+            for ident in ['BR', 'WR']:
+                known, value = fast_sgf.root_text(props, ident)
+                self.assertTrue(known)
+                self.assertEqual(value, root.get(ident) if root.has_property(ident) else None)
+
+    def test_values(self):
+        for data in ['(;SZ[9]BR[3k]WR[ 2d])',
+                     '(;SiZe[13]BlackRank[1d] ;B[aa])',
+                     '(;SZ[19]CA[UTF-8]BR[1p];W[aa])',
+                     'junk (;FF[4]\nBR[5k]\n(;B[aa])(;B[bb]))']:
+            size, root = gomill_root(data)
+            props = fast_sgf.root_properties(data)
+            self.assertEqual(fast_sgf.root_size(props), size)
+            for ident in ['BR', 'WR']:
+                known, value = fast_sgf.root_text(props, ident)
+                self.assertTrue(known)
+                self.assertEqual(value, root.get(ident) if root.has_property(ident) else None)
+
+    def test_unknown(self):
+        self.assertEqual(fast_sgf.root_properties('no game here'), None)
+        self.assertEqual(fast_sgf.root_properties('(;SZ[19'), None)
+        self.assertEqual(fast_sgf.root_size(fast_sgf.root_properties('(;SZ[19:19])')), None)
+        self.assertEqual(fast_sgf.root_size(fast_sgf.root_properties('(;FF[4])')), 19)
+        for data in ['(;BR[1\\]d])', '(;BR[1d][2d])', '(;BR[1\td])', '(;CA[foo]BR[1d])']:
+            props = fast_sgf.root_properties(data)
+            self.assertEqual(fast_sgf.root_text(props, 'BR'), (False, None))
+
+
+class TestGetSetupAndMoves(TestCase):
+    def assertSameGame(self, data):
+        game = fast_sgf.get_setup_and_moves(data)
+        self.assertNotEqual(game, None)
+        props, board, moves = game
+        board_ref, moves_ref = gomill_setup_and_moves(data)
+        self.assertEqual(board.side, board_ref.side)
+        self.assertEqual(sorted(board.list_occupied_points()),
+                         sorted(board_ref.list_occupied_points()))
+        self.assertEqual(moves, moves_ref)
+
+    def test_files(self):
+        for filename in ['test_sgf/test1.sgf', 'test_sgf/test2.sgf', 'test_sgf/correctness.sgf']:
+            with open(filename, 'r') as fin:
+                self.assertSameGame(fin.read())
+
+    def test_games(self):
+        for data in ['(;SZ[9];B[ee];W[cc];B[];W[tt])',
+                     '(;SZ[19];B[aa]C[comment [x\\]];W[tt];B[ss])',
+                     '(;SZ[9]AB[aa][bb:cc]AW[ee];W[dd];Black[ff]PL[B])',
+                     '(;SZ[9]B[ee];W[cc])',
+                     '(;SZ[9];B[ee]B[ff];C[no move];W[cc])',
+                     'junk (;SZ[5]HA[2];B[aa]) (;SZ[9];B[bb])']:
+            self.assertSameGame(data)
+
+    def test_fallback(self):
+        for data in ['no game',
+                     '(;SZ[9];B[aa](;W[bb])(;W[cc]))',
+                     '(;SZ[9];B[aa];W[bb]',
+                     '(;SZ[9];B[aa];W;B[cc])',
+                     '(;SZ[9]AB[aa]B[bb])',
+                     '(;SZ[9];B[aa];AW[bb])',
+                     '(;SZ[9]AE[aa];B[bb])',
+                     '(;SZ[9]AB[];B[bb])',
+                     '(;SZ[9];B[zz])',
+                     '(;SZ[27];B[aa])',
+                     '(;SZ[x];B[aa])',
+                     '(;CA[foo];B[aa])']:
+            self.assertEqual(fast_sgf.get_setup_and_moves(data), None)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
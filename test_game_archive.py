@@ -0,0 +1,63 @@
+from unittest import TestCase
+import tempfile
+import shutil
+
+import numpy as np
+
+import gomill
+import gomill.sgf, gomill.sgf_moves
+
+from deepgo import rank
+from deepgo.game_archive import ArchiveWriter, GameArchive, make_record, encode_move, decode_move
+
+
+class TestGameArchive(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_moves(self):
+        for side in [5, 19]:
+            for colour in 'bw':
+                for move in [None, (0, 0), (side - 1, side - 1), (2, 3)]:
+                    value = encode_move(colour, move, side)
+                    self.assertEqual(decode_move(value, side), (colour, move))
+
+    def test_roundtrip(self):
+        games = []
+        writer = ArchiveWriter(self.tmpdir)
+        for filename in ['test_sgf/test1.sgf', 'test_sgf/test2.sgf', 'test_sgf/correctness.sgf']:
+            with open(filename, 'r') as fin:
+                game = gomill.sgf.Sgf_game.from_string(fin.read())
+            board, moves = gomill.sgf_moves.get_setup_and_moves(game)
+            root = game.get_root()
+            ranks = rank.BrWr(rank.get_rank(root, 'BR'), rank.get_rank(root, 'WR'))
+            games.append((filename, board, moves, ranks))
+            writer.add(make_record(filename, board, moves, ranks))
+        # made up ranks
+        board = gomill.boards.Board(9)
+        board.play(2, 2, 'b')
+        ranks = rank.BrWr(rank.Rank(3, 'd'), None)
+        games.append(('small', board, [('w', (3, 3)), ('b', None)], ranks))
+        writer.add(make_record(*games[-1]))
+        writer.close()
+
+        archive = GameArchive(self.tmpdir)
+        self.assertEqual(len(archive), len(games))
+        for index, (name, board, moves, ranks) in enumerate(games):
+            self.assertEqual(archive.name(index), name)
+            self.assertEqual(archive.side(index), board.side)
+            self.assertEqual(archive.get_ranks(index), ranks)
+
+            archived_board, archived_moves = archive.game(index)
+            self.assertEqual(archived_moves, moves)
+            self.assertEqual(archived_board.list_occupied_points(), board.list_occupied_points())
+
+        self.assertNotEqual(archive.raw(0), archive.raw(1))
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
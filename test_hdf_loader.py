@@ -0,0 +1,79 @@
+from unittest import TestCase
+import tempfile
+import shutil
+import os
+
+import numpy as np
+import h5py
+
+from make_dataset import make_layout, dataset_attrs, create_dataset
+from hdf_loader import BatchLoader, parse_dtype
+
+SIDE = 5
+SIZE = 100
+
+class TestBatchLoader(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'dataset.hdf5')
+
+        rng = np.random.RandomState(0)
+        self.planes = rng.randint(2, size=(SIZE, 3, SIDE, SIDE)).astype('uint8')
+        self.labels = rng.randint(SIDE * SIDE, size=(SIZE, 1)).astype('uint8')
+        packed = np.packbits(self.planes.reshape((SIZE, -1)), axis=1)
+
+        with h5py.File(self.filename, 'w') as f:
+            # the planes packed, the labels flattened to float32
+            for name, a, layout in [
+                    ('xs', packed, make_layout(packed[0])),
+                    ('ys', self.labels.astype('float32'),
+                     make_layout(self.labels[0], shrink_units=True, dtype='float32'))]:
+                encoding = 'clark_storkey_2014_packed' if name == 'xs' else 'simple_label'
+                dset = create_dataset(f, name, layout, {}, dataset_attrs(encoding, SIDE, layout), 8)
+                dset.resize((SIZE,) + layout.shape)
+                dset[:] = a.reshape((SIZE,) + layout.shape)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def load(self, **kwargs):
+        with BatchLoader(self.filename, batch_size=16, rng=np.random.RandomState(1),
+                         **kwargs) as loader:
+            batches = list(loader)
+            self.assertEqual(len(batches), len(loader))
+        return batches
+
+    def test_decode(self):
+        for shuffle in [False, True]:
+            batches = self.load(shuffle=shuffle, chunks_mixed=3, threads=3)
+            self.assertEqual([ len(xs) for xs, ys in batches ], [16] * 6 + [4])
+            xs, ys = [ np.concatenate(arrays) for arrays in zip(*batches) ]
+            self.assertEqual(xs.dtype, np.dtype('uint8'))
+            self.assertEqual(ys.dtype, np.dtype('uint8'))
+            self.assertEqual(ys.shape, self.labels.shape)
+            if not shuffle:
+                self.assertTrue(np.array_equal(xs, self.planes))
+                self.assertTrue(np.array_equal(ys, self.labels))
+            # the positions stay with their labels
+            pairs = set((x.tobytes(), int(y)) for x, y in zip(self.planes, self.labels))
+            self.assertEqual(set((x.tobytes(), int(y)) for x, y in zip(xs, ys)), pairs)
+
+    def test_options(self):
+        batches = self.load(drop_last=True, dtypes=['float32', None], symmetries=True)
+        self.assertEqual(len(batches), SIZE // 16)
+        for xs, ys in batches:
+            self.assertEqual(xs.shape, (16, 3, SIDE, SIDE))
+            self.assertEqual(xs.dtype, np.dtype('float32'))
+
+        xs, ys = self.load(decode=False, shuffle=False)[0]
+        self.assertEqual(xs.shape, (16, 10))
+        self.assertEqual(ys.shape, (16,))
+
+    def test_parse_dtype(self):
+        self.assertEqual(parse_dtype(repr(np.dtype('float32'))), np.dtype('float32'))
+        self.assertRaises(ValueError, parse_dtype, 'float32')
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
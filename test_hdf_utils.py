@@ -89,6 +89,204 @@ class Test(TestCase):
             assert (mx == ax).all()
             assert (my == ay).all()
 
+    def test_shuffle(self):
+        with removing_files(counting_namefactory('tempfile_', '.%d.tmp' % os.getpid())) as nameg_factory:
+            name_it = nameg_factory()
+
+            name = next(name_it)
+            dx, dy, fout = make_test_dset(name)
+            ax, ay = np.array(dx), np.array(dy)
+            fout.close()
+
+            for memory in [10 ** 6, 20 * 232 * 2]:
+                nameo = next(name_it)
+                hdf_utils.shuffle(hdf_utils.HdfLoc(name, 'xs', 'ys'),
+                                  hdf_utils.HdfLoc(nameo, 'xs', 'ys'),
+                                  memory=memory, tmpdir='.', rng=np.random.RandomState(0))
+
+                shuffled = h5py.File(nameo, 'r')
+                sx = np.array(shuffled['xs'][:])
+                sy = np.array(shuffled['ys'][:])
+                shuffled.close()
+
+                assert sx.shape == ax.shape
+                assert sy.shape == ay.shape
+                assert not (sx == ax).all()
+                # every example once, the xs stay with their ys
+                order = np.argsort(sx[:, 0, 0])
+                assert (sx[order] == ax).all()
+                assert (sy[order] == ay).all()
+
+    def test_scatter(self):
+        fin = h5py.File('scatter', 'w', driver='core', backing_store=False)
+        dx = fin.create_dataset('xs', data=np.arange(1000 * 3).reshape((1000, 3)))
+        dy = fin.create_dataset('ys', data=np.arange(1000))
+        tmpfile = h5py.File('scatter_tmp', 'w', driver='core', backing_store=False)
+
+        out = hdf_utils.scatter([dx, dy], 5, tmpfile, 200, np.random.RandomState(0))
+        xs = np.concatenate([bucket[0][:] for bucket in out])
+        ys = np.concatenate([bucket[1][:] for bucket in out])
+        assert sorted(ys) == list(range(1000))
+        assert (xs[:, 0] == 3 * ys).all()
+        # the buffers of the buckets are appended by whole chunks
+        for bucket in out:
+            assert bucket[0].chunks == (20, 3) and bucket[1].chunks == (20,)
+            assert bucket[0].compression == 'lzf'
+        tmpfile.close()
+        fin.close()
+
+    def test_shuffle_buckets(self):
+        size, rows = 100000, 4096
+        fin = h5py.File('shuffle_buckets', 'w', driver='core', backing_store=False)
+        dx = fin.create_dataset('xs', data=np.arange(size * 2).reshape((size, 2)))
+        dy = fin.create_dataset('ys', data=np.arange(size))
+        fout = h5py.File('shuffle_buckets_out', 'w', driver='core', backing_store=False)
+        outs = [fout.create_dataset(name, (0,) + dset.shape[1:], maxshape=(None,) + dset.shape[1:],
+                                    dtype=dset.dtype) for name, dset in [('xs', dx), ('ys', dy)]]
+
+        scatter, scattered = hdf_utils.scatter, []
+        def recording_scatter(dsets, buckets, tmpfile, rows, rng):
+            out = scatter(dsets, buckets, tmpfile, rows, rng)
+            scattered.append((len(dsets[0]), buckets, [bucket[0].chunks[0] for bucket in out]))
+            return out
+        hdf_utils.scatter = recording_scatter
+        try:
+            hdf_utils.shuffle_rows([dx, dy], outs, rows, '.', np.random.RandomState(0))
+        finally:
+            hdf_utils.scatter = scatter
+
+        ys = outs[1][:]
+        assert sorted(ys) == list(range(size))
+        assert (outs[0][:, 0] == 2 * ys).all()
+        # the fan-out is capped, the buckets still too big are scattered again
+        assert scattered[0] == (size, 8, [256] * 8)
+        assert len(scattered) > 1
+        for _, buckets, chunks in scattered:
+            assert 2 <= buckets <= rows // (2 * hdf_utils.MIN_CHUNK_ROWS)
+            assert all(chunk >= hdf_utils.MIN_CHUNK_ROWS for chunk in chunks)
+        fout.close()
+        fin.close()
+
+    def test_split_merge_chunks(self):
+        with removing_files(counting_namefactory('tempfile_', '.%d.tmp' % os.getpid())) as nameg_factory:
+            name_it = nameg_factory()
+
+            name = next(name_it)
+            with h5py.File(name, 'w') as fout:
+                fout.create_dataset('xs', data=np.arange(100 * 15).reshape((100, 3, 5)),
+                                    maxshape=(None, 3, 5), chunks=(8, 3, 5), compression='gzip')
+                fout.create_dataset('ys', data=np.arange(100), maxshape=(None,), chunks=(8,),
+                                    compression='gzip', shuffle=True)
+                fout['xs'].attrs['name'] = 'test'
+
+            # at the chunk boundaries and not
+            tosplit = [hdf_utils.HdfLoc(next(name_it), 'xs', 'ys') for _ in range(4)]
+            hdf_utils.split(hdf_utils.HdfLoc(name, 'xs', 'ys'),
+                            [hdf_utils.SplitTo(tosplit[0], 16),
+                             hdf_utils.SplitTo(tosplit[1], 60),
+                             hdf_utils.SplitTo(tosplit[2], 75),
+                             hdf_utils.SplitTo(tosplit[3], -1)],
+                            blocksize=11)
+
+            with h5py.File(tosplit[0].filename, 'r') as fin:
+                dset = fin['xs']
+                assert dset.chunks == (8, 3, 5) and dset.compression == 'gzip'
+                assert dset.attrs['name'] == 'test'
+
+            namem, namev = next(name_it), next(name_it)
+            hdf_utils.merge(hdf_utils.HdfLoc(namem, 'xs', 'ys'), tosplit, blocksize=13)
+            hdf_utils.merge_virtual(hdf_utils.HdfLoc(namev, 'xs', 'ys'), tosplit)
+
+            # the first source is copied by H5Ocopy, the chunks as they are
+            with h5py.File(namem, 'r') as merged, h5py.File(tosplit[0].filename, 'r') as first:
+                assert (merged['xs'].id.read_direct_chunk((8, 0, 0))
+                        == first['xs'].id.read_direct_chunk((8, 0, 0)))
+
+            for merged_name in [namem, namev]:
+                with h5py.File(merged_name, 'r') as merged:
+                    assert (merged['xs'][:] == np.arange(100 * 15).reshape((100, 3, 5))).all()
+                    assert (merged['ys'][:] == np.arange(100)).all()
+                    assert merged['xs'].attrs['name'] == 'test'
+
+    def test_split_points(self):
+        assert hdf_utils.split_points(100, [0.9, 0.1]) == [0, 90, 100]
+        assert hdf_utils.split_points(100, [10, None, 0.2]) == [0, 10, 80, 100]
+        assert hdf_utils.split_points(100, [30, 20]) == [0, 30, 50]
+        self.assertRaises(ValueError, hdf_utils.split_points, 100, [0.5, 60])
+        self.assertRaises(ValueError, hdf_utils.split_points, 100, [None, None])
+        # moved to the nearest game starts
+        assert hdf_utils.split_points(100, [0.5, 0.3, None], np.array([0, 20, 48, 90])) \
+               == [0, 48, 90, 100]
+        # moved to the nearest chunk boundaries, the end stays
+        assert hdf_utils.split_points(100, [0.5, 20, None], chunk_rows=8) == [0, 48, 72, 100]
+        assert hdf_utils.split_points(101, [100, None], chunk_rows=8) == [0, 101, 101]
+        # the game starts take precedence
+        assert hdf_utils.split_points(100, [0.5, None], np.array([0, 20, 46]), chunk_rows=8) \
+               == [0, 46, 100]
+
+    def test_split_sizes(self):
+        with removing_files(counting_namefactory('tempfile_', '.%d.tmp' % os.getpid())) as nameg_factory:
+            name_it = nameg_factory()
+
+            name = next(name_it)
+            with h5py.File(name, 'w') as fout:
+                fout.create_dataset('xs_a', data=np.arange(100 * 15).reshape((100, 3, 5)),
+                                    maxshape=(None, 3, 5), chunks=(8, 3, 5))
+                fout.create_dataset('xs_b', data=np.arange(100) * 2, maxshape=(None,), chunks=(8,))
+                fout.create_dataset('ys', data=np.arange(100), maxshape=(None,), chunks=(8,))
+                fout.create_dataset('game_starts', data=np.arange(0, 100, 7))
+                fout['ys'].attrs['name'] = 'test'
+
+            keys = ['xs_a', 'xs_b', 'ys']
+            outputs = [hdf_utils.HdfData(next(name_it), ['a', 'b', 'y']) for _ in range(3)]
+            hdf_utils.split_sizes(hdf_utils.HdfData(name, keys), outputs, [0.5, 20, None],
+                                  games=True, compression=hdf_utils.parse_compression('gzip4'),
+                                  blocksize=16)
+
+            start = 0
+            for output, size in zip(outputs, [49, 21, 30]):
+                with h5py.File(output.filename, 'r') as fin:
+                    assert (fin['y'][:] == np.arange(start, start + size)).all()
+                    assert (fin['b'][:] == 2 * fin['y'][:]).all()
+                    assert (fin['a'][:, 0, 0] == 15 * fin['y'][:]).all()
+                    assert fin['a'].compression == 'gzip' and fin['a'].compression_opts == 4
+                    assert fin['y'].attrs['name'] == 'test'
+                    # the games are not cut
+                    starts = np.arange(start, start + size, 7) - start
+                    assert (fin['game_starts'][:] == starts).all()
+                    assert (start + size) % 7 == 0 or start + size == 100
+                start += size
+
+            namem = next(name_it)
+            hdf_utils.merge(hdf_utils.HdfData(namem, keys), outputs)
+            with h5py.File(namem, 'r') as merged:
+                assert (merged['ys'][:] == np.arange(100)).all()
+                assert (merged['game_starts'][:] == np.arange(0, 100, 7)).all()
+
+            # without the games, at the chunk boundaries of the source
+            outputs = [hdf_utils.HdfData(next(name_it), ['a', 'b', 'y']) for _ in range(3)]
+            hdf_utils.split_sizes(hdf_utils.HdfData(name, keys), outputs, [0.5, 20, None],
+                                  blocksize=16)
+            start = 0
+            for output, size in zip(outputs, [48, 24, 28]):
+                with h5py.File(output.filename, 'r') as fin:
+                    assert (fin['y'][:] == np.arange(start, start + size)).all()
+                start += size
+
+    def test_parse_args(self):
+        args = hdf_utils.parse_args(['s', 'in.hdf', 'train.hdf:90%', 'val.hdf:*', '-k', 'xs,ys,zs',
+                                     '--games', '--compression', 'lzf'])
+        assert args.command == 'split' and args.games
+        assert args.outputs == [('train.hdf', 0.9), ('val.hdf', None)]
+        assert args.keys == args.output_keys == ['xs', 'ys', 'zs']
+        assert args.compression == {'compression': 'lzf'}
+
+        args = hdf_utils.parse_args(['v', 'out.hdf', 'a.hdf', 'b.hdf'])
+        assert args.command == 'merge' and args.virtual
+
+        args = hdf_utils.parse_args(['shuffle', 'in.hdf', 'out.hdf', '64'])
+        assert args.memory == 64 and args.compression is None
+
 
 if __name__ == '__main__':
     import unittest
@@ -1,8 +1,22 @@
 #from __future__ import absolute_import
 
 from unittest import TestCase
+import multiprocessing
+import tempfile
+import shutil
+import time
+import os
+import sys
+import subprocess
 
-from make_dataset import parse_rank_specification
+import numpy as np
+import h5py
+
+from deepgo.rank import parse_rank_specification
+from deepgo.encoding import Layout, SharedRing, SlotRef
+from deepgo.encoding import streaming_imap, SchedulerStats, Profile, GameCache, get_samples
+from make_dataset import create_dataset, chunk_rows, BufferedDataset
+from make_dataset import Journal, dataset_names, encodings_type
 
 class TestParse_rank_specification(TestCase):
     def test_basic(self):
@@ -20,6 +34,296 @@ class TestParse_rank_specification(TestCase):
         self.assertEqual(parse_rank_specification('1..3,'), set([1, 2, 3, None]))
         self.assertEqual(parse_rank_specification(','), set([None]))
 
+def init_ring(shared_ring):
+    global ring
+    ring = shared_ring
+
+def fill_slot(value):
+    slot, [(xs, xs_view), (ys, ys_view)] = ring.acquire()
+    xs_view[:3] = value
+    ys_view[:3] = value + 1
+    return SlotRef(slot, 3)
+
+class TestEncodings(TestCase):
+    def test_names(self):
+        self.assertEqual(dataset_names('xs', 'ys', ['detlefko'], ['simple_label']),
+                         ['xs', 'ys'])
+        self.assertEqual(dataset_names('xs', 'ys', ['detlefko', 'jm2017'], ['simple_label']),
+                         ['xs_detlefko', 'xs_jm2017', 'ys'])
+
+    def test_type(self):
+        parse = encodings_type({'a' : None, 'b' : None})
+        self.assertEqual(parse('a'), ['a'])
+        self.assertEqual(parse('b,a'), ['b', 'a'])
+        for s in ['c', 'a,c', 'a,a', '']:
+            self.assertRaises(Exception, parse, s)
+
+    def test_samples(self):
+        samples = get_samples(['clark_storkey_2014', 'detlefko'],
+                              ['simple_label', 'expanded_label'], 9)
+        self.assertEqual([sample.shape for sample in samples],
+                         [(7, 9, 9), (14, 9, 9), (1,), (9, 9)])
+
+class TestSharedRing(TestCase):
+    def test_transport(self):
+        layout_x = Layout((8,), np.dtype('uint8'), (2, 2, 2), np.dtype('float32'))
+        layout_y = Layout((), np.dtype('uint16'), (1,), np.dtype('uint16'))
+        ring = SharedRing(2, 5, (layout_x, layout_y))
+
+        # the ring is inherited by the workers
+        pool = multiprocessing.Pool(2, initializer=init_ring, initargs=(ring,))
+        refs = [ pool.apply(fill_slot, (value,)) for value in [10, 20] ]
+        pool.close()
+        pool.join()
+
+        self.assertEqual(set(ref.slot for ref in refs), set([0, 1]))
+        for ref, value in zip(refs, [10, 20]):
+            xs, ys = ring.get(ref)
+            self.assertEqual(xs.shape, (3, 8))
+            self.assertEqual(ys.shape, (3,))
+            self.assertTrue((xs == value).all())
+            self.assertTrue((ys == value + 1).all())
+            ring.release(ref.slot)
+
+        slot, blocks = ring.acquire()
+        self.assertEqual(blocks[0][1].shape, (5, 2, 2, 2))
+
+class RecordingDataset(object):
+    """
+    Dataset which records the rows written.
+    """
+    def __init__(self, dset):
+        self.dset = dset
+        self.chunks = dset.chunks
+        self.dtype = dset.dtype
+        self.writes = []
+
+    @property
+    def shape(self):
+        return self.dset.shape
+
+    def resize(self, shape):
+        self.dset.resize(shape)
+
+    def __getitem__(self, key):
+        return self.dset[key]
+
+    def __setitem__(self, key, value):
+        self.writes.append((key.start, key.stop))
+        self.dset[key] = value
+
+class TestBufferedDataset(TestCase):
+    def test_append(self):
+        layout = Layout((2, 3), np.dtype('uint8'), (2, 3), np.dtype('uint8'))
+        self.assertEqual(chunk_rows(layout, 10) % 10, 0)
+
+        f = h5py.File('buffered.hdf', 'w', driver='core', backing_store=False)
+        dset = create_dataset(f, 'xs', layout, {}, {'name' : 'test'}, 4)
+        self.assertEqual(dset.chunks[0] % 4, 0)
+
+        writer = BufferedDataset(dset, 2 * dset.chunks[0] + 1)
+        self.assertEqual(len(writer.buffer), 2 * dset.chunks[0])
+
+        blocks = [ np.full((size, 2, 3), size, dtype='uint8')
+                   for size in [1, 0, 3 * dset.chunks[0] + 5, 7] ]
+        for block in blocks:
+            writer.append(block)
+        writer.close()
+
+        data = np.concatenate(blocks)
+        self.assertEqual(dset.shape, data.shape)
+        self.assertTrue(np.array_equal(dset[:], data))
+        self.assertEqual(dset.attrs['name'], 'test')
+        f.close()
+
+    def test_checkpoints(self):
+        f = h5py.File('buffered.hdf', 'w', driver='core', backing_store=False)
+        rows = 4
+        dset = RecordingDataset(f.create_dataset('xs', (0, 2, 3), maxshape=(None, 2, 3),
+                                                 chunks=(rows, 2, 3), dtype='uint8'))
+
+        data = np.repeat(np.arange(5 * rows + 3, dtype='uint8'), 6).reshape((-1, 2, 3))
+        writer = BufferedDataset(dset, 2 * rows)
+        for start, end in [(0, 3), (3, rows + 5), (rows + 5, 3 * rows + 1)]:
+            writer.append(data[start:end])
+            writer.flush()
+            self.assertEqual(writer.size, end)
+            writer.flush()
+        # resumed, with the partial chunk in the dataset
+        dset.resize((writer.size,) + dset.shape[1:])
+        writer = BufferedDataset(dset, 2 * rows)
+        writer.append(data[3 * rows + 1:])
+        writer.close()
+
+        self.assertTrue(np.array_equal(dset[:], data))
+        # the writes start at the chunk boundaries,
+        # only the partial last chunk is written again
+        for start, end in dset.writes:
+            self.assertEqual(start % rows, 0)
+        starts = [ start for start, end in dset.writes ]
+        self.assertEqual(starts, [0, 0, 2 * rows, 2 * rows, 3 * rows, 5 * rows])
+        f.close()
+
+def square(x):
+    if x < 0:
+        raise ValueError("negative")
+    return x * x
+
+def sleep_steps(x):
+    time.sleep(0.05 * x)
+    return x
+
+class TestStreamingImap(TestCase):
+    def test_results(self):
+        pool = multiprocessing.Pool(2)
+        for window in [1, 3, 100]:
+            stats = SchedulerStats()
+            results = streaming_imap(pool, 2, square, iter(range(20)), window, stats)
+            self.assertEqual(sorted(results), [(x, x * x) for x in range(20)])
+            self.assertEqual(stats.tasks, 20)
+
+        stats = SchedulerStats()
+        results = streaming_imap(pool, 2, square, [1, -1, 2], 1, stats)
+        self.assertRaises(RuntimeError, list, results)
+        pool.close()
+        pool.join()
+
+    def test_not_starved(self):
+        # the tasks finish one by one, each result is replaced by a new task
+        # before the next one is done, so the window keeps both workers busy
+        pool = multiprocessing.Pool(2)
+        stats = SchedulerStats()
+        results = streaming_imap(pool, 2, sleep_steps, [1, 2, 3, 4], 2, stats)
+        self.assertEqual(sorted(x for x, _ in results), [1, 2, 3, 4])
+        self.assertEqual(stats.starved, 0)
+        pool.close()
+        pool.join()
+
+class TestProfile(TestCase):
+    def test_merge(self):
+        worker = Profile()
+        with worker.timed('cube'):
+            pass
+        worker.add('cube', 1.0)
+        worker.add('parse', 0.5)
+
+        master = Profile()
+        master.add('write', 2.0)
+        master.merge(worker.pop())
+        self.assertEqual(worker.times, {})
+        self.assertEqual(master.counts, {'cube' : 2, 'parse' : 1, 'write' : 1})
+        self.assertTrue(1.0 <= master.times['cube'] < 1.5)
+
+        lines = master.report().split('\n')
+        self.assertEqual([line.split()[0] for line in lines[1:]], ['write', 'cube', 'parse'])
+
+class TestJournal(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'test.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_resume(self):
+        journal = Journal(self.filename)
+        journal.add('a.sgf')
+        journal.add('b.sgf')
+        journal.checkpoint(10)
+        journal.add('c.sgf')
+        journal.close()
+        # interrupted while writing
+        with open(self.filename, 'a') as fout:
+            fout.write('#checkpoint 2')
+
+        self.assertEqual(Journal.read(self.filename), (set(['a.sgf', 'b.sgf']), 10))
+
+        journal = Journal(self.filename, resume=True)
+        self.assertEqual((journal.done, journal.size), (set(['a.sgf', 'b.sgf']), 10))
+        journal.add('c.sgf')
+        journal.checkpoint(15)
+        journal.close()
+        self.assertEqual(Journal.read(self.filename), (set(['a.sgf', 'b.sgf', 'c.sgf']), 15))
+
+        # without resume, the journal is started again
+        Journal(self.filename).close()
+        self.assertEqual(Journal.read(self.filename), (set(), 0))
+
+class TestResume(TestCase):
+    GAMES = ['test_sgf/test1.sgf', 'test_sgf/test2.sgf']
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_dataset(self, filename, *args):
+        proc = subprocess.Popen([sys.executable, 'make_dataset.py', '-p', 'clark_storkey_2014',
+                                 '--batch-size', '16', '--checkpoint-interval', '0',
+                                 '--proc', '1'] + list(args) + [filename],
+                                stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+        _, err = proc.communicate(''.join(game + '\n' for game in self.GAMES))
+        self.assertEqual(proc.returncode, 0, err)
+
+    def test_interrupted(self):
+        expected = os.path.join(self.tmpdir, 'expected.hdf')
+        self.make_dataset(expected)
+
+        filename = os.path.join(self.tmpdir, 'resumed.hdf')
+        self.make_dataset(filename)
+        # interrupted after the first game was committed, the examples
+        # of the second game were (partly) written
+        with open(filename + '.journal') as fin:
+            lines = fin.readlines()
+        last = lines.index(self.GAMES[0] + '\n') + 1
+        self.assertTrue(lines[last].startswith('#checkpoint '))
+        with open(filename + '.journal', 'w') as fout:
+            fout.writelines(lines[:last + 1])
+        size = Journal.read(filename + '.journal')[1]
+        self.assertTrue(0 < size < h5py.File(filename, 'r')['xs'].shape[0])
+
+        self.make_dataset(filename, '--resume')
+        with h5py.File(expected, 'r') as fexp:
+            with h5py.File(filename, 'r') as f:
+                self.assertEqual(sorted(f.keys()), sorted(fexp.keys()))
+                for key in fexp:
+                    self.assertTrue(np.array_equal(f[key][:], fexp[key][:]), key)
+
+class TestGameCache(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cache(self):
+        cache = GameCache(self.tmpdir, 'plane=a')
+        key = cache.key('(;SZ[19];B[aa])')
+        self.assertNotEqual(key, GameCache(self.tmpdir, 'plane=b').key('(;SZ[19];B[aa])'))
+        self.assertNotEqual(key, cache.key('(;SZ[19];B[bb])'))
+
+        self.assertEqual(cache.get(key), (False, None))
+        xs = np.arange(24, dtype='float32').reshape((2, 3, 4))
+        ys = np.array([[1], [2]], dtype='uint16')
+        cache.put(key, [xs, ys])
+        hit, (cxs, cys) = cache.get(key)
+        self.assertTrue(hit)
+        for a, b in [(xs, cxs), (ys, cys)]:
+            self.assertEqual(a.dtype, b.dtype)
+            self.assertTrue(np.array_equal(a, b))
+
+        skipped = cache.key('(;SZ[9])')
+        cache.put(skipped, None)
+        self.assertEqual(cache.get(skipped), (True, None))
+
+        # the oldest entry is removed first
+        os.utime(cache.path(key), (0, 0))
+        self.assertEqual(cache.evict(os.path.getsize(cache.path(skipped))), 1)
+        self.assertEqual(cache.get(key), (False, None))
+        self.assertEqual(cache.get(skipped), (True, None))
+        self.assertEqual(cache.evict(0), 1)
+
 
 if __name__ == '__main__':
     import unittest
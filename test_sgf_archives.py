@@ -0,0 +1,47 @@
+from unittest import TestCase
+import tempfile
+import shutil
+import os
+import tarfile
+import zipfile
+
+from deepgo.sgf_archives import iter_sgfs
+
+
+class TestSgfArchives(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = {}
+        for name in ['test1.sgf', 'test2.sgf']:
+            with open(os.path.join('test_sgf', name), 'r') as fin:
+                self.files['games/' + name] = fin.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check(self, filename):
+        self.assertEqual(dict(iter_sgfs(filename)),
+                         dict(('%s:%s'%(filename, name), data)
+                              for name, data in self.files.items()))
+
+    def test_tar(self):
+        for mode, suffix in [('w', '.tar'), ('w:gz', '.tgz'), ('w:bz2', '.tar.bz2')]:
+            filename = os.path.join(self.tmpdir, 'games' + suffix)
+            with tarfile.open(filename, mode) as tar:
+                for name in self.files:
+                    tar.add(os.path.join('test_sgf', os.path.basename(name)), name)
+                tar.add('README.md', 'games/README.md')
+            self.check(filename)
+
+    def test_zip(self):
+        filename = os.path.join(self.tmpdir, 'games.zip')
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for name, data in self.files.items():
+                zf.writestr(name, data)
+            zf.writestr('games/README.md', 'readme')
+        self.check(filename)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import sgf_index
+from deepgo.rank import parse_rank_specification
+
+
+FILES = ['test_sgf/correctness.sgf', 'test_sgf/test1.sgf', 'test_sgf/test2.sgf']
+
+
+class TestSgfIndex(TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = sgf_index.open_index(os.path.join(self.tmpdir, 'index.db'))
+        sgf_index.build(self.db, [ fn + '\n' for fn in FILES ], 1)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_query(self):
+        self.assertEqual(sgf_index.query(self.db), FILES)
+        self.assertEqual(sgf_index.query(self.db, boardsize=9), [])
+        self.assertEqual(sgf_index.query(self.db, rankspec=parse_rank_specification('-6..-5')),
+                         FILES[1:])
+        self.assertEqual(sgf_index.query(self.db, rankspec=parse_rank_specification('1..2,')),
+                         FILES[:1])
+        self.assertEqual(sgf_index.query(self.db, min_moves=230), FILES[1:2])
+        self.assertEqual(sgf_index.query(self.db, max_moves=230), FILES[::2])
+        self.assertEqual(sgf_index.query(self.db, result='W+'), FILES[2:])
+
+    def test_rebuild(self):
+        rows = list(self.db.execute('SELECT * FROM games ORDER BY path'))
+        sgf_index.build(self.db, [ fn + '\n' for fn in FILES ], 1)
+        self.assertEqual(list(self.db.execute('SELECT * FROM games ORDER BY path')), rows)
@@ -0,0 +1,74 @@
+from unittest import TestCase
+
+import numpy as np
+
+from deepgo import encoding, stream
+from deepgo.encoding import Layout
+from deepgo.symmetry import SymmetryTransform, NUM_SYMMETRIES
+from deepgo.stream import ShuffleBuffer
+
+
+GAMES = ['test_sgf/test1.sgf\n', 'test_sgf/test2.sgf\n']
+
+def pairs(xs, ys):
+    return set((x.tobytes(), y.tobytes()) for x, y in zip(xs, ys))
+
+class TestShuffleBuffer(TestCase):
+    def batches(self, buf, games, batch_size):
+        out = []
+        for game in games:
+            out.extend(buf.add([game, game * 10], batch_size))
+        out.extend(buf.drain(batch_size))
+        return out
+
+    def test_every_example_once(self):
+        layouts = [Layout((), np.dtype('int64'), (), np.dtype('int64'))] * 2
+        games = [ np.arange(start, start + size)
+                  for start, size in [(0, 7), (7, 30), (37, 2), (39, 25)] ]
+        for shuffle in [True, False]:
+            buf = ShuffleBuffer(16, layouts, np.random.RandomState(0), shuffle=shuffle)
+            out = self.batches(buf, games, 4)
+            self.assertEqual(len(out), 64 // 4)
+            for xs, ys in out:
+                self.assertEqual(len(xs), 4)
+                self.assertTrue(np.array_equal(xs * 10, ys))
+            xs = np.concatenate([ xs for xs, ys in out ])
+            self.assertEqual(sorted(xs), range(64))
+            self.assertEqual(list(xs) == range(64), not shuffle)
+
+class TestIterBatches(TestCase):
+    PLANE, LABEL = 'clark_storkey_2014_packed', 'simple_label'
+
+    def setUp(self):
+        encoding.init_subprocess([self.PLANE], [self.LABEL], (19,), None)
+        expected = [ encoding.process_game(game) for game in GAMES ]
+        self.xs, self.ys = [ np.concatenate(arrays) for arrays in zip(*expected) ]
+
+    def batches(self, **kwargs):
+        batches = list(stream.iter_batches(GAMES, self.PLANE, self.LABEL, 10,
+                                           rng=np.random.RandomState(0), **kwargs))
+        self.assertEqual(len(batches), len(self.xs) // 10)
+        X, y = [ np.concatenate(arrays) for arrays in zip(*batches) ]
+        self.assertEqual(X.shape[1:], self.xs.shape[1:])
+        self.assertEqual(y.dtype, self.ys.dtype)
+        return X, y
+
+    def test_same_as_make_dataset(self):
+        for proc in [1, 2]:
+            X, y = self.batches(shuffle_buffer=50, proc=proc)
+            # the positions stay with their labels
+            self.assertTrue(pairs(X, y) <= pairs(self.xs, self.ys))
+
+    def test_symmetries(self):
+        X, y = self.batches(shuffle_buffer=50, symmetries=True)
+        transforms = [ SymmetryTransform(self.PLANE, 19, self.xs.shape[1:], self.xs.shape[1:]),
+                       SymmetryTransform(self.LABEL, 19, (1,), (1,)) ]
+        transformed = set()
+        for k in xrange(NUM_SYMMETRIES):
+            transformed |= pairs(*[ t.apply(a, k) for t, a in zip(transforms, [self.xs, self.ys]) ])
+        self.assertTrue(pairs(X, y) <= transformed)
+        self.assertFalse(pairs(X, y) <= pairs(self.xs, self.ys))
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
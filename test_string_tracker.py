@@ -0,0 +1,70 @@
+from unittest import TestCase
+
+import gomill
+import gomill.boards, gomill.sgf, gomill.sgf_moves
+
+from deepgo import analyze_board
+from deepgo.string_tracker import StringTracker
+
+
+def canonical(string_lib):
+    """
+    String numbers are arbitrary, so compare strings as sets of stones.
+    """
+    strings = {}
+    for pt, si in string_lib.string.items():
+        strings.setdefault(si, set()).add(pt)
+
+    return (set((frozenset(stones), frozenset(string_lib.liberties[si]))
+                for si, stones in strings.items()),
+            string_lib.liberties_nb_count)
+
+
+def load_game(filename):
+    with open(filename, 'r') as fin:
+        game = gomill.sgf.Sgf_game.from_string(fin.read())
+    return gomill.sgf_moves.get_setup_and_moves(game)
+
+
+class TestStringTracker(TestCase):
+    def check_replay(self, board, moves):
+        tracker = StringTracker(board)
+        for colour, move in moves:
+            self.assertEqual(canonical(tracker.string_lib()),
+                             canonical(analyze_board.board2string_lib(board)))
+            if not move:
+                continue
+            row, col = move
+            self.assertEqual(board.play(row, col, colour),
+                             tracker.play(row, col, colour))
+
+        self.assertEqual(canonical(tracker.string_lib()),
+                         canonical(analyze_board.board2string_lib(board)))
+
+    def test_games(self):
+        for filename in ['test_sgf/test1.sgf', 'test_sgf/test2.sgf']:
+            self.check_replay(*load_game(filename))
+
+    def test_setup(self):
+        board, moves = load_game('test_sgf/correctness.sgf')
+        # suicides and captures from the correctness sgf
+        for vertex in 'A19 C19 T18 G18 E8 T4 Q12 K1'.split():
+            self.check_replay(board.copy(),
+                              [('w', gomill.common.move_from_vertex(vertex, board.side))])
+
+    def test_ko(self):
+        board = gomill.boards.Board(5)
+        moves = [('b', (1, 0)), ('w', (0, 2)),
+                 ('b', (0, 1)), ('w', (2, 2)),
+                 ('b', (2, 1)), ('w', (1, 3)),
+                 ('w', (1, 1)),
+                 # takes the ko
+                 ('b', (1, 2)),
+                 # self capture in the corner
+                 ('b', (3, 0)), ('b', (4, 1)), ('w', (4, 0))]
+        self.check_replay(board, moves)
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
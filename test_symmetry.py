@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+import numpy as np
+
+from deepgo import symmetry
+from deepgo.symmetry import SymmetryTransform, NUM_SYMMETRIES
+
+
+SIDE = 5
+
+def random_planes(num, planes, side=SIDE):
+    return np.random.randint(2, size=(num, planes, side, side)).astype('uint8')
+
+def one_hot(index, side=SIDE):
+    planes = np.zeros((len(index), 1, side, side), dtype='uint8')
+    planes.reshape((len(index), -1))[np.arange(len(index)), index] = 1
+    return planes
+
+class TestSymmetryTransform(TestCase):
+    def test_group(self):
+        a = random_planes(1, 1)[0, 0]
+        images = [ symmetry.transform_planes(a, k) for k in xrange(NUM_SYMMETRIES) ]
+        # all 8 different for a random board
+        self.assertEqual(len(set(image.tobytes() for image in images)), NUM_SYMMETRIES)
+        self.assertTrue(np.array_equal(images[0], a))
+        self.assertTrue(np.array_equal(images[1], np.rot90(a)))
+        self.assertTrue(np.array_equal(images[4], a.T))
+
+    def test_index_same_as_planes(self):
+        index = np.arange(SIDE * SIDE, dtype='uint16')
+        planes = SymmetryTransform('expanded_label', SIDE, (1, SIDE, SIDE), (1, SIDE, SIDE))
+        simple = SymmetryTransform('simple_label', SIDE, (1,), (1,))
+        for k in xrange(NUM_SYMMETRIES):
+            transformed = simple.apply(index.reshape((-1, 1)), k)
+            self.assertEqual(transformed.dtype, index.dtype)
+            self.assertTrue(np.array_equal(one_hot(transformed.ravel()),
+                                           planes.apply(one_hot(index), k)))
+
+    def test_index_float(self):
+        index = np.arange(SIDE * SIDE, dtype='uint16').reshape((-1, 1))
+        simple = SymmetryTransform('simple_label', SIDE, (1,), (1,))
+        for k in xrange(NUM_SYMMETRIES):
+            transformed = simple.apply(index.astype('float32'), k)
+            self.assertEqual(transformed.dtype, np.dtype('float32'))
+            self.assertTrue(np.array_equal(transformed, simple.apply(index, k)))
+
+    def test_packed_and_flattened(self):
+        xs = random_planes(10, 3)
+        packed = np.packbits(xs.reshape((10, -1)), axis=1)
+        plain = SymmetryTransform('some_cube', SIDE, (3, SIDE, SIDE), (3, SIDE, SIDE))
+        flat = SymmetryTransform('some_cube', SIDE, (3 * SIDE * SIDE,), (3, SIDE, SIDE))
+        bits = SymmetryTransform('clark_storkey_2014_packed', SIDE,
+                                 packed.shape[1:], packed.shape[1:])
+        for k in xrange(NUM_SYMMETRIES):
+            expected = plain.apply(xs, k)
+            self.assertTrue(np.array_equal(flat.apply(xs.reshape((10, -1)), k),
+                                           expected.reshape((10, -1))))
+            self.assertTrue(np.array_equal(bits.apply(packed, k),
+                                           np.packbits(expected.reshape((10, -1)), axis=1)))
+
+    def test_not_planes(self):
+        self.assertRaises(ValueError, SymmetryTransform, 'some_cube', SIDE, (10,), (10,))
+        ranks = SymmetryTransform('ranks_number', SIDE, (2,), (2,))
+        ys = np.arange(6).reshape((3, 2))
+        self.assertTrue(ranks.apply(ys, 3) is ys)
+
+    def test_random_symmetries(self):
+        rng = np.random.RandomState(1)
+        index = rng.randint(SIDE * SIDE, size=(100, 1))
+        planes = SymmetryTransform('expanded_label', SIDE, (1, SIDE, SIDE), (1, SIDE, SIDE))
+        simple = SymmetryTransform('simple_label', SIDE, (1,), (1,))
+        xs, ys = symmetry.random_symmetries([one_hot(index.ravel()), index], [planes, simple], rng)
+        # the positions and labels are transformed by the same symmetries
+        self.assertTrue(np.array_equal(xs, one_hot(ys.ravel())))
+        self.assertFalse(np.array_equal(ys, index))
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,42 @@
+from unittest import TestCase
+
+import numpy as np
+import gomill.boards
+from gomill.gtp_states import History_move
+
+from deepgo.utils import raw_history, HistoryTracker, ListTail
+
+
+class TestHistoryTracker(TestCase):
+    def test_same_as_raw_history(self):
+        board = gomill.boards.Board(5)
+        moves = [('b', (0, 0)), ('w', (1, 1)), ('b', (2, 2)), ('w', (0, 0)), ('b', (4, 3))]
+        history = []
+        tracker = HistoryTracker(board.side)
+        self.assertTrue(np.array_equal(tracker.raw_history(), raw_history(board, history)))
+        for colour, move in moves:
+            history.append(History_move(colour, move))
+            tracker.add(move)
+            a, b = tracker.raw_history(), raw_history(board, history)
+            self.assertEqual(a.dtype, b.dtype)
+            self.assertTrue(np.array_equal(a, b))
+
+class TestListTail(TestCase):
+    def test_view(self):
+        lst = range(10)
+        for start in [0, 3, 9, 10, 12]:
+            tail = ListTail(lst, start)
+            self.assertEqual(len(tail), len(lst[start:]))
+            self.assertEqual(bool(tail), bool(lst[start:]))
+            self.assertEqual(list(tail), lst[start:])
+            self.assertEqual(tail[:3], lst[start:][:3])
+            self.assertEqual(tail[1::2], lst[start:][1::2])
+            if lst[start:]:
+                self.assertEqual(tail[0], lst[start])
+                self.assertEqual(tail[-1], lst[-1])
+            self.assertRaises(IndexError, lambda : tail[len(tail)])
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()